@@ -0,0 +1,219 @@
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+from flask import Response, g, request
+from metrics import metrics
+
+LANES = ('emergency', 'chat', 'background')   # highest priority first
+
+DEFAULT_MAX_CONCURRENT = 32
+DEFAULT_EMERGENCY_RESERVED = 4     # slots only the emergency lane may use
+DEFAULT_QUEUE_LIMITS = {'emergency': None, 'chat': 256, 'background': 64}
+DEFAULT_MAX_WAIT = {'emergency': 30.0, 'chat': 5.0, 'background': 2.0}   # seconds
+DEFAULT_RETRY_AFTER = 2            # seconds, for shed requests
+
+# Never admission-controlled: long-lived streams and the scrape endpoint
+EXEMPT_PATHS = ('/api/alerts/stream', '/metrics')
+CHAT_PREFIX = '/api/chat'
+# Single-message endpoints whose emergencies may take the reserved slots;
+# batches (e.g. /api/chat/batch) never do
+EMERGENCY_PATHS = ('/api/chat', '/api/report')
+
+
+class _Lane:
+    __slots__ = ('name', 'priority', 'queue_limit', 'max_wait', 'waiting', 'active', 'admitted', 'shed')
+
+    def __init__(self, name: str, priority: int, queue_limit: Optional[int], max_wait: float):
+        self.name = name
+        self.priority = priority
+        self.queue_limit = queue_limit
+        self.max_wait = max_wait
+        self.waiting = deque()
+        self.active = 0
+        self.admitted = 0
+        self.shed = 0
+
+
+class AdmissionController:
+    """
+    Priority admission for request handling.
+
+    At most max_concurrent requests run at once per process. The last
+    emergency_reserved slots can only be taken by the emergency lane, so an
+    emergency is never stuck behind a full house of ordinary traffic.
+    Waiting requests are admitted strictly by lane priority, FIFO within a
+    lane. A lower lane is shed with 503 and Retry-After when its queue is at
+    queue_limit or a request waits longer than its max_wait.
+    """
+
+    def __init__(self, max_concurrent: int = DEFAULT_MAX_CONCURRENT,
+                 emergency_reserved: int = DEFAULT_EMERGENCY_RESERVED,
+                 queue_limits: Dict[str, Optional[int]] = None, max_wait: Dict[str, float] = None):
+        self.max_concurrent = max_concurrent
+        self.emergency_reserved = min(emergency_reserved, max_concurrent - 1)
+        queue_limits = dict(DEFAULT_QUEUE_LIMITS, **(queue_limits or {}))
+        max_wait = dict(DEFAULT_MAX_WAIT, **(max_wait or {}))
+        self.lanes = {name: _Lane(name, priority, queue_limits[name], max_wait[name])
+                      for priority, name in enumerate(LANES)}
+        self.active = 0
+        self._cond = threading.Condition()
+
+    def _capacity(self, lane: _Lane) -> int:
+        return self.max_concurrent if lane.priority == 0 else self.max_concurrent - self.emergency_reserved
+
+    def _admissible(self, lane: _Lane, ticket) -> bool:
+        if lane.waiting[0] is not ticket or self.active >= self._capacity(lane):
+            return False
+        return all(not other.waiting for other in self.lanes.values() if other.priority < lane.priority)
+
+    def acquire(self, lane_name: str) -> Optional[int]:
+        """
+        Wait for a slot in the lane. Returns the wait in nanoseconds, or
+        None if the request was shed.
+        """
+        lane = self.lanes[lane_name]
+        started = time.perf_counter_ns()
+        with self._cond:
+            if lane.queue_limit is not None and len(lane.waiting) >= lane.queue_limit:
+                lane.shed += 1
+                return None
+            ticket = object()
+            lane.waiting.append(ticket)
+            deadline = time.monotonic() + lane.max_wait
+            while not self._admissible(lane, ticket):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    lane.waiting.remove(ticket)
+                    lane.shed += 1
+                    self._cond.notify_all()
+                    return None
+                self._cond.wait(remaining)
+            lane.waiting.popleft()
+            lane.active += 1
+            lane.admitted += 1
+            self.active += 1
+            self._cond.notify_all()
+        return time.perf_counter_ns() - started
+
+    def release(self, lane_name: str):
+        with self._cond:
+            self.lanes[lane_name].active -= 1
+            self.active -= 1
+            self._cond.notify_all()
+
+    def render_metrics(self) -> List[str]:
+        """Prometheus lines for per-lane queue depth, in-flight and totals"""
+        with self._cond:
+            lanes = [(lane.name, len(lane.waiting), lane.active, lane.admitted, lane.shed)
+                     for lane in self.lanes.values()]
+        lines = []
+        for index, (name, kind, help_text) in enumerate((
+            ('admission_queue_depth', 'gauge', 'Requests waiting for a slot, by lane'),
+            ('admission_in_flight', 'gauge', 'Requests holding a slot, by lane'),
+            ('admission_admitted_total', 'counter', 'Requests admitted, by lane'),
+            ('admission_shed_total', 'counter', 'Requests rejected with 503, by lane')
+        ), start=1):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.extend(f'{name}{{lane="{lane[0]}"}} {lane[index]}' for lane in lanes)
+        return lines
+
+
+def _message_text(data) -> Optional[str]:
+    """The chat message or report description of a request body"""
+    if not isinstance(data, dict):
+        return None
+    for key in ('message', 'description'):
+        if isinstance(data.get(key), str):
+            return data[key]
+    return None
+
+
+class Admission:
+    """
+    Flask integration: classifies each API request into a lane before it
+    is handled and holds its slot until teardown. A single chat message or
+    hazard report (POST to one of EMERGENCY_PATHS) containing one of
+    ChatbotEngine.emergency_keywords goes to the emergency lane, other chat
+    traffic to 'chat', everything else under /api to 'background'. The
+    check is one keyword-index scan of one message.
+    """
+
+    def __init__(self):
+        self.controller: Optional[AdmissionController] = None
+        self.engine = None
+        self.retry_after = DEFAULT_RETRY_AFTER
+        self._options = ()
+
+    def init_app(self, app, engine=None):
+        """
+        Enable admission control if ADMISSION_ENABLED is set. Configured by
+        ADMISSION_MAX_CONCURRENT, ADMISSION_EMERGENCY_RESERVED,
+        ADMISSION_QUEUE_LIMITS and ADMISSION_MAX_WAIT (dicts keyed by lane)
+        and ADMISSION_RETRY_AFTER.
+        """
+        if not app.config.get('ADMISSION_ENABLED'):
+            return
+        config = app.config
+        self._options = (
+            config.get('ADMISSION_MAX_CONCURRENT', DEFAULT_MAX_CONCURRENT),
+            config.get('ADMISSION_EMERGENCY_RESERVED', DEFAULT_EMERGENCY_RESERVED),
+            config.get('ADMISSION_QUEUE_LIMITS'),
+            config.get('ADMISSION_MAX_WAIT')
+        )
+        self.controller = AdmissionController(*self._options)
+        self.retry_after = config.get('ADMISSION_RETRY_AFTER', DEFAULT_RETRY_AFTER)
+        if engine is None:
+            from chat_api import chatbot as engine
+        self.engine = engine
+        app.extensions['admission'] = self
+        metrics.add_collector(self.render_metrics)
+        app.before_request(self._admit)
+        app.teardown_request(self._release)
+
+    def classify(self) -> Optional[str]:
+        path = request.path
+        if path in EXEMPT_PATHS or not path.startswith('/api/'):
+            return None
+        if request.method != 'POST':
+            return 'background'
+        if path in EMERGENCY_PATHS:
+            text = _message_text(request.get_json(silent=True))
+            if text and self.engine.find_emergency_keywords(text):
+                return 'emergency'
+        return 'chat' if path.startswith(CHAT_PREFIX) else 'background'
+
+    def _admit(self):
+        lane = self.classify()
+        if lane is None:
+            return None
+        waited = self.controller.acquire(lane)
+        if waited is None:
+            body = json.dumps({'error': 'server busy, please retry', 'lane': lane})
+            return Response(body, status=503, mimetype='application/json',
+                            headers={'Retry-After': str(math.ceil(self.retry_after))})
+        g.admission_lane = lane
+        metrics.record_admission(lane, waited)
+        return None
+
+    def _release(self, exc=None):
+        lane = g.pop('admission_lane', None)
+        if lane is not None:
+            self.controller.release(lane)
+
+    def render_metrics(self) -> List[str]:
+        return self.controller.render_metrics() if self.controller is not None else []
+
+    def _after_fork(self):
+        """Each forked worker admits against its own slots and queues"""
+        if self.controller is not None:
+            self.controller = AdmissionController(*self._options)
+
+
+admission = Admission()
+os.register_at_fork(after_in_child=admission._after_fork)
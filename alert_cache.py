@@ -0,0 +1,108 @@
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from chatbot import EmergencyAlert
+
+# Upper bound on snapshot age. Commits made in this process invalidate the
+# snapshot immediately; this only bounds staleness from writes made by
+# other worker processes.
+DEFAULT_MAX_AGE = 30.0
+
+
+class AlertSnapshot:
+    """Immutable, pre-serialized view of the active alerts at one point in time"""
+
+    __slots__ = ('alerts', 'body', 'etag', 'version', 'built_at', 'valid_until')
+
+    def __init__(self, alerts: Tuple[dict, ...], version: int, valid_until: Optional[datetime]):
+        self.alerts = alerts
+        self.body = json.dumps({'alerts': list(alerts), 'count': len(alerts)}).encode('utf-8')
+        self.etag = hashlib.sha1(self.body).hexdigest()
+        self.version = version
+        self.built_at = time.monotonic()
+        self.valid_until = valid_until
+
+
+class ActiveAlertCache:
+    """
+    In-process cache of EmergencyAlert.get_active_alerts().
+
+    The snapshot is rebuilt when a committed transaction touched an
+    EmergencyAlert, when the earliest expires_at among the cached alerts
+    passes, or after max_age seconds. Readers always get a whole snapshot,
+    and only one thread rebuilds at a time.
+    """
+
+    def __init__(self, max_age: float = DEFAULT_MAX_AGE):
+        self.max_age = max_age
+        self._snapshot: Optional[AlertSnapshot] = None
+        self._version = 0
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[], None]] = []
+
+    def add_listener(self, callback: Callable[[], None]):
+        """Call callback (with no arguments) whenever the snapshot is invalidated"""
+        self._listeners.append(callback)
+
+    def invalidate(self):
+        """Drop the current snapshot; the next read rebuilds it"""
+        self._version += 1
+        for callback in self._listeners:
+            callback()
+
+    def _is_fresh(self, snapshot: Optional[AlertSnapshot]) -> bool:
+        if snapshot is None or snapshot.version != self._version:
+            return False
+        if time.monotonic() - snapshot.built_at >= self.max_age:
+            return False
+        return snapshot.valid_until is None or datetime.utcnow() < snapshot.valid_until
+
+    def get(self) -> AlertSnapshot:
+        """Return the current snapshot, rebuilding it if stale (needs an app context)"""
+        snapshot = self._snapshot
+        if self._is_fresh(snapshot):
+            return snapshot
+        with self._lock:
+            snapshot = self._snapshot
+            if self._is_fresh(snapshot):
+                return snapshot
+            version = self._version
+            alerts = EmergencyAlert.get_active_alerts()
+            expiries = [alert.expires_at for alert in alerts if alert.expires_at is not None]
+            snapshot = AlertSnapshot(
+                tuple(alert.to_dict() for alert in alerts),
+                version,
+                min(expiries) if expiries else None
+            )
+            self._snapshot = snapshot
+            return snapshot
+
+
+active_alerts = ActiveAlertCache()
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_alert_changes(session, flush_context):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, EmergencyAlert):
+            session.info['emergency_alerts_changed'] = True
+            return
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_on_commit(session):
+    # Invalidate only after commit so a concurrent rebuild cannot cache
+    # rows from a transaction that is not yet visible
+    if session.info.pop('emergency_alerts_changed', False):
+        active_alerts.invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_on_rollback(session):
+    session.info.pop('emergency_alerts_changed', None)
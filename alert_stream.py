@@ -0,0 +1,315 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from alert_cache import active_alerts
+from chatbot import ALERT_TYPES, SEVERITY_LEVELS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUFFER_SIZE = 1000     # events kept for Last-Event-ID resume
+DEFAULT_HEARTBEAT = 15.0       # seconds between keep-alive comments
+DEFAULT_POLL_INTERVAL = 30.0   # longest wait between snapshot checks
+STREAM_PATH = '/api/alerts/stream'
+
+
+class AlertEvent:
+    __slots__ = ('seq', 'id', 'type', 'alert_type', 'severity', 'payload')
+
+    def __init__(self, seq: int, event_id: str, event_type: str, alert: Dict):
+        self.seq = seq
+        self.id = event_id
+        self.type = event_type
+        self.alert_type = alert.get('alert_type')
+        self.severity = alert.get('severity')
+        self.payload = format_event(event_id, event_type, alert)
+
+
+def format_event(event_id: Optional[str], event_type: str, data) -> str:
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event_type}')
+    lines.append(f'data: {json.dumps(data)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+class AlertFilter:
+    """alert_type / severity filter parsed from comma-separated query values"""
+
+    def __init__(self, alert_types: Optional[List[str]] = None, severities: Optional[List[str]] = None):
+        self.alert_types = frozenset(alert_types) if alert_types else None
+        self.severities = frozenset(severities) if severities else None
+
+    @classmethod
+    def parse(cls, alert_type: Optional[str], severity: Optional[str]) -> 'AlertFilter':
+        alert_types = [value for value in (alert_type or '').split(',') if value]
+        severities = [value for value in (severity or '').split(',') if value]
+        invalid = [value for value in alert_types if value not in ALERT_TYPES]
+        invalid += [value for value in severities if value not in SEVERITY_LEVELS]
+        if invalid:
+            raise ValueError(f"invalid filter value(s): {', '.join(invalid)}")
+        return cls(alert_types, severities)
+
+    def matches(self, alert_type: Optional[str], severity: Optional[str]) -> bool:
+        return ((self.alert_types is None or alert_type in self.alert_types) and
+                (self.severities is None or severity in self.severities))
+
+
+class AlertBroadcaster:
+    """
+    Single publisher for alert changes.
+
+    One background thread diffs successive active-alert snapshots and turns
+    them into alert_created / alert_updated / alert_expired events in a
+    bounded ring buffer. It wakes when a commit invalidates the alert cache,
+    at the next expires_at boundary, or every poll_interval seconds (for
+    writes from other processes). Subscribers never touch the database;
+    they read from the buffer, so fan-out costs no query per connection.
+
+    Event ids are "<epoch>-<seq>"; a Last-Event-ID from another process
+    lifetime, or one older than the buffer, gets a fresh snapshot instead of
+    a replay.
+    """
+
+    def __init__(self, buffer_size: int = DEFAULT_BUFFER_SIZE, poll_interval: float = DEFAULT_POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self.epoch = format(int(time.time() * 1000), 'x')
+        self._events = deque(maxlen=buffer_size)
+        self._seq = 0
+        self._alerts: Dict[int, Dict] = {}
+        self._cond = threading.Condition()
+        self._wake = threading.Event()
+        self.ready = threading.Event()  # set once the first snapshot is loaded
+        self._loop_callbacks: List[Callable[[], None]] = []
+        self._thread: Optional[threading.Thread] = None
+        self._app = None
+        self._closed = False
+
+    @property
+    def last_seq(self) -> int:
+        return self._seq
+
+    def start(self, app, timeout: float = 5.0) -> bool:
+        """
+        Start the publisher thread for app (idempotent) and wait up to
+        timeout seconds for the first snapshot.
+        """
+        with self._cond:
+            if self._thread is None:
+                self._app = app
+                active_alerts.add_listener(self._wake.set)
+                self._thread = threading.Thread(target=self._run, name='alert-publisher', daemon=True)
+                self._thread.start()
+        return self.ready.wait(timeout)
+
+    def close(self):
+        """End every blocking stream() generator, so a graceful shutdown is not held up by subscribers"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def add_loop_callback(self, callback: Callable[[], None]):
+        """Register a thread-safe callback run after each publish (used by asyncio servers)"""
+        self._loop_callbacks.append(callback)
+
+    def _run(self):
+        while True:
+            try:
+                with self._app.app_context():
+                    snapshot = active_alerts.get()
+                self._publish(snapshot.alerts)
+                self.ready.set()
+                timeout = self.poll_interval
+                if snapshot.valid_until is not None:
+                    until_expiry = (snapshot.valid_until - datetime.utcnow()).total_seconds()
+                    timeout = max(0.05, min(timeout, until_expiry))
+            except Exception:
+                logger.exception('alert publisher failed to refresh snapshot')
+                timeout = self.poll_interval
+            self._wake.wait(timeout)
+            self._wake.clear()
+
+    def _publish(self, alerts):
+        current = {alert['id']: alert for alert in alerts}
+        changes: List[Tuple[str, Dict]] = []
+        for alert_id, alert in current.items():
+            previous = self._alerts.get(alert_id)
+            if previous is None:
+                changes.append(('alert_created', alert))
+            elif previous != alert:
+                changes.append(('alert_updated', alert))
+        for alert_id, alert in self._alerts.items():
+            if alert_id not in current:
+                changes.append(('alert_expired', alert))
+        if not changes:
+            return
+
+        with self._cond:
+            self._alerts = current
+            for event_type, alert in changes:
+                self._seq += 1
+                self._events.append(AlertEvent(self._seq, f'{self.epoch}-{self._seq}', event_type, alert))
+            self._cond.notify_all()
+        for callback in self._loop_callbacks:
+            callback()
+
+    def parse_last_event_id(self, last_event_id: Optional[str]) -> Optional[int]:
+        """Sequence to resume after, or None when a full snapshot is needed"""
+        if not last_event_id:
+            return None
+        epoch, _, seq = last_event_id.partition('-')
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        seq = int(seq)
+        with self._cond:
+            oldest = self._events[0].seq if self._events else self._seq + 1
+            if seq > self._seq or seq < oldest - 1:
+                return None
+        return seq
+
+    def snapshot_event(self, alert_filter: AlertFilter) -> Tuple[int, str]:
+        """(seq, payload) of a 'snapshot' event holding the matching active alerts"""
+        with self._cond:
+            seq = self._seq
+            alerts = [alert for alert in self._alerts.values()
+                      if alert_filter.matches(alert.get('alert_type'), alert.get('severity'))]
+        alerts.sort(key=lambda alert: alert.get('created_at') or '', reverse=True)
+        return seq, format_event(f'{self.epoch}-{seq}', 'snapshot', {'alerts': alerts})
+
+    def events_after(self, seq: int, alert_filter: AlertFilter) -> Tuple[int, List[str]]:
+        """Payloads of matching events newer than seq, and the new cursor"""
+        with self._cond:
+            events = [event for event in self._events if event.seq > seq]
+            latest = self._seq
+        return latest, [event.payload for event in events
+                        if alert_filter.matches(event.alert_type, event.severity)]
+
+    def wait(self, seq: int, timeout: float) -> bool:
+        """Block until an event newer than seq exists or the broadcaster is closed (for thread-per-client servers)"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._seq > seq or self._closed, timeout)
+
+    def stream(self, alert_filter: AlertFilter, last_event_id: Optional[str] = None,
+               heartbeat: float = DEFAULT_HEARTBEAT) -> Iterator[str]:
+        """Blocking SSE generator for WSGI responses; returns once close() is called"""
+        seq = self.parse_last_event_id(last_event_id)
+        if seq is None:
+            seq, payload = self.snapshot_event(alert_filter)
+            yield payload
+        while not self._closed:
+            if self.wait(seq, heartbeat):
+                if self._closed:
+                    return
+                seq, payloads = self.events_after(seq, alert_filter)
+                for payload in payloads:
+                    yield payload
+            else:
+                yield ': keep-alive\n\n'
+
+
+broadcaster = AlertBroadcaster()
+
+
+class AlertStreamServer:
+    """
+    asyncio SSE server for alert subscribers.
+
+    Every connection is a coroutine waiting on one shared asyncio.Condition,
+    so thousands of idle subscribers cost a few KB each and no threads. The
+    publisher thread wakes the loop through call_soon_threadsafe. Serves
+    only GET STREAM_PATH with the same query parameters and Last-Event-ID
+    handling as the Flask route.
+    """
+
+    def __init__(self, app, publisher: AlertBroadcaster = None, heartbeat: float = DEFAULT_HEARTBEAT):
+        self.app = app
+        self.publisher = publisher or broadcaster
+        self.heartbeat = heartbeat
+        self.subscribers = 0
+        self._cond: Optional[asyncio.Condition] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _notify_threadsafe(self):
+        self._loop.call_soon_threadsafe(lambda: asyncio.ensure_future(self._notify()))
+
+    async def _notify(self):
+        async with self._cond:
+            self._cond.notify_all()
+
+    async def _read_request(self, reader) -> Tuple[str, str, Dict[str, str]]:
+        head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout=10)
+        if len(head) > 16384:
+            raise ValueError('request header too large')
+        lines = head.decode('latin-1').split('\r\n')
+        method, target, _ = lines[0].split(' ', 2)
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(':')
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+        return method, target, headers
+
+    async def _handle(self, reader, writer):
+        try:
+            try:
+                method, target, headers = await self._read_request(reader)
+                url = urlsplit(target)
+                query = parse_qs(url.query)
+                if method != 'GET' or url.path != STREAM_PATH:
+                    writer.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                    return
+                alert_filter = AlertFilter.parse(query.get('alert_type', [None])[0], query.get('severity', [None])[0])
+            except ValueError as e:
+                body = json.dumps({'error': str(e)}).encode('utf-8')
+                writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Type: application/json\r\n'
+                             b'Content-Length: ' + str(len(body)).encode() + b'\r\nConnection: close\r\n\r\n' + body)
+                return
+
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n'
+                         b'Cache-Control: no-cache\r\nConnection: keep-alive\r\nX-Accel-Buffering: no\r\n\r\n')
+            self.subscribers += 1
+            try:
+                seq = self.publisher.parse_last_event_id(headers.get('last-event-id'))
+                if seq is None:
+                    seq, payload = self.publisher.snapshot_event(alert_filter)
+                    writer.write(payload.encode('utf-8'))
+                while True:
+                    await writer.drain()
+                    async with self._cond:
+                        try:
+                            await asyncio.wait_for(
+                                self._cond.wait_for(lambda: self.publisher.last_seq > seq), self.heartbeat
+                            )
+                        except asyncio.TimeoutError:
+                            writer.write(b': keep-alive\n\n')
+                            continue
+                    seq, payloads = self.publisher.events_after(seq, alert_filter)
+                    if payloads:
+                        writer.write(''.join(payloads).encode('utf-8'))
+            finally:
+                self.subscribers -= 1
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = '0.0.0.0', port: int = 5001):
+        self._loop = asyncio.get_running_loop()
+        self._cond = asyncio.Condition()
+        self.publisher.add_loop_callback(self._notify_threadsafe)
+        await self._loop.run_in_executor(None, self.publisher.start, self.app)
+        server = await asyncio.start_server(self._handle, host, port, backlog=4096)
+        async with server:
+            await server.serve_forever()
+
+
+def run_stream_server(app, host: str = '0.0.0.0', port: int = 5001):
+    """Run the alert stream server until interrupted"""
+    asyncio.run(AlertStreamServer(app).serve(host, port))
@@ -0,0 +1,43 @@
+from flask import Blueprint, Response, current_app, jsonify, request
+from alert_cache import active_alerts
+from alert_stream import AlertFilter, broadcaster
+
+alerts_api_bp = Blueprint('alerts_api', __name__)
+
+
+@alerts_api_bp.route('/alerts/active', methods=['GET'])
+def get_active_alerts():
+    """Active alerts from the cached snapshot, with ETag / If-None-Match support"""
+    snapshot = active_alerts.get()
+    if snapshot.etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = Response(snapshot.body, mimetype='application/json')
+    response.set_etag(snapshot.etag)
+    # Clients may keep the body but must revalidate; a 304 costs no DB access
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@alerts_api_bp.route('/alerts/stream', methods=['GET'])
+def stream_alerts():
+    """
+    Server-Sent Events stream of alert_created / alert_updated / alert_expired
+    events, optionally filtered by alert_type and severity (comma-separated).
+    Starts with a 'snapshot' event unless Last-Event-ID can be resumed.
+
+    Under a thread-per-request server each subscriber holds a thread; for
+    large subscriber counts run 'flask serve-alert-stream' and route this
+    path to it instead.
+    """
+    try:
+        alert_filter = AlertFilter.parse(request.args.get('alert_type'), request.args.get('severity'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    broadcaster.start(current_app._get_current_object())
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    response = Response(broadcaster.stream(alert_filter, last_event_id), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
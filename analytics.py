@@ -0,0 +1,279 @@
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import DateTime, event, func, inspect, insert, select, type_coerce
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from chatbot import db, ChatMessage, HazardReport, IntentRollup, HazardRollup
+from chat_archive import chat_archive
+
+CELL_PRECISION = 5              # geohash characters per rollup cell, about 4.9 x 4.9 km
+BUCKETS = ('hour', 'day', 'total')
+REPORT_GROUPS = ('category', 'status', 'cell')
+MAX_ROWS = 10000
+
+# Hour and day starts in SQLAlchemy's SQLite DateTime format, so buckets
+# computed in SQL equal the ones bound from Python
+_SQL_HOUR = '%Y-%m-%d %H:00:00.000000'
+_SQL_DAY = '%Y-%m-%d 00:00:00.000000'
+
+_MESSAGE_KEYS = ('bucket', 'intent')
+_REPORT_KEYS = ('bucket', 'category', 'status', 'cell')
+
+
+def hour_bucket(at: datetime) -> datetime:
+    return at.replace(minute=0, second=0, microsecond=0)
+
+
+def message_key(created_at: Optional[datetime], intent: Optional[str]) -> Optional[Tuple]:
+    if created_at is None:
+        return None
+    return hour_bucket(created_at), intent or ''
+
+
+def report_key(created_at: Optional[datetime], category: str, status: Optional[str],
+               geohash: Optional[str]) -> Optional[Tuple]:
+    if created_at is None:
+        return None
+    return hour_bucket(created_at), category, status or '', (geohash or '')[:CELL_PRECISION]
+
+
+# model -> (rollup, key columns, attributes the key is built from, key function)
+_TRACKED = {
+    ChatMessage: (IntentRollup, _MESSAGE_KEYS, ('created_at', 'intent'), message_key),
+    HazardReport: (HazardRollup, _REPORT_KEYS, ('created_at', 'category', 'status', 'geohash'), report_key)
+}
+
+
+def _upsert(connection, rollup, keys: Sequence[str], counts: Counter):
+    """Add counts (key tuple -> delta) to the rollup rows, creating missing ones"""
+    rows = [dict(zip(keys, key), count=delta) for key, delta in counts.items() if key is not None and delta]
+    if not rows:
+        return
+    table = rollup.__table__
+    statement = sqlite_insert(table)
+    statement = statement.on_conflict_do_update(
+        index_elements=list(keys), set_={'count': table.c.count + statement.excluded['count']}
+    )
+    connection.execute(statement, rows)
+
+
+def count_messages(rows: Iterable[Dict]):
+    """
+    Count chat_messages rows written with a Core insert. Call inside the
+    inserting transaction, before its commit; ORM inserts are counted by
+    the flush hook below.
+    """
+    counts = Counter(message_key(row['created_at'], row.get('intent')) for row in rows)
+    _upsert(db.session.connection(), IntentRollup, _MESSAGE_KEYS, counts)
+
+
+def count_reports(rows: Iterable[Dict]):
+    """Count hazard_reports rows written with a Core insert (see count_messages)"""
+    counts = Counter(report_key(row['created_at'], row['category'], row.get('status'), row.get('geohash'))
+                     for row in rows)
+    _upsert(db.session.connection(), HazardRollup, _REPORT_KEYS, counts)
+
+
+def _flushed_value(state, name: str):
+    """Attribute value as of the previous flush"""
+    history = state.attrs[name].history
+    if not history.has_changes():
+        return getattr(state.obj(), name)
+    return history.deleted[0] if history.deleted else None
+
+
+@event.listens_for(Session, 'after_flush')
+def _roll_up_flush(session, flush_context):
+    """
+    Apply the rollup deltas of the ORM changes just flushed, on the same
+    connection, so they commit or roll back with the rows themselves:
+    +1 for new rows, -1 for deleted rows, and a move from the old key to
+    the new one when a report's status, category, location or creation
+    time changes.
+    """
+    deltas = {model: Counter() for model in _TRACKED}
+    for obj in session.new:
+        tracked = _TRACKED.get(type(obj))
+        if tracked is not None:
+            deltas[type(obj)][tracked[3](*(getattr(obj, name) for name in tracked[2]))] += 1
+    for obj in session.dirty:
+        tracked = _TRACKED.get(type(obj))
+        if tracked is None:
+            continue
+        state = inspect(obj)
+        if any(state.attrs[name].history.has_changes() for name in tracked[2]):
+            deltas[type(obj)][tracked[3](*(_flushed_value(state, name) for name in tracked[2]))] -= 1
+            deltas[type(obj)][tracked[3](*(getattr(obj, name) for name in tracked[2]))] += 1
+    for obj in session.deleted:
+        tracked = _TRACKED.get(type(obj))
+        if tracked is not None:
+            state = inspect(obj)
+            deltas[type(obj)][tracked[3](*(_flushed_value(state, name) for name in tracked[2]))] -= 1
+
+    if any(deltas.values()):
+        connection = session.connection()
+        for model, counts in deltas.items():
+            rollup, keys = _TRACKED[model][:2]
+            _upsert(connection, rollup, keys, counts)
+
+
+def _load_previous(target, value, oldvalue, initiator):
+    """Registered only for active_history"""
+
+
+# Load the old value when an expired attribute is set, so the flush hook
+# knows which rollup row to take the report out of
+for _model, (_, _, _names, _) in _TRACKED.items():
+    for _name in _names:
+        event.listen(getattr(_model, _name), 'set', _load_previous, active_history=True)
+
+
+# -- rebuild ------------------------------------------------------------------
+
+def _archive_counts(archive, day: str) -> Counter:
+    return Counter(message_key(row.created_at, row.intent) for row in archive.read_partition(day))
+
+
+def rebuild(archive=None) -> Dict[str, int]:
+    """
+    Recompute both rollups from chat_messages, the chat archive and
+    hazard_reports, for repair or after a bulk change made behind the
+    ORM. Archived days are read first, without a lock; the rollups are
+    then replaced in one transaction whose GROUP BY scans hold the write
+    lock, so writes made meanwhile are neither lost nor counted twice.
+    Only archive days appended to in between are re-read under the lock.
+    Needs an app context. Returns the number of rollup rows written.
+    """
+    archive = archive or chat_archive
+    read = {day: (archive.partition(day)['bytes'], _archive_counts(archive, day)) for day in archive.days()}
+
+    messages = ChatMessage.__table__
+    reports = HazardReport.__table__
+    intent_rollups = IntentRollup.__table__
+    hazard_rollups = HazardRollup.__table__
+    try:
+        connection = db.session.connection()
+        # Deleting first takes the write lock before anything is counted
+        connection.execute(intent_rollups.delete())
+        connection.execute(hazard_rollups.delete())
+
+        bucket = func.strftime(_SQL_HOUR, messages.c.created_at)
+        intent = func.coalesce(messages.c.intent, '')
+        connection.execute(insert(intent_rollups).from_select(
+            ['bucket', 'intent', 'count'],
+            select(bucket, intent, func.count()).where(messages.c.created_at.isnot(None)).group_by(bucket, intent)
+        ))
+        archived = Counter()
+        for day in archive.days():
+            size = archive.partition(day)['bytes']
+            archived.update(read[day][1] if day in read and read[day][0] == size else _archive_counts(archive, day))
+        pending = archive.pending_ids()
+        if pending:
+            # Written to the archive but not yet deleted: already counted above
+            archived.subtract(message_key(row.created_at, row.intent) for row in connection.execute(
+                select(messages.c.created_at, messages.c.intent).where(messages.c.id.in_(pending))
+            ))
+        _upsert(connection, IntentRollup, _MESSAGE_KEYS, archived)
+
+        bucket = func.strftime(_SQL_HOUR, reports.c.created_at)
+        status = func.coalesce(reports.c.status, '')
+        cell = func.coalesce(func.substr(reports.c.geohash, 1, CELL_PRECISION), '')
+        connection.execute(insert(hazard_rollups).from_select(
+            ['bucket', 'category', 'status', 'cell', 'count'],
+            select(bucket, reports.c.category, status, cell, func.count())
+            .where(reports.c.created_at.isnot(None)).group_by(bucket, reports.c.category, status, cell)
+        ))
+
+        stats = {
+            'intent_rows': connection.execute(select(func.count()).select_from(intent_rollups)).scalar(),
+            'hazard_rows': connection.execute(select(func.count()).select_from(hazard_rollups)).scalar()
+        }
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return stats
+
+
+# -- queries ------------------------------------------------------------------
+
+def _utc(at: Optional[datetime]) -> Optional[datetime]:
+    if at is not None and at.tzinfo is not None:
+        at = at.astimezone(timezone.utc).replace(tzinfo=None)
+    return at
+
+
+def _select(table, bucket: str, groups: List, since: Optional[datetime], until: Optional[datetime]):
+    if bucket not in BUCKETS:
+        raise ValueError(f"bucket must be one of: {', '.join(BUCKETS)}")
+    columns = list(groups)
+    if bucket == 'hour':
+        columns.insert(0, table.c.bucket)
+    elif bucket == 'day':
+        columns.insert(0, type_coerce(func.strftime(_SQL_DAY, table.c.bucket), DateTime).label('bucket'))
+    total = func.sum(table.c.count)
+    query = select(*columns, total.label('count')).group_by(*columns).having(total != 0).order_by(*columns)
+    since, until = _utc(since), _utc(until)
+    if since is not None:
+        query = query.where(table.c.bucket >= hour_bucket(since))
+    if until is not None:
+        query = query.where(table.c.bucket < until)
+    return query
+
+
+def _json_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return None if value == '' else value
+
+
+def _result(query, limit: int) -> Dict:
+    rows = db.session.execute(query.limit(limit + 1)).mappings().fetchall()
+    result = [{key: _json_value(value) for key, value in row.items()} for row in rows[:limit]]
+    return {'rows': result, 'count': len(result), 'truncated': len(rows) > limit}
+
+
+def intent_counts(since: Optional[datetime] = None, until: Optional[datetime] = None, bucket: str = 'hour',
+                  intents: Sequence[str] = (), limit: int = MAX_ROWS) -> Dict:
+    """
+    Chat message counts per bucket and intent, from the rollup alone.
+    Whole hours: since is rounded down and until up to the hour.
+    """
+    table = IntentRollup.__table__
+    query = _select(table, bucket, [table.c.intent], since, until)
+    if intents:
+        query = query.where(table.c.intent.in_([intent or '' for intent in intents]))
+    return _result(query, limit)
+
+
+def report_counts(since: Optional[datetime] = None, until: Optional[datetime] = None, bucket: str = 'hour',
+                  group_by: Sequence[str] = ('category', 'status'), precision: int = CELL_PRECISION,
+                  categories: Sequence[str] = (), statuses: Sequence[str] = (), cell: Optional[str] = None,
+                  limit: int = MAX_ROWS) -> Dict:
+    """
+    Hazard report counts per bucket of creation time and the group_by
+    columns, by current status. Cells are geohash prefixes of precision
+    characters (at most CELL_PRECISION); cell restricts the counts to one
+    geohash prefix. Rounded to whole hours like intent_counts.
+    """
+    table = HazardRollup.__table__
+    unknown = set(group_by) - set(REPORT_GROUPS)
+    if unknown:
+        raise ValueError(f"group_by must be drawn from: {', '.join(REPORT_GROUPS)}")
+    if not 1 <= precision <= CELL_PRECISION:
+        raise ValueError(f'precision must be between 1 and {CELL_PRECISION}')
+    if cell and len(cell) > CELL_PRECISION:
+        raise ValueError(f'cell is limited to {CELL_PRECISION} geohash characters')
+
+    columns = {'category': table.c.category, 'status': table.c.status,
+               'cell': func.substr(table.c.cell, 1, precision).label('cell')}
+    query = _select(table, bucket, [columns[name] for name in REPORT_GROUPS if name in group_by], since, until)
+    if categories:
+        query = query.where(table.c.category.in_(categories))
+    if statuses:
+        query = query.where(table.c.status.in_([status or '' for status in statuses]))
+    if cell:
+        query = query.where(table.c.cell.startswith(cell.lower(), autoescape=True))
+    return _result(query, limit)
@@ -0,0 +1,84 @@
+import threading
+import time
+from typing import Callable, Dict, Tuple
+
+from flask import Blueprint, current_app, jsonify, request
+import analytics
+import pagination
+
+analytics_api_bp = Blueprint('analytics_api', __name__)
+
+DEFAULT_CACHE_TTL = 2.0         # seconds a result is shared between dashboard refreshes
+MAX_CACHE_ENTRIES = 256
+
+_cache: Dict[Tuple, Tuple[float, Dict]] = {}
+_cache_lock = threading.Lock()
+
+
+def _cached(compute: Callable[[], Dict]) -> Dict:
+    """
+    Result for the current path and query args, recomputed at most once
+    per ANALYTICS_CACHE_TTL seconds in this process, however many
+    dashboards are polling.
+    """
+    ttl = current_app.config.get('ANALYTICS_CACHE_TTL', DEFAULT_CACHE_TTL)
+    key = (request.path, tuple(sorted(request.args.items(multi=True))))
+    now = time.monotonic()
+    with _cache_lock:
+        hit = _cache.get(key)
+    if hit is not None and now - hit[0] < ttl:
+        return hit[1]
+    result = compute()
+    with _cache_lock:
+        if len(_cache) >= MAX_CACHE_ENTRIES:
+            for stale in [cached for cached, (at, _) in _cache.items() if now - at >= ttl]:
+                del _cache[stale]
+            if len(_cache) >= MAX_CACHE_ENTRIES:
+                _cache.clear()
+        _cache[key] = (now, result)
+    return result
+
+
+def _list_arg(name: str):
+    """Repeated or comma-separated values"""
+    return [value for values in request.args.getlist(name) for value in values.split(',') if value]
+
+
+@analytics_api_bp.route('/analytics/intents', methods=['GET'])
+def intent_counts():
+    """
+    Chat messages per time bucket and intent.
+    Query: since, until, bucket (hour|day|total, default hour), intent (repeatable).
+    """
+    try:
+        bounds = pagination.time_bounds(request.args)
+        bucket = request.args.get('bucket', 'hour')
+        intents = _list_arg('intent')
+        result = _cached(lambda: analytics.intent_counts(bucket=bucket, intents=intents, **bounds))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(result)
+
+
+@analytics_api_bp.route('/analytics/hazard-reports', methods=['GET'])
+def report_counts():
+    """
+    Hazard reports per time bucket of creation, by current status.
+    Query: since, until, bucket (hour|day|total), group_by (any of category,
+    status, cell; default category,status), precision (cell length, 1-5),
+    category, status (repeatable), cell (geohash prefix).
+    """
+    try:
+        bounds = pagination.time_bounds(request.args)
+        options = {
+            'bucket': request.args.get('bucket', 'hour'),
+            'group_by': _list_arg('group_by') or ('category', 'status'),
+            'precision': request.args.get('precision', analytics.CELL_PRECISION, type=int),
+            'categories': _list_arg('category'),
+            'statuses': _list_arg('status'),
+            'cell': request.args.get('cell') or None
+        }
+        result = _cached(lambda: analytics.report_counts(**options, **bounds))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(result)
@@ -0,0 +1,446 @@
+"""
+Benchmark suite for the chat pipeline and storage models.
+
+    python benchmark.py --output bench.json
+    python benchmark.py --only engine --messages 20000 --compare bench.json
+    python benchmark.py --only engine --model intents.ngm
+
+Every run is seeded, so the same arguments produce the same corpus and
+database. Results are written as JSON with throughput, p50/p99 latency and
+peak traced memory per benchmark; --compare reports regressions against a
+previous result file and exits non-zero when any exceed --threshold.
+
+Engine benchmarks run once per classifier backend: regex pattern scoring
+('engine.*') and the hashed n-gram model ('engine[ngram].*'), either the
+--model file or one trained on a corpus with a different seed. Their
+classify_intent results carry accuracy against the corpus labels.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Sequence
+
+from chatbot_engine import ChatbotEngine
+
+DEFAULT_SEED = 1234
+DEFAULT_MESSAGES = 5000
+
+# Share of each message kind in the corpus
+DEFAULT_MIX = {
+    'emergency': 0.15,
+    'hazard': 0.30,
+    'greeting': 0.10,
+    'information': 0.15,
+    'alerts': 0.10,
+    'noise': 0.15,
+    'adversarial': 0.05
+}
+
+_EMERGENCY = [
+    'someone is bleeding badly', 'there is a fire in my building', 'help my dad is having a heart attack',
+    'a man was shooting at cars', 'my friend took an overdose and is unconscious', 'car accident, people injured',
+    'urgent! robbery in progress', 'a child is choking', 'explosion near the plant', 'emergency someone got stabbed'
+]
+_HAZARD = [
+    'there is a huge pothole', 'a tree fell and is blocking the road', 'the traffic light is broken',
+    'flooding on the street again', 'debris all over the sidewalk', 'damaged bridge railing looks unsafe',
+    'a downed wire is sparking', 'I want to report a dangerous intersection', 'graffiti and vandalism in the park',
+    'sign knocked over, drivers confused'
+]
+_GREETING = ['hello', 'hi there', 'hey', 'good morning', 'good evening, can you help me', 'hi, I want to start']
+_INFORMATION = [
+    'what should I do to prepare for a tornado', 'how do I contact the police non emergency number',
+    'where can I find safety tips', 'what is the phone number for public works', 'how to prevent house fires'
+]
+_ALERTS = [
+    'any current weather alerts', 'show me active traffic warnings', 'is there a recent emergency update',
+    'latest news alerts for downtown', 'current notification about the storm'
+]
+_NOISE = [
+    'ok thanks', 'lol', 'what time is it', 'the quick brown fox', 'can you sing a song',
+    'I like turtles', 'asdfgh', 'yes', 'no', 'maybe later'
+]
+# Intent each corpus kind should be classified as
+CORPUS_INTENTS = {
+    'emergency': 'emergency',
+    'hazard': 'hazard_report',
+    'greeting': 'greeting',
+    'information': 'information',
+    'alerts': 'alerts',
+    'noise': 'fallback',
+    'adversarial': 'fallback'
+}
+
+_LOCATIONS = [
+    'at 123 N Meridian St', 'near the library', 'on Fall Creek Pkwy', 'near Broad Ripple and College',
+    'at 4500 W 38th Street', 'on East Washington Street', 'near the Circle Centre mall', 'at Monument Circle'
+]
+_FILLER = (
+    'the of and to in is was it for on with as at by this that from they we you he she but or an '
+    'are be been have has had not what all were when there can said which their if will up other '
+    'about out many then them these so some her would make like him into time has look two more'
+).split()
+
+
+def generate_corpus(count: int, seed: int = DEFAULT_SEED, mix: Optional[Dict[str, float]] = None) -> List[Dict]:
+    """
+    Deterministic synthetic corpus of {'kind', 'message'} items.
+    Adversarial items are long inputs built to stress the matchers: pasted
+    paragraphs with no keywords, runs of location trigger words, and
+    numbers followed by long word runs with no street suffix.
+    """
+    rng = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+    pools = {
+        'emergency': _EMERGENCY, 'hazard': _HAZARD, 'greeting': _GREETING,
+        'information': _INFORMATION, 'alerts': _ALERTS, 'noise': _NOISE
+    }
+
+    corpus = []
+    for _ in range(count):
+        kind = rng.choices(kinds, weights)[0]
+        if kind == 'adversarial':
+            style = rng.randrange(3)
+            words = rng.randint(200, 2000)
+            if style == 0:
+                message = ' '.join(rng.choice(_FILLER) for _ in range(words))
+            elif style == 1:
+                message = ' '.join(rng.choice(('near', 'at', 'on', 'the')) for _ in range(words))
+            else:
+                message = f'{rng.randint(1, 9999)} ' + ' '.join(rng.choice(_FILLER) for _ in range(words))
+        else:
+            message = rng.choice(pools[kind])
+            if kind in ('emergency', 'hazard') and rng.random() < 0.7:
+                message = f'{message} {rng.choice(_LOCATIONS)}'
+            if rng.random() < 0.3:
+                # Realistic length spread: pad with conversational filler
+                message += ' ' + ' '.join(rng.choice(_FILLER) for _ in range(rng.randint(5, 60)))
+            if rng.random() < 0.2:
+                message = message.capitalize() + rng.choice(('!', '?', '.', '!!'))
+        corpus.append({'kind': kind, 'message': message})
+    return corpus
+
+
+def _percentile(sorted_values: Sequence[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def measure(name: str, operation: Callable[[object], object], items: Sequence, warmup: int = 50,
+            batch: int = 1) -> Dict:
+    """
+    Time operation(item) for every item. batch is the number of logical
+    operations per call, used for throughput of batched APIs.
+    """
+    for item in items[:warmup]:
+        operation(item)
+
+    gc.collect()
+    gc.disable()
+    try:
+        latencies = []
+        cpu_started = time.process_time()
+        started = time.perf_counter()
+        for item in items:
+            t0 = time.perf_counter_ns()
+            operation(item)
+            latencies.append(time.perf_counter_ns() - t0)
+        elapsed = time.perf_counter() - started
+        cpu = time.process_time() - cpu_started
+    finally:
+        gc.enable()
+
+    # Separate pass for memory: tracemalloc would distort the timings above
+    sample = items[:max(1, min(len(items), 500))]
+    tracemalloc.start()
+    for item in sample:
+        operation(item)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies.sort()
+    operations = len(items) * batch
+    return {
+        'name': name,
+        'calls': len(items),
+        'operations': operations,
+        'total_s': round(elapsed, 6),
+        'throughput_per_s': round(operations / elapsed, 1) if elapsed else None,
+        'mean_us': round(statistics.fmean(latencies) / 1000, 2) if latencies else 0.0,
+        'cpu_us_per_op': round(cpu / operations * 1e6, 2) if operations else 0.0,
+        'p50_us': round(_percentile(latencies, 0.50) / 1000, 2),
+        'p99_us': round(_percentile(latencies, 0.99) / 1000, 2),
+        'max_us': round(latencies[-1] / 1000, 2) if latencies else 0.0,
+        'peak_mem_kb': round(peak / 1024, 1)
+    }
+
+
+def train_benchmark_model(count: int, seed: int):
+    """n-gram model trained on a corpus disjoint in seed from the measured one"""
+    from ngram_classifier import train
+    corpus = generate_corpus(count, seed)
+    return train([(item['message'], CORPUS_INTENTS[item['kind']]) for item in corpus], seed=seed)
+
+
+def _accuracy(engine: ChatbotEngine, corpus: List[Dict]) -> Dict:
+    correct = {}
+    totals = {}
+    for item in corpus:
+        kind = item['kind']
+        totals[kind] = totals.get(kind, 0) + 1
+        if engine.classify_intent(item['message'])[0] == CORPUS_INTENTS[kind]:
+            correct[kind] = correct.get(kind, 0) + 1
+    return {
+        'accuracy': round(sum(correct.values()) / len(corpus), 4) if corpus else None,
+        'accuracy_by_kind': {kind: round(correct.get(kind, 0) / total, 4) for kind, total in sorted(totals.items())}
+    }
+
+
+def run_engine_benchmarks(corpus: List[Dict], batch_size: int = 100, model_path: Optional[str] = None) -> List[Dict]:
+    """
+    Benchmark the regex engine and, if model_path is given, the engine
+    with that n-gram model ('engine[ngram].*' results).
+    """
+    messages = [item['message'] for item in corpus]
+    adversarial = [item['message'] for item in corpus if item['kind'] == 'adversarial']
+    batches = [messages[i:i + batch_size] for i in range(0, len(messages), batch_size)]
+
+    results = []
+    backends = [('engine', None)] + ([('engine[ngram]', model_path)] if model_path else [])
+    for prefix, classifier in backends:
+        engine = ChatbotEngine(classifier=classifier)
+        classified = [(message, engine.classify_intent(message)[0]) for message in messages]
+        classify = measure(f'{prefix}.classify_intent', engine.classify_intent, messages)
+        classify.update(_accuracy(engine, corpus))
+        results += [
+            measure(f'{prefix}.init', lambda _: ChatbotEngine(classifier=classifier), list(range(20)), warmup=2),
+            classify,
+            measure(f'{prefix}.extract_entities', lambda pair: engine.extract_entities(*pair), classified),
+            measure(f'{prefix}.process_message', engine.process_message, messages),
+            measure(f'{prefix}.process_message+json',
+                    lambda m: engine.response_json(engine.process_message(m)), messages),
+            measure(f'{prefix}.process_batch[{batch_size}]', engine.process_batch, batches, warmup=2,
+                    batch=batch_size)
+        ]
+        if adversarial:
+            results.append(measure(f'{prefix}.process_message.adversarial', engine.process_message, adversarial,
+                                   warmup=5))
+    return results
+
+
+def _populate(db, models, rng: random.Random, sessions: int, reports: int, messages: int, alerts: int):
+    """Fill an empty database with seeded rows using bulk inserts"""
+    from chatbot import HAZARD_CATEGORIES, ALERT_TYPES, SEVERITY_LEVELS
+    UserSession, HazardReport, EmergencyAlert, ChatMessage = models
+    now = datetime.utcnow()
+    session_ids = [f'bench-{i}' for i in range(sessions)]
+    db.session.add_all(UserSession(id=session_id, created_at=now, last_active=now) for session_id in session_ids)
+    db.session.commit()
+
+    for start in range(0, reports, 5000):
+        db.session.add_all(
+            HazardReport(
+                user_session_id=rng.choice(session_ids),
+                category=rng.choice(HAZARD_CATEGORIES),
+                description=rng.choice(_HAZARD),
+                location_lat=39.77 + rng.uniform(-0.2, 0.2),
+                location_lng=-86.16 + rng.uniform(-0.2, 0.2),
+                created_at=now - timedelta(minutes=rng.randint(0, 525600))
+            )
+            for _ in range(start, min(reports, start + 5000))
+        )
+        db.session.commit()
+
+    table = ChatMessage.__table__
+    for start in range(0, messages, 20000):
+        db.session.execute(table.insert(), [
+            {
+                'user_session_id': rng.choice(session_ids),
+                'message': rng.choice(_HAZARD + _EMERGENCY + _NOISE),
+                'response': 'ok',
+                'intent': rng.choice(('emergency', 'hazard_report', 'greeting', 'fallback')),
+                'created_at': now - timedelta(minutes=rng.randint(0, 525600))
+            }
+            for _ in range(start, min(messages, start + 20000))
+        ])
+        db.session.commit()
+
+    db.session.add_all(
+        EmergencyAlert(
+            title=f'Alert {i}', message='Bench alert', alert_type=rng.choice(ALERT_TYPES),
+            severity=rng.choice(SEVERITY_LEVELS), active=rng.random() < 0.5,
+            created_at=now - timedelta(minutes=rng.randint(0, 10000)),
+            expires_at=None if rng.random() < 0.3 else now + timedelta(minutes=rng.randint(-5000, 5000))
+        )
+        for i in range(alerts)
+    )
+    db.session.commit()
+    return session_ids
+
+
+def run_db_benchmarks(seed: int, sessions: int, reports: int, messages: int, alerts: int,
+                      operations: int = 1000) -> List[Dict]:
+    from flask import Flask
+    from chatbot import db, UserSession, HazardReport, EmergencyAlert, ChatMessage
+    import geo_index
+    from alert_cache import ActiveAlertCache
+
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as directory:
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+        app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        db.init_app(app)
+        with app.app_context():
+            db.create_all()
+            started = time.perf_counter()
+            session_ids = _populate(db, (UserSession, HazardReport, EmergencyAlert, ChatMessage),
+                                    rng, sessions, reports, messages, alerts)
+            populate_s = time.perf_counter() - started
+
+            def insert_report(_):
+                db.session.add(HazardReport(
+                    user_session_id=rng.choice(session_ids), category='road_traffic',
+                    description='bench pothole', location_lat=39.77 + rng.uniform(-0.2, 0.2),
+                    location_lng=-86.16 + rng.uniform(-0.2, 0.2)
+                ))
+                db.session.commit()
+
+            def insert_message(_):
+                db.session.add(ChatMessage(user_session_id=rng.choice(session_ids), message='hello',
+                                           response='hi', intent='greeting'))
+                db.session.commit()
+
+            def session_history(_):
+                return [message.to_dict() for message in
+                        ChatMessage.query.filter_by(user_session_id=rng.choice(session_ids)).all()]
+
+            def nearby(_):
+                return geo_index.nearest_reports(39.77 + rng.uniform(-0.1, 0.1), -86.16 + rng.uniform(-0.1, 0.1), 10)
+
+            cache = ActiveAlertCache()
+            items = list(range(operations))
+            results = [
+                measure('db.hazard_report.insert', insert_report, items, warmup=10),
+                measure('db.chat_message.insert', insert_message, items, warmup=10),
+                measure('db.chat_message.session_history', session_history, items, warmup=10),
+                measure('db.emergency_alert.get_active_alerts',
+                        lambda _: [alert.to_dict() for alert in EmergencyAlert.get_active_alerts()], items, warmup=10),
+                measure('db.emergency_alert.cached_snapshot', lambda _: cache.get().body, items, warmup=10),
+                measure('db.hazard_report.nearest_10', nearby, items, warmup=10)
+            ]
+            db.session.remove()
+        for result in results:
+            result['populate_s'] = round(populate_s, 3)
+    return results
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """Describe benchmarks whose p50, p99 or throughput regressed by more than threshold"""
+    previous = {result['name']: result for result in baseline.get('results', [])}
+    regressions = []
+    for result in current['results']:
+        before = previous.get(result['name'])
+        if not before:
+            continue
+        for key, higher_is_worse in (('p50_us', True), ('p99_us', True), ('throughput_per_s', False),
+                                     ('accuracy', False)):
+            old, new = before.get(key), result.get(key)
+            if not old or new is None:
+                continue
+            change = (new - old) / old if higher_is_worse else (old - new) / old
+            if change > threshold:
+                regressions.append(f"{result['name']}: {key} {old} -> {new} ({change:+.0%} worse)")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='SafeIndy AI chat pipeline and storage benchmarks')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--messages', type=int, default=DEFAULT_MESSAGES, help='corpus size for engine benchmarks')
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--sessions', type=int, default=1000)
+    parser.add_argument('--reports', type=int, default=50000)
+    parser.add_argument('--chat-messages', type=int, default=100000)
+    parser.add_argument('--alerts', type=int, default=200)
+    parser.add_argument('--db-operations', type=int, default=1000)
+    parser.add_argument('--only', choices=('engine', 'db'))
+    parser.add_argument('--model', help='n-gram model file to benchmark (default: train one on a '
+                                        'corpus seeded with --seed + 1)')
+    parser.add_argument('--no-ngram', action='store_true', help='benchmark only the regex classifier')
+    parser.add_argument('--output', help='write JSON results to this file (default: stdout)')
+    parser.add_argument('--compare', help='previous JSON results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10, help='allowed regression fraction')
+    args = parser.parse_args(argv)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat(),
+            'git_revision': _git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'seed': args.seed,
+            'messages': args.messages,
+            'sessions': args.sessions,
+            'reports': args.reports,
+            'chat_messages': args.chat_messages,
+            'alerts': args.alerts
+        },
+        'results': []
+    }
+    if args.only in (None, 'engine'):
+        corpus = generate_corpus(args.messages, args.seed)
+        with tempfile.TemporaryDirectory() as directory:
+            model_path = None
+            if not args.no_ngram:
+                model_path = args.model
+                if model_path is None:
+                    model_path = os.path.join(directory, 'bench.ngm')
+                    train_benchmark_model(args.messages, args.seed + 1).save(model_path)
+                report['meta']['ngram_model'] = args.model or f'trained on seed {args.seed + 1}'
+            report['results'].extend(run_engine_benchmarks(corpus, args.batch_size, model_path))
+    if args.only in (None, 'db'):
+        report['results'].extend(run_db_benchmarks(
+            args.seed, args.sessions, args.reports, args.chat_messages, args.alerts, args.db_operations
+        ))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        for line in regressions:
+            print(f'REGRESSION {line}', file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
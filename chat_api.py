@@ -0,0 +1,92 @@
+import json
+import logging
+from flask import Blueprint, Response, current_app, jsonify, request
+from chatbot_engine import ChatbotEngine
+from session_store import session_store
+from write_behind import log_chat_messages
+
+logger = logging.getLogger(__name__)
+
+chat_api_bp = Blueprint('chat_api', __name__)
+
+chatbot = ChatbotEngine()
+
+# Upper bound on messages per batch request, overridable via CHAT_BATCH_MAX_SIZE
+DEFAULT_BATCH_MAX_SIZE = 500
+
+
+@chat_api_bp.route('/chat/batch', methods=['POST'])
+def chat_batch():
+    """
+    Process a batch of chat messages in one request.
+
+    Body: {"messages": [{"message": str, "session_id": str?, "context": dict?} | str, ...]}
+    Returns results in input order; a bad item gets an "error" entry
+    instead of failing the whole batch.
+    """
+    data = request.get_json(silent=True) or {}
+    items = data.get('messages')
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'messages must be a non-empty list'}), 400
+
+    max_size = current_app.config.get('CHAT_BATCH_MAX_SIZE', DEFAULT_BATCH_MAX_SIZE)
+    if len(items) > max_size:
+        return jsonify({'error': f'batch size exceeds limit of {max_size}'}), 413
+
+    messages = []
+    contexts = []
+    session_ids = []
+    for item in items:
+        if isinstance(item, dict):
+            messages.append(item.get('message'))
+            contexts.append(item.get('context') if isinstance(item.get('context'), dict) else None)
+            session_ids.append(item.get('session_id'))
+        else:
+            messages.append(item)
+            contexts.append(None)
+            session_ids.append(None)
+
+    responses = chatbot.process_batch(messages, contexts)
+
+    # Answered items that belong to a session; blank and failed items are
+    # neither recorded nor logged
+    answered = [(session_id, message, response)
+                for session_id, message, response in zip(session_ids, messages, responses)
+                if isinstance(session_id, str) and session_id and 'error' not in response
+                and isinstance(message, str) and message.strip()]
+
+    # With the session cache running, record activity and the last intent
+    # per session without a query for sessions already cached
+    if session_store.running:
+        for session_id, _, response in answered:
+            try:
+                state = session_store.touch(session_id)
+            except Exception:
+                logger.exception('could not record activity for session %s', session_id)
+                continue
+            state.context['last_intent'] = response['intent']
+            state.context['turns'] = state.context.get('turns', 0) + 1
+
+    # Exchanges with a session go to chat history through the write-behind
+    # queue (a synchronous insert when it is not running). A logging failure
+    # is not allowed to cost the user their answers.
+    try:
+        log_chat_messages((session_id, message, response['message'], response['intent'])
+                          for session_id, message, response in answered)
+    except Exception:
+        logger.exception('could not log chat batch')
+
+    # Responses are serialized with the engine's cached fragments and
+    # spliced into the body rather than passed through jsonify
+    results = []
+    for session_id, message, response in zip(session_ids, messages, responses):
+        prefix = '{"session_id": ' + json.dumps(session_id)
+        if isinstance(message, str) and not message.strip():
+            results.append(prefix + ', "error": "Message is required"}')
+        elif 'error' in response:
+            results.append(prefix + ', "error": ' + json.dumps(response['error']) + '}')
+        else:
+            results.append(prefix + ', "response": ' + chatbot.response_json(response) + '}')
+
+    body = '{"results": [' + ', '.join(results) + '], "count": ' + str(len(results)) + '}'
+    return Response(body, mimetype='application/json')
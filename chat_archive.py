@@ -0,0 +1,372 @@
+import atexit
+import base64
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import select
+from chatbot import db, ChatMessage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RETENTION_DAYS = 90     # live chat history kept in the database
+DEFAULT_BATCH_SIZE = 1000       # rows moved per transaction
+DEFAULT_INTERVAL = 3600.0       # seconds between background passes
+DEFAULT_PAUSE = 0.05            # seconds between batches, so other writers get the lock
+INDEX_FILE = 'index.json'
+SESSION_FILTER_BYTES = 2048     # per-partition Bloom filter of session ids
+SESSION_FILTER_HASHES = 4
+
+MESSAGE_COLUMNS = tuple(column.name for column in ChatMessage.__table__.columns)
+ArchivedMessage = namedtuple('ArchivedMessage', MESSAGE_COLUMNS)
+
+
+def _partition_file(day: str) -> str:
+    return f'chat-messages-{day}.ndjson.gz'
+
+
+def _key(row) -> Tuple[datetime, int]:
+    return row.created_at, row.id
+
+
+def _filter_bits(value: str) -> List[int]:
+    digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+    first, step = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+    return [(first + i * step) % (SESSION_FILTER_BYTES * 8) for i in range(SESSION_FILTER_HASHES)]
+
+
+def _add_sessions(session_filter: str, session_ids) -> str:
+    bits = bytearray(base64.b64decode(session_filter))
+    for session_id in session_ids:
+        for bit in _filter_bits(session_id):
+            bits[bit >> 3] |= 1 << (bit & 7)
+    return base64.b64encode(bytes(bits)).decode('ascii')
+
+
+def _may_hold_session(session_filter: str, session_id: str) -> bool:
+    bits = base64.b64decode(session_filter)
+    return all(bits[bit >> 3] & (1 << (bit & 7)) for bit in _filter_bits(session_id))
+
+
+_EMPTY_SESSION_FILTER = base64.b64encode(bytes(SESSION_FILTER_BYTES)).decode('ascii')
+
+
+class ArchiveSource:
+    """
+    Archived messages matching one history query, in keyset order.
+    Plugged into pagination.keyset_page / iter_rows next to the live table.
+    """
+
+    def __init__(self, archive: 'ChatArchive', session_id: Optional[str] = None, intent: Optional[str] = None,
+                 since: Optional[datetime] = None, until: Optional[datetime] = None):
+        self.archive = archive
+        self.session_id = session_id
+        self.intent = intent
+        self.since = since
+        self.until = until
+
+    def newest_key(self) -> Optional[Tuple[datetime, int]]:
+        return self.archive.newest_key()
+
+    def _may_match(self, partition: Dict) -> bool:
+        """False when the partition's intent list or session filter rules it out (older partitions have neither)"""
+        if self.intent is not None and 'intents' in partition and self.intent not in partition['intents']:
+            return False
+        if self.session_id is not None and 'sessions' in partition and \
+                not _may_hold_session(partition['sessions'], self.session_id):
+            return False
+        return True
+
+    def _matches(self, row) -> bool:
+        return ((self.session_id is None or row.user_session_id == self.session_id) and
+                (self.intent is None or row.intent == self.intent) and
+                (self.since is None or row.created_at >= self.since) and
+                (self.until is None or row.created_at < self.until))
+
+    def rows(self, after: Optional[Tuple[datetime, int]], descending: bool) -> Iterator[ArchivedMessage]:
+        for day in self.archive.days(descending):
+            partition = self.archive.partition(day)
+            first = datetime.fromisoformat(partition['first_created_at'])
+            last = datetime.fromisoformat(partition['last_created_at'])
+            if (self.since is not None and last < self.since) or (self.until is not None and first >= self.until):
+                continue
+            if after is not None and ((descending and first > after[0]) or (not descending and last < after[0])):
+                continue
+            if not self._may_match(partition):
+                continue
+            rows = [row for row in self.archive.read_partition(day) if self._matches(row)]
+            rows.sort(key=_key, reverse=descending)
+            for row in rows:
+                if after is None or (_key(row) < after if descending else _key(row) > after):
+                    yield row
+
+
+class ChatArchive:
+    """
+    Retention for chat_messages.
+
+    Rows older than retention_days are moved, oldest first and batch_size
+    rows per transaction, into one gzip NDJSON file per UTC day. Each batch
+    is appended as a new gzip member, so files are only ever appended to.
+    index.json lists every partition with its row count and time range, and
+    the history API reads archived days through ArchiveSource. Each
+    partition also lists its intents and keeps a Bloom filter of its
+    session ids, so queries for one session or intent skip the days that
+    cannot hold it.
+
+    A batch is written and fsynced before its rows are deleted. The index
+    records the step in progress, so an interrupted batch is either rolled
+    back (file truncated) or completed (rows deleted) on the next run.
+    Only one process should run the archiver; any process may read.
+    """
+
+    def __init__(self, app=None, **options):
+        self.app = None
+        self.directory: Optional[str] = options.get('directory')
+        self.retention_days = options.get('retention_days', DEFAULT_RETENTION_DAYS)
+        self.batch_size = options.get('batch_size', DEFAULT_BATCH_SIZE)
+        self.interval = options.get('interval', DEFAULT_INTERVAL)
+        self.pause = options.get('pause', DEFAULT_PAUSE)
+        self._index: Dict = {'partitions': {}, 'pending': None}
+        self._index_mtime = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Configure from app.config (CHAT_ARCHIVE_DIR, CHAT_RETENTION_DAYS,
+        CHAT_ARCHIVE_BATCH_SIZE, CHAT_ARCHIVE_INTERVAL) and start the
+        background archiver if CHAT_ARCHIVE_ENABLED is set.
+        """
+        self.app = app
+        config = app.config
+        self.directory = config.get('CHAT_ARCHIVE_DIR') or self.directory or \
+            os.path.join(app.root_path, 'database', 'archive')
+        self.retention_days = config.get('CHAT_RETENTION_DAYS', self.retention_days)
+        self.batch_size = config.get('CHAT_ARCHIVE_BATCH_SIZE', self.batch_size)
+        self.interval = config.get('CHAT_ARCHIVE_INTERVAL', self.interval)
+        app.extensions['chat_archive'] = self
+        if config.get('CHAT_ARCHIVE_ENABLED'):
+            self.start()
+
+    # -- index -------------------------------------------------------------
+
+    def _index_path(self) -> str:
+        return os.path.join(self.directory, INDEX_FILE)
+
+    def _load_index(self) -> Dict:
+        """Current index, re-read when another process has rewritten it"""
+        try:
+            path = self._index_path()
+            mtime = os.stat(path).st_mtime_ns
+        except (OSError, TypeError):  # no index yet, or no directory configured
+            return self._index
+        if mtime != self._index_mtime:
+            with open(path, encoding='utf-8') as f:
+                self._index = json.load(f)
+            self._index_mtime = mtime
+        return self._index
+
+    def _save_index(self, partitions: Dict, pending: Optional[Dict]):
+        # Readers may hold the old dict, so the index is replaced, never mutated
+        self._index = {'partitions': partitions, 'pending': pending}
+        path = self._index_path()
+        temp = path + '.tmp'
+        with open(temp, 'w', encoding='utf-8') as f:
+            json.dump(self._index, f, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, path)
+        self._index_mtime = os.stat(path).st_mtime_ns
+
+    def days(self, descending: bool = False) -> List[str]:
+        return sorted(self._load_index()['partitions'], reverse=descending)
+
+    def partition(self, day: str) -> Dict:
+        return self._load_index()['partitions'][day]
+
+    def newest_key(self) -> Optional[Tuple[datetime, int]]:
+        partitions = self._load_index()['partitions']
+        if not partitions:
+            return None
+        newest = partitions[max(partitions)]
+        return datetime.fromisoformat(newest['last_created_at']), newest['last_id']
+
+    def pending_ids(self) -> List[int]:
+        """Ids of an archived batch that may not be deleted from chat_messages yet"""
+        pending = self._load_index().get('pending') or {}
+        return list(pending.get('ids') or ())
+
+    def read_partition(self, day: str) -> Iterator[ArchivedMessage]:
+        partition = self.partition(day)
+        # Read only the indexed bytes; a batch may be appending past them
+        with open(os.path.join(self.directory, partition['file']), 'rb') as raw:
+            compressed = raw.read(partition['bytes'])
+        with gzip.open(io.BytesIO(compressed), 'rt', encoding='utf-8') as f:
+            for line in f:
+                data = json.loads(line)
+                data['created_at'] = datetime.fromisoformat(data['created_at'])
+                yield ArchivedMessage(**data)
+
+    def source(self, **criteria) -> ArchiveSource:
+        return ArchiveSource(self, **criteria)
+
+    # -- archiving ---------------------------------------------------------
+
+    def _recover(self):
+        pending = self._index.get('pending')
+        if not pending:
+            return
+        if pending.get('ids'):
+            # Files and index were complete; only the delete may be missing
+            self._delete(pending['ids'])
+        else:
+            for name, size in pending.get('sizes', {}).items():
+                path = os.path.join(self.directory, name)
+                if size is None:
+                    if os.path.exists(path):
+                        os.remove(path)
+                elif os.path.exists(path):
+                    with open(path, 'r+b') as f:
+                        f.truncate(size)
+        self._save_index(self._index['partitions'], None)
+
+    def _delete(self, ids: List[int]):
+        table = ChatMessage.__table__
+        try:
+            db.session.execute(table.delete().where(table.c.id.in_(ids)))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    def _archive_batch(self, cutoff: datetime) -> int:
+        table = ChatMessage.__table__
+        rows = db.session.execute(
+            select(table).where(table.c.created_at < cutoff)
+            .order_by(table.c.created_at, table.c.id).limit(self.batch_size)
+        ).fetchall()
+        db.session.rollback()
+        if not rows:
+            return 0
+
+        by_day: Dict[str, List] = {}
+        for row in rows:
+            by_day.setdefault(row.created_at.date().isoformat(), []).append(row)
+        partitions = {day: dict(partition) for day, partition in self._index['partitions'].items()}
+
+        sizes = {}
+        for day in by_day:
+            path = os.path.join(self.directory, _partition_file(day))
+            sizes[_partition_file(day)] = os.path.getsize(path) if os.path.exists(path) else None
+        self._save_index(self._index['partitions'], {'sizes': sizes})
+
+        for day, day_rows in by_day.items():
+            name = _partition_file(day)
+            with open(os.path.join(self.directory, name), 'ab') as raw:
+                with gzip.GzipFile(fileobj=raw, mode='wb') as f:
+                    for row in day_rows:
+                        f.write((json.dumps(ChatMessage.serialize(row)) + '\n').encode('utf-8'))
+                raw.flush()
+                os.fsync(raw.fileno())
+
+            partition = partitions.setdefault(day, {
+                'file': name, 'count': 0,
+                'first_created_at': day_rows[0].created_at.isoformat(), 'first_id': day_rows[0].id,
+                'last_created_at': day_rows[0].created_at.isoformat(), 'last_id': day_rows[0].id,
+                'intents': [], 'sessions': _EMPTY_SESSION_FILTER
+            })
+            partition['count'] += len(day_rows)
+            if 'intents' in partition:
+                # Partitions written before these were tracked stay without them
+                intents = set(partition['intents']) | {row.intent for row in day_rows}
+                partition['intents'] = sorted(intents, key=lambda intent: intent or '')
+                partition['sessions'] = _add_sessions(partition['sessions'], {row.user_session_id for row in day_rows})
+            partition['bytes'] = os.path.getsize(os.path.join(self.directory, name))
+            first = min(day_rows, key=_key)
+            last = max(day_rows, key=_key)
+            if _key(first) < (datetime.fromisoformat(partition['first_created_at']), partition['first_id']):
+                partition['first_created_at'], partition['first_id'] = first.created_at.isoformat(), first.id
+            if _key(last) > (datetime.fromisoformat(partition['last_created_at']), partition['last_id']):
+                partition['last_created_at'], partition['last_id'] = last.created_at.isoformat(), last.id
+
+        ids = [row.id for row in rows]
+        self._save_index(partitions, {'ids': ids})
+        self._delete(ids)
+        self._save_index(partitions, None)
+        return len(rows)
+
+    def run_once(self, now: Optional[datetime] = None, max_batches: Optional[int] = None) -> int:
+        """
+        Archive every message older than the retention period, one short
+        transaction per batch. Needs an app context. Returns rows archived.
+        """
+        cutoff = (now or datetime.utcnow()) - timedelta(days=self.retention_days)
+        archived = 0
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            self._index_mtime = None
+            self._load_index()
+            self._recover()
+            batches = 0
+            while max_batches is None or batches < max_batches:
+                moved = self._archive_batch(cutoff)
+                if not moved:
+                    break
+                archived += moved
+                batches += 1
+                if self._stop.wait(self.pause):
+                    break
+        return archived
+
+    # -- background thread -------------------------------------------------
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='chat-archiver', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self, timeout: Optional[float] = None):
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with self.app.app_context():
+                    archived = self.run_once()
+                if archived:
+                    logger.info('archived %d chat messages', archived)
+            except Exception:
+                logger.exception('chat archiver pass failed')
+            self._stop.wait(self.interval)
+
+    def _after_fork(self):
+        """Archiving stays with the parent (e.g. the serve.py master); children only read"""
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+
+chat_archive = ChatArchive()
+os.register_at_fork(after_in_child=chat_archive._after_fork)
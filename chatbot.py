@@ -1,11 +1,15 @@
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import validates
+from sqlalchemy.orm.attributes import set_committed_value
 from datetime import datetime
 import json
-
-db = SQLAlchemy()
+from geohash import encode as encode_geohash
+from database import db
 
 class UserSession(db.Model):
     __tablename__ = 'user_sessions'
+    __table_args__ = (
+        db.Index('ix_user_sessions_created_at_id', 'created_at', 'id'),
+    )
     
     id = db.Column(db.String(50), primary_key=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -16,56 +20,94 @@ class UserSession(db.Model):
     hazard_reports = db.relationship('HazardReport', backref='user_session', lazy=True)
     chat_messages = db.relationship('ChatMessage', backref='user_session', lazy=True)
     
+    # Optional write-behind queue for activity updates (see write_behind.py)
+    activity_writer = None
+    
     def __repr__(self):
         return f'<UserSession {self.id}>'
     
     def to_dict(self):
+        return self.serialize(self)
+    
+    @staticmethod
+    def serialize(row):
+        """Dict for an instance or a Core row with the same columns"""
         return {
-            'id': self.id,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'last_active': self.last_active.isoformat() if self.last_active else None,
-            'preferences': json.loads(self.preferences) if self.preferences else {}
+            'id': row.id,
+            'created_at': row.created_at.isoformat() if row.created_at else None,
+            'last_active': row.last_active.isoformat() if row.last_active else None,
+            'preferences': json.loads(row.preferences) if row.preferences else {}
         }
     
     def update_activity(self):
-        self.last_active = datetime.utcnow()
-        db.session.commit()
+        now = datetime.utcnow()
+        writer = UserSession.activity_writer
+        if writer is not None and writer.touch_session(self.id, now):
+            # Written by the queue; update the loaded value without dirtying the row
+            set_committed_value(self, 'last_active', now)
+        else:
+            self.last_active = now
+            db.session.commit()
 
 class HazardReport(db.Model):
     __tablename__ = 'hazard_reports'
+    __table_args__ = (
+        db.Index('ix_hazard_reports_status_created_at', 'status', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
-    user_session_id = db.Column(db.String(50), db.ForeignKey('user_sessions.id'), nullable=False)
+    user_session_id = db.Column(db.String(50), db.ForeignKey('user_sessions.id'), nullable=False, index=True)
     category = db.Column(db.String(50), nullable=False)
     description = db.Column(db.Text, nullable=False)
-    location_lat = db.Column(db.Numeric(10, 8))
-    location_lng = db.Column(db.Numeric(11, 8))
+    location_lat = db.Column(db.Numeric(10, 8, asdecimal=False))
+    location_lng = db.Column(db.Numeric(11, 8, asdecimal=False))
+    geohash = db.Column(db.String(12), index=True)  # kept in sync with lat/lng
     address = db.Column(db.Text)
     image_url = db.Column(db.String(255))
     status = db.Column(db.String(20), default='submitted')
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    duplicate_of = db.Column(db.Integer, db.ForeignKey('hazard_reports.id'), index=True)  # see report_dedup.py
     
     def __repr__(self):
         return f'<HazardReport {self.id}: {self.category}>'
     
+    @validates('location_lat', 'location_lng')
+    def _update_geohash(self, key, value):
+        lat = value if key == 'location_lat' else self.location_lat
+        lng = value if key == 'location_lng' else self.location_lng
+        if lat is not None and lng is not None:
+            self.geohash = encode_geohash(float(lat), float(lng))
+        else:
+            self.geohash = None
+        return value
+    
     def to_dict(self):
+        return self.serialize(self)
+    
+    @staticmethod
+    def serialize(row):
+        """Dict for an instance or a Core row with the same columns"""
         return {
-            'id': self.id,
-            'user_session_id': self.user_session_id,
-            'category': self.category,
-            'description': self.description,
-            'location_lat': float(self.location_lat) if self.location_lat else None,
-            'location_lng': float(self.location_lng) if self.location_lng else None,
-            'address': self.address,
-            'image_url': self.image_url,
-            'status': self.status,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+            'id': row.id,
+            'user_session_id': row.user_session_id,
+            'category': row.category,
+            'description': row.description,
+            'location_lat': float(row.location_lat) if row.location_lat else None,
+            'location_lng': float(row.location_lng) if row.location_lng else None,
+            'address': row.address,
+            'image_url': row.image_url,
+            'status': row.status,
+            'duplicate_of': row.duplicate_of,
+            'created_at': row.created_at.isoformat() if row.created_at else None,
+            'updated_at': row.updated_at.isoformat() if row.updated_at else None
         }
 
 class EmergencyAlert(db.Model):
     __tablename__ = 'emergency_alerts'
+    __table_args__ = (
+        db.Index('ix_emergency_alerts_active_expires_at', 'active', 'expires_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(255), nullable=False)
@@ -103,27 +145,53 @@ class EmergencyAlert(db.Model):
 
 class ChatMessage(db.Model):
     __tablename__ = 'chat_messages'
+    __table_args__ = (
+        db.Index('ix_chat_messages_user_session_id_created_at', 'user_session_id', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_session_id = db.Column(db.String(50), db.ForeignKey('user_sessions.id'), nullable=False)
     message = db.Column(db.Text, nullable=False)
     response = db.Column(db.Text)
     intent = db.Column(db.String(50))
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     
     def __repr__(self):
         return f'<ChatMessage {self.id}: {self.intent}>'
     
     def to_dict(self):
+        return self.serialize(self)
+    
+    @staticmethod
+    def serialize(row):
+        """Dict for an instance or a Core row with the same columns"""
         return {
-            'id': self.id,
-            'user_session_id': self.user_session_id,
-            'message': self.message,
-            'response': self.response,
-            'intent': self.intent,
-            'created_at': self.created_at.isoformat() if self.created_at else None
+            'id': row.id,
+            'user_session_id': row.user_session_id,
+            'message': row.message,
+            'response': row.response,
+            'intent': row.intent,
+            'created_at': row.created_at.isoformat() if row.created_at else None
         }
 
+class IntentRollup(db.Model):
+    """Chat messages per hour and intent; maintained by analytics.py"""
+    __tablename__ = 'chat_intent_rollups'
+
+    bucket = db.Column(db.DateTime, primary_key=True)  # start of the UTC hour
+    intent = db.Column(db.String(50), primary_key=True)  # '' for messages without one
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class HazardRollup(db.Model):
+    """Hazard reports per creation hour, category, current status and geohash cell; see analytics.py"""
+    __tablename__ = 'hazard_report_rollups'
+
+    bucket = db.Column(db.DateTime, primary_key=True)  # start of the UTC hour
+    category = db.Column(db.String(50), primary_key=True)
+    status = db.Column(db.String(20), primary_key=True)  # '' for NULL
+    cell = db.Column(db.String(12), primary_key=True)  # geohash prefix, '' without a location
+    count = db.Column(db.Integer, nullable=False, default=0)
+
 # Predefined categories for hazard reports
 HAZARD_CATEGORIES = [
     'road_traffic',
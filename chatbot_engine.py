@@ -1,24 +1,264 @@
 import re
 import json
+import logging
+import time
 from datetime import datetime
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, List, Set, Tuple, Optional
+from keyword_index import KeywordIndex
+from location_extractor import Gazetteer, LocationExtractor
+from response_renderer import ResponseRenderer
+
+logger = logging.getLogger(__name__)
+
+CONFIG_SECTIONS = ('intents', 'responses', 'emergency_keywords', 'entity_types')
+
+
+class EngineSnapshot:
+    """
+    One compiled engine configuration: intent patterns and thresholds,
+    emergency keywords, entity patterns, the keyword index built from them
+    and the pre-rendered responses. Never modified once built; a new
+    configuration gets a new snapshot, which ChatbotEngine swaps in whole.
+    """
+    
+    __slots__ = ('version', 'intents', 'responses', 'emergency_keywords', 'entity_types',
+                 'keyword_index', 'renderer')
+    
+    def __init__(self, config: Dict):
+        self.version = config.get('version')
+        self.intents = config['intents']
+        self.responses = config['responses']
+        self.emergency_keywords = list(config['emergency_keywords'])
+        self.entity_types = config['entity_types']
+        self.keyword_index = self._build_keyword_index()
+        self.keyword_index.search('')  # compile the automaton now, not on the first message
+        self.renderer = ResponseRenderer(self.responses)
+    
+    def to_config(self) -> Dict:
+        """The configuration this snapshot was built from"""
+        config = {'version': self.version}
+        config.update((section, getattr(self, section)) for section in CONFIG_SECTIONS)
+        return config
+    
+    def _build_keyword_index(self) -> KeywordIndex:
+        """
+        Compile intent patterns, emergency keywords and entity patterns into
+        one keyword index so each message is scanned once.
+        """
+        index = KeywordIndex()
+        for intent, config in self.intents.items():
+            for i, pattern in enumerate(config['patterns']):
+                index.add_pattern(pattern, ('intent', intent, i))
+        for keyword in self.emergency_keywords:
+            index.add_keyword(keyword, ('emergency_keyword', keyword))
+        for intent, config in self.entity_types.items():
+            for etype, pattern in config['types'].items():
+                index.add_pattern(pattern, ('entity', intent, etype))
+        return index
+    
+    def scan_keywords(self, message: str) -> Set[Tuple]:
+        return self.keyword_index.search(message.lower())
+    
+    def classify_intent(self, hits: Set[Tuple]) -> Tuple[str, float]:
+        # Check for emergency keywords first (highest priority)
+        emergency_score = self._hit_score(hits, 'emergency')
+        if emergency_score >= self.intents['emergency']['confidence_threshold']:
+            return 'emergency', emergency_score
+        
+        # Check other intents
+        best_intent = 'fallback'
+        best_score = 0.0
+        
+        for intent, config in self.intents.items():
+            if intent == 'emergency':  # Already checked
+                continue
+                
+            score = self._hit_score(hits, intent)
+            if score >= config['confidence_threshold'] and score > best_score:
+                best_intent = intent
+                best_score = score
+        
+        return best_intent, best_score
+    
+    def _hit_score(self, hits: Set[Tuple], intent: str) -> float:
+        """Fraction of an intent's patterns present in the keyword hits"""
+        total_patterns = len(self.intents[intent]['patterns'])
+        total_matches = sum(1 for i in range(total_patterns) if ('intent', intent, i) in hits)
+        return total_matches / total_patterns if total_patterns > 0 else 0.0
+    
+    def find_emergency_keywords(self, hits: Set[Tuple]) -> List[str]:
+        return [keyword for keyword in self.emergency_keywords if ('emergency_keyword', keyword) in hits]
+    
+    def entity_type(self, hits: Set[Tuple], intent: str) -> Optional[Tuple[str, str]]:
+        """(entity name, type) for the first entity pattern of intent in the hits"""
+        entity_config = self.entity_types.get(intent)
+        if entity_config:
+            for etype in entity_config['types']:
+                if ('entity', intent, etype) in hits:
+                    return entity_config['entity'], etype
+        return None
+
+
+def validate_config(config: Dict):
+    """Raise ValueError if an engine configuration cannot be compiled"""
+    if not isinstance(config, dict):
+        raise ValueError('engine config must be an object')
+    intents = config['intents']
+    if not isinstance(intents, dict) or 'emergency' not in intents:
+        raise ValueError("intents must be an object with an 'emergency' intent")
+    for intent, intent_config in intents.items():
+        patterns = intent_config.get('patterns') if isinstance(intent_config, dict) else None
+        if not isinstance(patterns, list) or not all(isinstance(pattern, str) for pattern in patterns):
+            raise ValueError(f'intent {intent!r}: patterns must be a list of strings')
+        if not isinstance(intent_config.get('confidence_threshold'), (int, float)):
+            raise ValueError(f'intent {intent!r}: confidence_threshold must be a number')
+        for pattern in patterns:
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                raise ValueError(f'intent {intent!r}: bad pattern {pattern!r}: {e}')
+    responses = config['responses']
+    # The renderer looks these up unconditionally: fallback as a single
+    # response, emergency by priority variant
+    if not isinstance(responses, dict) or not isinstance(responses.get('fallback'), dict) \
+            or 'message' not in responses['fallback']:
+        raise ValueError("responses must have a 'fallback' response with a message")
+    emergency = responses.get('emergency')
+    if not isinstance(emergency, dict) or 'message' in emergency:
+        raise ValueError("responses must have an 'emergency' response with priority variants")
+    for variant in ('high_priority', 'medium_priority'):
+        if variant not in emergency:
+            raise ValueError(f"responses.emergency must have a {variant!r} variant")
+    for intent, response in responses.items():
+        variants = {None: response} if isinstance(response, dict) and 'message' in response else response
+        if not isinstance(variants, dict) or not all(
+                isinstance(variant, dict) and isinstance(variant.get('message'), str)
+                for variant in variants.values()):
+            raise ValueError(f'response {intent!r} needs a message string')
+    keywords = config['emergency_keywords']
+    if not isinstance(keywords, list) or not all(isinstance(keyword, str) and keyword for keyword in keywords):
+        raise ValueError('emergency_keywords must be a list of non-empty strings')
+    for intent, entity_config in config['entity_types'].items():
+        if not isinstance(entity_config, dict) or not isinstance(entity_config.get('types'), dict) \
+                or not isinstance(entity_config.get('entity'), str):
+            raise ValueError(f"entity_types {intent!r} needs 'entity' and 'types'")
+        for etype, pattern in entity_config['types'].items():
+            try:
+                re.compile(pattern)
+            except (re.error, TypeError) as e:
+                raise ValueError(f'entity type {intent}.{etype}: bad pattern {pattern!r}: {e}')
+
 
 class ChatbotEngine:
     """
     Core chatbot engine for SafeIndy AI public safety chatbot.
     Handles intent recognition, entity extraction, and response generation.
+    
+    Intents, thresholds, emergency keywords, entity patterns and responses
+    live in an EngineSnapshot. apply_config() compiles a new one and swaps
+    it in with a single assignment; each call into the engine reads the
+    snapshot once, so work in progress finishes on the snapshot it started
+    with and no locking is needed.
+    
+    Intent classification is regex pattern scoring unless a classifier is
+    given (see ngram_classifier.py). Its prediction is then used when it is
+    confident enough and names a configured intent; otherwise, and whenever
+    the patterns detect an emergency, the regex result stands.
     """
     
-    def __init__(self):
-        self.intents = self._load_intents()
-        self.responses = self._load_responses()
-        self.emergency_keywords = [
+    # Optional MetricsRegistry for stage timings and intent counters (see metrics.py)
+    metrics = None
+    
+    def __init__(self, gazetteer: Optional[Gazetteer] = None, config: Optional[Dict] = None,
+                 classifier=None):
+        """
+        classifier: None or 'regex' for pattern scoring only, the path of an
+        n-gram model file, or a loaded model with predict(messages).
+        """
+        self.location_extractor = LocationExtractor(gazetteer)
+        self.snapshot = self.compile_config(config)
+        self.classifier = self._load_classifier(classifier)
+    
+    @staticmethod
+    def _load_classifier(classifier):
+        if classifier is None or classifier == 'regex':
+            return None
+        if isinstance(classifier, str):
+            from ngram_classifier import NgramClassifier
+            return NgramClassifier.load(classifier)
+        return classifier
+    
+    def use_classifier(self, classifier):
+        """Switch classifier backend (same values as the constructor argument)"""
+        self.classifier = self._load_classifier(classifier)
+    
+    def default_config(self) -> Dict:
+        """The built-in configuration, in the format apply_config() accepts"""
+        return {
+            'version': None,
+            'intents': self._load_intents(),
+            'responses': self._load_responses(),
+            'emergency_keywords': self._load_emergency_keywords(),
+            'entity_types': self._load_entity_types()
+        }
+    
+    def compile_config(self, config: Optional[Dict] = None) -> EngineSnapshot:
+        """
+        Build a snapshot from config. Sections missing from config keep
+        their built-in defaults. Raises ValueError if config is invalid.
+        """
+        merged = self.default_config()
+        if config:
+            unknown = set(config) - set(CONFIG_SECTIONS) - {'version'}
+            if unknown:
+                raise ValueError(f'unknown engine config sections: {", ".join(sorted(unknown))}')
+            merged.update(config)
+        validate_config(merged)
+        return EngineSnapshot(merged)
+    
+    def apply_config(self, config: Dict) -> EngineSnapshot:
+        """Compile config and make it the live snapshot"""
+        snapshot = self.compile_config(config)
+        self.snapshot = snapshot
+        return snapshot
+    
+    @property
+    def config_version(self):
+        return self.snapshot.version
+    
+    @property
+    def intents(self) -> Dict:
+        return self.snapshot.intents
+    
+    @property
+    def responses(self) -> Dict:
+        return self.snapshot.responses
+    
+    @property
+    def emergency_keywords(self) -> List[str]:
+        return self.snapshot.emergency_keywords
+    
+    @property
+    def entity_types(self) -> Dict:
+        return self.snapshot.entity_types
+    
+    @property
+    def keyword_index(self) -> KeywordIndex:
+        return self.snapshot.keyword_index
+    
+    @property
+    def renderer(self) -> ResponseRenderer:
+        return self.snapshot.renderer
+    
+    def _load_emergency_keywords(self) -> List[str]:
+        """Keywords that mark a message as a possible emergency"""
+        return [
             'emergency', 'urgent', 'help', 'danger', 'fire', 'accident', 
             'injured', 'hurt', 'bleeding', 'unconscious', 'robbery', 
             'assault', 'shooting', 'stabbing', 'overdose', 'heart attack',
             'stroke', 'choking', 'drowning', 'trapped', 'explosion'
         ]
-        
+
     def _load_intents(self) -> Dict:
         """Load intent patterns and classifications"""
         return {
@@ -66,6 +306,33 @@ class ChatbotEngine:
             }
         }
     
+    def _load_entity_types(self) -> Dict:
+        """Load keyword patterns for intent-specific entities"""
+        return {
+            'emergency': {
+                'entity': 'emergency_type',
+                'types': {
+                    'medical': r'\b(heart attack|stroke|choking|overdose|injured|hurt|bleeding|unconscious)\b',
+                    'fire': r'\b(fire|smoke|burning|explosion)\b',
+                    'crime': r'\b(robbery|assault|shooting|stabbing|theft|break.?in)\b',
+                    'accident': r'\b(accident|crash|collision|vehicle)\b'
+                }
+            },
+            'hazard_report': {
+                'entity': 'hazard_category',
+                'types': {
+                    'road_traffic': r'\b(pothole|road|street|traffic|sign|light|intersection)\b',
+                    'infrastructure': r'\b(bridge|sidewalk|building|structure|utility|pipe|wire)\b',
+                    'environmental': r'\b(flooding|debris|tree|pollution|spill|waste)\b',
+                    'public_safety': r'\b(lighting|security|vandalism|graffiti|suspicious)\b'
+                }
+            }
+        }
+    
+    def scan_keywords(self, message: str) -> Set[Tuple]:
+        """Return every keyword-index hit for a message"""
+        return self.snapshot.scan_keywords(message)
+    
     def _load_responses(self) -> Dict:
         """Load response templates for different intents"""
         return {
@@ -134,145 +401,118 @@ class ChatbotEngine:
             }
         }
     
-    def classify_intent(self, message: str) -> Tuple[str, float]:
+    def classify_intent(self, message: str, hits: Set[Tuple] = None) -> Tuple[str, float]:
         """
         Classify the intent of a user message.
         Returns (intent, confidence_score)
         """
-        message_lower = message.lower()
-        
-        # Check for emergency keywords first (highest priority)
-        emergency_score = self._calculate_pattern_score(message_lower, self.intents['emergency']['patterns'])
-        if emergency_score >= self.intents['emergency']['confidence_threshold']:
-            return 'emergency', emergency_score
-        
-        # Check other intents
-        best_intent = 'fallback'
-        best_score = 0.0
-        
-        for intent, config in self.intents.items():
-            if intent == 'emergency':  # Already checked
-                continue
-                
-            score = self._calculate_pattern_score(message_lower, config['patterns'])
-            if score >= config['confidence_threshold'] and score > best_score:
-                best_intent = intent
-                best_score = score
-        
-        return best_intent, best_score
+        snapshot = self.snapshot
+        if hits is None:
+            hits = snapshot.scan_keywords(message)
+        return self._choose_intent(snapshot, hits, self._predict([message])[0])
     
-    def _calculate_pattern_score(self, message: str, patterns: List[str]) -> float:
-        """Calculate confidence score based on pattern matching"""
-        total_matches = 0
-        total_patterns = len(patterns)
-        
-        for pattern in patterns:
-            if re.search(pattern, message, re.IGNORECASE):
-                total_matches += 1
-        
-        return total_matches / total_patterns if total_patterns > 0 else 0.0
+    def _predict(self, messages: List[str]) -> List[Optional[Tuple[str, float]]]:
+        """Classifier predictions that clear its min_confidence, else None"""
+        classifier = self.classifier
+        if classifier is None:
+            return [None] * len(messages)
+        try:
+            predictions = classifier.predict(messages)
+        except Exception:
+            logger.exception('intent classifier failed; using pattern scoring')
+            return [None] * len(messages)
+        return [prediction if prediction[1] >= classifier.min_confidence else None
+                for prediction in predictions]
+    
+    @staticmethod
+    def _choose_intent(snapshot: EngineSnapshot, hits: Set[Tuple],
+                       prediction: Optional[Tuple[str, float]]) -> Tuple[str, float]:
+        intent, confidence = snapshot.classify_intent(hits)
+        if prediction is None or intent == 'emergency':
+            return intent, confidence
+        if prediction[0] != 'fallback' and prediction[0] not in snapshot.intents:
+            return intent, confidence
+        return prediction
     
-    def extract_entities(self, message: str, intent: str) -> Dict:
+    def find_emergency_keywords(self, message: str, hits: Set[Tuple] = None) -> List[str]:
+        """Return the emergency keywords present in a message"""
+        snapshot = self.snapshot
+        if hits is None:
+            hits = snapshot.scan_keywords(message)
+        return snapshot.find_emergency_keywords(hits)
+    
+    def extract_entities(self, message: str, intent: str, hits: Set[Tuple] = None,
+                         snapshot: EngineSnapshot = None) -> Dict:
         """Extract relevant entities from the message based on intent"""
         entities = {}
-        message_lower = message.lower()
-        
-        if intent == 'emergency':
-            # Extract emergency type
-            emergency_types = {
-                'medical': r'\b(heart attack|stroke|choking|overdose|injured|hurt|bleeding|unconscious)\b',
-                'fire': r'\b(fire|smoke|burning|explosion)\b',
-                'crime': r'\b(robbery|assault|shooting|stabbing|theft|break.?in)\b',
-                'accident': r'\b(accident|crash|collision|vehicle)\b'
-            }
-            
-            for etype, pattern in emergency_types.items():
-                if re.search(pattern, message_lower):
-                    entities['emergency_type'] = etype
-                    break
+        snapshot = snapshot or self.snapshot
         
-        elif intent == 'hazard_report':
-            # Extract hazard category
-            hazard_types = {
-                'road_traffic': r'\b(pothole|road|street|traffic|sign|light|intersection)\b',
-                'infrastructure': r'\b(bridge|sidewalk|building|structure|utility|pipe|wire)\b',
-                'environmental': r'\b(flooding|debris|tree|pollution|spill|waste)\b',
-                'public_safety': r'\b(lighting|security|vandalism|graffiti|suspicious)\b'
-            }
-            
-            for htype, pattern in hazard_types.items():
-                if re.search(pattern, message_lower):
-                    entities['hazard_category'] = htype
-                    break
+        # Extract emergency type / hazard category
+        if intent in snapshot.entity_types:
+            if hits is None:
+                hits = snapshot.scan_keywords(message)
+            found = snapshot.entity_type(hits, intent)
+            if found:
+                entities[found[0]] = found[1]
         
         # Extract location information
-        location_patterns = [
-            r'\b(\d+)\s+([A-Za-z\s]+(?:street|st|avenue|ave|road|rd|boulevard|blvd|drive|dr|lane|ln|way|circle|cir|court|ct))\b',
-            r'\bnear\s+([A-Za-z\s]+)\b',
-            r'\bat\s+([A-Za-z\s]+)\b',
-            r'\bon\s+([A-Za-z\s]+(?:street|st|avenue|ave|road|rd))\b'
-        ]
-        
-        for pattern in location_patterns:
-            match = re.search(pattern, message, re.IGNORECASE)
-            if match:
-                entities['location'] = match.group(0)
-                break
+        location = self.location_extractor.extract(message)
+        if location:
+            entities['location'] = location
         
         return entities
     
-    def generate_response(self, intent: str, entities: Dict, context: Dict = None) -> Dict:
-        """Generate appropriate response based on intent and entities"""
-        
-        if intent == 'emergency':
-            # Determine emergency priority
-            emergency_type = entities.get('emergency_type')
-            if emergency_type in ['medical', 'fire', 'crime']:
-                response_data = self.responses['emergency']['high_priority']
-            else:
-                response_data = self.responses['emergency']['medium_priority']
-        else:
-            response_data = self.responses.get(intent, self.responses['fallback'])
-        
-        # Customize response based on entities
-        message = response_data['message']
-        quick_actions = response_data.get('quick_actions', [])
-        
-        # Add context-specific information
-        if entities.get('location'):
-            message += f"\n\n📍 **Location detected**: {entities['location']}"
-        
-        if entities.get('hazard_category'):
-            category_names = {
-                'road_traffic': 'Road/Traffic Hazard',
-                'infrastructure': 'Infrastructure Issue',
-                'environmental': 'Environmental Concern',
-                'public_safety': 'Public Safety Issue'
-            }
-            category_name = category_names.get(entities['hazard_category'], 'General Hazard')
-            message += f"\n\n📋 **Category**: {category_name}"
-        
-        return {
-            'message': message,
-            'quick_actions': quick_actions,
-            'intent': intent,
-            'entities': entities,
-            'timestamp': datetime.utcnow().isoformat()
-        }
+    def normalize_location(self, location: str) -> str:
+        """Canonical form of a location or address, for comparing reports"""
+        return self.location_extractor.normalize(location)
+    
+    def generate_response(self, intent: str, entities: Dict, context: Dict = None,
+                          snapshot: EngineSnapshot = None) -> Dict:
+        """
+        Generate appropriate response based on intent and entities.
+        Static text and quick actions come from precomputed templates; the
+        quick_actions returned are shared and read-only, and entities is a
+        read-only copy.
+        """
+        return (snapshot or self.snapshot).renderer.render(intent, entities)
+    
+    def response_json(self, response: Dict) -> str:
+        """
+        Serialize a response using the renderer's cached JSON fragments.
+        A response rendered by an older snapshot serializes the same way,
+        just without the cached fragments.
+        """
+        return self.snapshot.renderer.dumps(response)
     
     def process_message(self, message: str, context: Dict = None) -> Dict:
         """
         Main method to process a user message and generate response.
         Returns complete response with intent, entities, and generated message.
         """
+        metrics = self.metrics
+        timed = metrics is not None and metrics.sampled()
+        if timed:
+            started = time.perf_counter_ns()
+        
+        snapshot = self.snapshot
+        hits = snapshot.scan_keywords(message)
+        
         # Classify intent
-        intent, confidence = self.classify_intent(message)
+        intent, confidence = self._choose_intent(snapshot, hits, self._predict([message])[0])
+        if timed:
+            classified = time.perf_counter_ns()
         
         # Extract entities
-        entities = self.extract_entities(message, intent)
+        entities = self.extract_entities(message, intent, hits, snapshot)
+        if timed:
+            extracted = time.perf_counter_ns()
         
         # Generate response
-        response = self.generate_response(intent, entities, context)
+        response = self.generate_response(intent, entities, context, snapshot)
+        if timed:
+            metrics.record_stages(started, classified, extracted, time.perf_counter_ns())
+        if metrics is not None:
+            metrics.count_intent(intent, confidence)
         
         # Add metadata
         response.update({
@@ -282,6 +522,67 @@ class ChatbotEngine:
         
         return response
     
+    def process_batch(self, messages: List[str], contexts: List[Dict] = None) -> List[Dict]:
+        """
+        Process several messages at once.
+        Returns one result per message, in input order, each shaped like the
+        output of process_message. Identical messages are classified and
+        rendered once. A failing item gets {'error', 'original_message'} in
+        its slot without affecting the rest of the batch.
+        """
+        if contexts is None:
+            contexts = [None] * len(messages)
+        elif len(contexts) != len(messages):
+            raise ValueError('contexts must have the same length as messages')
+        
+        snapshot = self.snapshot
+        # One batched classifier call for every distinct message
+        distinct = []
+        if self.classifier is not None:
+            distinct = list(dict.fromkeys(message for message in messages if isinstance(message, str)))
+        predictions = dict(zip(distinct, self._predict(distinct)))
+        analyses = {}  # message -> (intent, confidence, entities)
+        rendered = {}  # message -> response, reused when no context is given
+        results = []
+        
+        for message, context in zip(messages, contexts):
+            try:
+                if not isinstance(message, str):
+                    raise TypeError('message must be a string')
+                
+                if not context and message in rendered:
+                    response = rendered[message]
+                else:
+                    analysis = analyses.get(message)
+                    if analysis is None:
+                        hits = snapshot.scan_keywords(message)
+                        intent, confidence = self._choose_intent(snapshot, hits, predictions.get(message))
+                        entities = self.extract_entities(message, intent, hits, snapshot)
+                        analysis = analyses[message] = (intent, confidence, entities)
+                    intent, confidence, entities = analysis
+                    
+                    response = self.generate_response(intent, dict(entities), context, snapshot)
+                    response.update({
+                        'confidence': confidence,
+                        'original_message': message
+                    })
+                    if not context:
+                        rendered[message] = response
+                
+                if self.metrics is not None:
+                    self.metrics.count_intent(response['intent'], response['confidence'])
+                
+                # Each item owns its dict even when the work was shared;
+                # entities stay the read-only FrozenDict process_message returns
+                results.append(dict(response))
+            except Exception as e:
+                results.append({
+                    'error': str(e),
+                    'original_message': message
+                })
+        
+        return results
+    
     def get_safety_tips(self, category: str = 'general') -> Dict:
         """Get safety tips for specific categories"""
         tips = {
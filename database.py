@@ -0,0 +1,64 @@
+import os
+import sqlite3
+
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Shared SQLAlchemy instance for every model module
+db = SQLAlchemy()
+
+# Applied to every new SQLite connection. WAL lets readers run alongside
+# the single writer; synchronous=NORMAL is durable across application
+# crashes in WAL mode and skips an fsync per commit; busy_timeout makes
+# writers wait for the lock instead of failing with "database is locked".
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,          # ms
+    'cache_size': -65536,          # KiB (64 MiB page cache per connection)
+    'temp_store': 'MEMORY',
+    'mmap_size': 268435456,        # bytes
+    'wal_autocheckpoint': 1000     # pages
+}
+
+DEFAULT_ENGINE_OPTIONS = {
+    'pool_size': 10,
+    'max_overflow': 20,
+    'pool_timeout': 30,
+    'pool_recycle': 3600,
+    'connect_args': {'check_same_thread': False, 'timeout': 15}
+}
+
+
+@event.listens_for(Engine, 'connect')
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+    finally:
+        cursor.close()
+
+
+def init_db(app):
+    """
+    Configure and initialise the shared db for app.
+    SQLALCHEMY_ENGINE_OPTIONS set by the app take precedence over the
+    defaults; in-memory databases keep SQLAlchemy's own pool.
+    """
+    uri = app.config.setdefault('SQLALCHEMY_DATABASE_URI', 'sqlite:///app.db')
+    app.config.setdefault('SQLALCHEMY_TRACK_MODIFICATIONS', False)
+
+    if uri.startswith('sqlite:///') and uri != 'sqlite:///:memory:':
+        path = uri[len('sqlite:///'):]
+        directory = os.path.dirname(path)
+        if os.path.isabs(path) and directory:
+            os.makedirs(directory, exist_ok=True)
+        options = dict(DEFAULT_ENGINE_OPTIONS)
+        options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+    db.init_app(app)
@@ -0,0 +1,158 @@
+import atexit
+import json
+import logging
+import os
+import threading
+from typing import List, Optional, Tuple
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POLL_INTERVAL = 2.0     # seconds between checks of the config file
+
+
+class EngineConfigWatcher:
+    """
+    Hot reload of ChatbotEngine intents, thresholds, keywords and responses.
+
+    ENGINE_CONFIG_PATH names a JSON file with a 'version' and any of the
+    sections of ChatbotEngine.default_config(); sections it leaves out keep
+    their built-in values. The file is polled every poll_interval seconds.
+    When it changes and carries a new version, it is compiled into a new
+    EngineSnapshot on this thread, keyword index and templates included,
+    and swapped in with one assignment. Requests already running finish on
+    the snapshot they started with. A file that does not parse or validate
+    is logged and skipped, and the live snapshot stays; replace the file
+    by rename to avoid reading it half-written.
+
+    Each process (every serve.py worker) polls for itself.
+    """
+
+    def __init__(self, app=None, engine=None, **options):
+        self.app = None
+        self.engine = engine
+        self.path: Optional[str] = options.get('path')
+        self.poll_interval = options.get('poll_interval', DEFAULT_POLL_INTERVAL)
+        self._seen: Optional[Tuple[int, int]] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        if app is not None:
+            self.init_app(app, engine)
+
+    def init_app(self, app, engine=None):
+        """
+        Configure from app.config (ENGINE_CONFIG_PATH,
+        ENGINE_CONFIG_POLL_INTERVAL). With a path set, the file is loaded
+        now, and an invalid file fails startup, then watched in the
+        background. CHATBOT_CLASSIFIER selects the intent classifier:
+        'regex' (default) or the path of an n-gram model file.
+        """
+        self.app = app
+        config = app.config
+        self.path = config.get('ENGINE_CONFIG_PATH') or self.path
+        self.poll_interval = config.get('ENGINE_CONFIG_POLL_INTERVAL', self.poll_interval)
+        if engine is None and self.engine is None:
+            from chat_api import chatbot as engine
+        self.engine = engine or self.engine
+        if config.get('CHATBOT_CLASSIFIER'):
+            self.engine.use_classifier(config['CHATBOT_CLASSIFIER'])
+        app.extensions['engine_config'] = self
+        metrics.add_collector(self.render_metrics)
+        if not self.path:
+            return
+        self.check(strict=True)
+        if self.poll_interval > 0:
+            self.start()
+
+    def check(self, strict: bool = False) -> bool:
+        """
+        Apply the config file if it changed and has a new version. Returns
+        True if a new snapshot was swapped in. With strict, errors are
+        raised instead of logged.
+        """
+        with self._lock:
+            try:
+                stat = os.stat(self.path)
+            except OSError:
+                if strict:
+                    raise
+                logger.warning('engine config %s is missing; keeping version %r',
+                               self.path, self.engine.config_version)
+                return False
+            seen = (stat.st_mtime_ns, stat.st_size)
+            if seen == self._seen:
+                return False
+            self._seen = seen
+            try:
+                with open(self.path, encoding='utf-8') as f:
+                    config = json.load(f)
+                if not isinstance(config, dict) or config.get('version') is None:
+                    raise ValueError("engine config needs a 'version'")
+                if config['version'] == self.engine.config_version:
+                    logger.info('engine config %s changed but is still version %r; not applied',
+                                self.path, config['version'])
+                    return False
+                self.engine.apply_config(config)
+            except (ValueError, KeyError, TypeError) as e:
+                # JSONDecodeError is a ValueError; covers a half-written file too
+                if strict:
+                    raise
+                logger.error('engine config %s rejected, keeping version %r: %s',
+                             self.path, self.engine.config_version, e)
+                return False
+        logger.info('engine config version %r loaded from %s', config['version'], self.path)
+        return True
+
+    def render_metrics(self) -> List[str]:
+        if self.engine is None:
+            return []
+        version = str(self.engine.config_version or 'builtin')
+        version = version.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return [
+            '# HELP chatbot_engine_config_info Version of the live engine configuration',
+            '# TYPE chatbot_engine_config_info gauge',
+            f'chatbot_engine_config_info{{version="{version}"}} 1'
+        ]
+
+    # -- background thread -------------------------------------------------
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='engine-config', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self, timeout: Optional[float] = None):
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.check()
+            except Exception:
+                logger.exception('engine config check failed')
+
+    def _after_fork(self):
+        """Forked workers inherit the parent's snapshot and poll on their own thread"""
+        was_running = self.running
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        if was_running:
+            self.start()
+
+
+engine_config = EngineConfigWatcher()
+os.register_at_fork(after_in_child=engine_config._after_fork)
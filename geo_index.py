@@ -0,0 +1,142 @@
+import heapq
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import inspect, select, text
+from chatbot import db, HazardReport
+import geohash
+
+# Largest search radius used when looking for nearest reports
+MAX_NEAREST_RADIUS_M = 50000.0
+# Radius the nearest-N search starts from before widening
+INITIAL_NEAREST_RADIUS_M = 250.0
+
+
+def _cell_filter(cells: List[str]):
+    """SQL condition matching rows whose geohash starts with any of the cells"""
+    # '~' sorts after every base32 character, so [cell, cell~) is a prefix range
+    return db.or_(*[
+        db.and_(HazardReport.geohash >= cell, HazardReport.geohash < cell + '~')
+        for cell in cells
+    ])
+
+
+def _in_bbox(min_lat: float, min_lng: float, max_lat: float, max_lng: float):
+    return db.and_(HazardReport.location_lat.between(min_lat, max_lat),
+                   HazardReport.location_lng.between(min_lng, max_lng))
+
+
+def _candidates(min_lat: float, min_lng: float, max_lat: float, max_lng: float, status: Optional[str] = None):
+    query = HazardReport.query.filter(
+        _cell_filter(geohash.cells_covering(min_lat, min_lng, max_lat, max_lng)),
+        _in_bbox(min_lat, min_lng, max_lat, max_lng)
+    )
+    if status:
+        query = query.filter(HazardReport.status == status)
+    return query
+
+
+def _scan(lat: float, lng: float, bounds: Tuple[float, float, float, float], status: Optional[str] = None,
+          skip: Optional[Tuple[float, float, float, float]] = None) -> Dict[int, float]:
+    """
+    id -> distance_m for the reports inside bounds, reading only ids and
+    coordinates. Reports inside skip (an area already scanned) are left out.
+    """
+    query = select(HazardReport.id, HazardReport.location_lat, HazardReport.location_lng).where(
+        _cell_filter(geohash.cells_covering(*bounds)), _in_bbox(*bounds)
+    )
+    if status:
+        query = query.where(HazardReport.status == status)
+    if skip is not None:
+        query = query.where(db.not_(_in_bbox(*skip)))
+    return {row.id: geohash.haversine_m(lat, lng, row.location_lat, row.location_lng)
+            for row in db.session.execute(query)}
+
+
+def _load(distances: List[Tuple[float, int]]) -> List[Tuple[HazardReport, float]]:
+    """(report, distance_m) pairs for (distance_m, id) pairs, in the same order"""
+    if not distances:
+        return []
+    reports = {report.id: report for report in
+               HazardReport.query.filter(HazardReport.id.in_([report_id for _, report_id in distances]))}
+    return [(reports[report_id], distance) for distance, report_id in distances if report_id in reports]
+
+
+def _nearest(distances: Dict[int, float], radius_m: float, limit: Optional[int]) -> List[Tuple[float, int]]:
+    found = [(distance, report_id) for report_id, distance in distances.items() if distance <= radius_m]
+    if limit:
+        return heapq.nsmallest(limit, found)
+    return sorted(found)
+
+
+def reports_in_bbox(min_lat: float, min_lng: float, max_lat: float, max_lng: float,
+                    status: Optional[str] = None, limit: Optional[int] = None) -> List[HazardReport]:
+    """Return reports inside a bounding box, newest first"""
+    query = _candidates(min_lat, min_lng, max_lat, max_lng, status).order_by(HazardReport.created_at.desc())
+    if limit:
+        query = query.limit(limit)
+    return query.all()
+
+
+def reports_within_radius(lat: float, lng: float, radius_m: float, status: Optional[str] = None,
+                          limit: Optional[int] = None) -> List[Tuple[HazardReport, float]]:
+    """
+    Return (report, distance_m) pairs within radius_m of a point, nearest
+    first. Candidates are ranked from their coordinates alone; only the
+    reports returned are loaded.
+    """
+    distances = _scan(lat, lng, geohash.radius_bounds(lat, lng, radius_m), status)
+    return _load(_nearest(distances, radius_m, limit))
+
+
+def nearest_reports(lat: float, lng: float, n: int = 10, status: Optional[str] = None,
+                    max_radius_m: float = MAX_NEAREST_RADIUS_M) -> List[Tuple[HazardReport, float]]:
+    """
+    Return the n reports nearest to a point as (report, distance_m) pairs.
+    The search radius doubles until n reports are found or max_radius_m
+    is reached; every report inside the final radius is considered, so the
+    result is exact within that radius. Each widening scans only the area
+    the previous bounding box did not cover.
+    """
+    radius = min(INITIAL_NEAREST_RADIUS_M, max_radius_m)
+    distances: Dict[int, float] = {}
+    scanned = None
+    while True:
+        bounds = geohash.radius_bounds(lat, lng, radius)
+        distances.update(_scan(lat, lng, bounds, status, skip=scanned))
+        scanned = bounds
+        found = _nearest(distances, radius, n)
+        if len(found) >= n or radius >= max_radius_m:
+            return _load(found)
+        radius = min(radius * 2, max_radius_m)
+
+
+def ensure_geohash_column(batch_size: int = 5000) -> int:
+    """
+    Add the geohash column and index to an existing hazard_reports table
+    and fill it for rows that lack one. Safe to run repeatedly.
+    Returns the number of rows backfilled.
+    """
+    columns = {column['name'] for column in inspect(db.engine).get_columns('hazard_reports')}
+    if 'geohash' not in columns:
+        db.session.execute(text('ALTER TABLE hazard_reports ADD COLUMN geohash VARCHAR(12)'))
+    db.session.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_hazard_reports_geohash ON hazard_reports (geohash)'
+    ))
+    db.session.commit()
+
+    updated = 0
+    while True:
+        rows = db.session.execute(text(
+            'SELECT id, location_lat, location_lng FROM hazard_reports '
+            'WHERE geohash IS NULL AND location_lat IS NOT NULL AND location_lng IS NOT NULL '
+            'LIMIT :limit'
+        ), {'limit': batch_size}).fetchall()
+        if not rows:
+            return updated
+        db.session.execute(
+            text('UPDATE hazard_reports SET geohash = :geohash WHERE id = :id'),
+            [{'id': row.id, 'geohash': geohash.encode(float(row.location_lat), float(row.location_lng))}
+             for row in rows]
+        )
+        db.session.commit()
+        updated += len(rows)
@@ -0,0 +1,121 @@
+import math
+from typing import List, Tuple
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+_DECODE = {char: index for index, char in enumerate(BASE32)}
+
+# Precision stored on rows; 9 characters is a cell of roughly 5m x 5m
+DEFAULT_PRECISION = 9
+
+EARTH_RADIUS_M = 6371008.8
+
+
+def encode(lat: float, lng: float, precision: int = DEFAULT_PRECISION) -> str:
+    """Encode a coordinate as a geohash string"""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lng_range[0] + lng_range[1]) / 2
+            if lng >= mid:
+                value = (value << 1) | 1
+                lng_range[0] = mid
+            else:
+                value <<= 1
+                lng_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if lat >= mid:
+                value = (value << 1) | 1
+                lat_range[0] = mid
+            else:
+                value <<= 1
+                lat_range[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = 0
+            value = 0
+    return ''.join(chars)
+
+
+def decode_bounds(geohash: str) -> Tuple[float, float, float, float]:
+    """Return (min_lat, min_lng, max_lat, max_lng) of a geohash cell"""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        value = _DECODE[char]
+        for shift in range(4, -1, -1):
+            bit = (value >> shift) & 1
+            target = lng_range if even else lat_range
+            mid = (target[0] + target[1]) / 2
+            target[1 - bit] = mid
+            even = not even
+    return lat_range[0], lng_range[0], lat_range[1], lng_range[1]
+
+
+def cell_size(precision: int) -> Tuple[float, float]:
+    """Return (height, width) in degrees of a cell at the given precision"""
+    bits = 5 * precision
+    lng_bits = (bits + 1) // 2
+    lat_bits = bits // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lng_bits)
+
+
+def cells_covering(min_lat: float, min_lng: float, max_lat: float, max_lng: float,
+                   max_cells: int = 32) -> List[str]:
+    """
+    Return geohash prefixes whose cells together cover the bounding box,
+    using the finest precision that needs at most max_cells cells.
+    """
+    min_lat = max(min_lat, -90.0)
+    max_lat = min(max_lat, 90.0)
+    min_lng = max(min_lng, -180.0)
+    max_lng = min(max_lng, 180.0)
+
+    precision = DEFAULT_PRECISION
+    while precision > 1:
+        height, width = cell_size(precision)
+        rows = math.floor((max_lat + 90.0) / height) - math.floor((min_lat + 90.0) / height) + 1
+        cols = math.floor((max_lng + 180.0) / width) - math.floor((min_lng + 180.0) / width) + 1
+        if rows * cols <= max_cells:
+            break
+        precision -= 1
+
+    height, width = cell_size(precision)
+    first_row = math.floor((min_lat + 90.0) / height)
+    last_row = math.floor((max_lat + 90.0) / height)
+    first_col = math.floor((min_lng + 180.0) / width)
+    last_col = math.floor((max_lng + 180.0) / width)
+
+    cells = set()
+    for row in range(first_row, last_row + 1):
+        lat = min(-90.0 + (row + 0.5) * height, 90.0)
+        for col in range(first_col, last_col + 1):
+            lng = min(-180.0 + (col + 0.5) * width, 180.0)
+            cells.add(encode(lat, lng, precision))
+    return sorted(cells)
+
+
+def haversine_m(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Great-circle distance in meters"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lng2 - lng1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def radius_bounds(lat: float, lng: float, radius_m: float) -> Tuple[float, float, float, float]:
+    """Bounding box (min_lat, min_lng, max_lat, max_lng) enclosing a circle"""
+    d_lat = math.degrees(radius_m / EARTH_RADIUS_M)
+    cos_lat = math.cos(math.radians(lat))
+    d_lng = 180.0 if cos_lat < 1e-12 else min(180.0, math.degrees(radius_m / (EARTH_RADIUS_M * cos_lat)))
+    return lat - d_lat, lng - d_lng, lat + d_lat, lng + d_lng
@@ -0,0 +1,120 @@
+import io
+from flask import Blueprint, current_app, jsonify, request
+import geo_index
+import hazard_ingest
+from report_dedup import report_dedup
+
+hazard_api_bp = Blueprint('hazard_api', __name__)
+
+# Caps on query size for the geo endpoints
+MAX_NEAREST = 200
+MAX_RADIUS_M = 50000.0
+MAX_BBOX_RESULTS = 1000
+
+_INGEST_CONTENT_TYPES = {
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+    'text/csv': 'csv'
+}
+
+
+def _float_arg(name: str, minimum: float, maximum: float) -> float:
+    value = request.args.get(name, type=float)
+    if value is None or not minimum <= value <= maximum:
+        raise ValueError(f'{name} must be a number between {minimum} and {maximum}')
+    return value
+
+
+def _limit_arg() -> int:
+    """limit arg clamped to 1..MAX_BBOX_RESULTS"""
+    return min(max(request.args.get('limit', MAX_BBOX_RESULTS, type=int), 1), MAX_BBOX_RESULTS)
+
+
+@hazard_api_bp.route('/hazard-reports/nearby', methods=['GET'])
+def nearby_reports():
+    """
+    Reports near a point, nearest first.
+    Query: lat, lng, and either radius (meters) or n (nearest n); optional status.
+    """
+    try:
+        lat = _float_arg('lat', -90.0, 90.0)
+        lng = _float_arg('lng', -180.0, 180.0)
+        status = request.args.get('status')
+        if 'radius' in request.args:
+            radius = _float_arg('radius', 0.0, MAX_RADIUS_M)
+            limit = _limit_arg()
+            found = geo_index.reports_within_radius(lat, lng, radius, status=status, limit=limit)
+        else:
+            n = min(max(request.args.get('n', 10, type=int), 1), MAX_NEAREST)
+            found = geo_index.nearest_reports(lat, lng, n, status=status)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    reports = []
+    for report, distance in found:
+        data = report.to_dict()
+        data['distance_m'] = round(distance, 1)
+        reports.append(data)
+    return jsonify({'reports': reports, 'count': len(reports)})
+
+
+@hazard_api_bp.route('/hazard-reports/within', methods=['GET'])
+def reports_within():
+    """
+    Reports inside a bounding box, newest first.
+    Query: min_lat, min_lng, max_lat, max_lng; optional status, limit.
+    """
+    try:
+        min_lat = _float_arg('min_lat', -90.0, 90.0)
+        min_lng = _float_arg('min_lng', -180.0, 180.0)
+        max_lat = _float_arg('max_lat', min_lat, 90.0)
+        max_lng = _float_arg('max_lng', min_lng, 180.0)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    limit = _limit_arg()
+    reports = geo_index.reports_in_bbox(min_lat, min_lng, max_lat, max_lng,
+                                        status=request.args.get('status'), limit=limit)
+    return jsonify({'reports': [report.to_dict() for report in reports], 'count': len(reports)})
+
+
+@hazard_api_bp.route('/hazard-reports/duplicates', methods=['POST'])
+def check_duplicate():
+    """
+    Check a report before submitting it.
+    Body: {"description": str, "address": str?, "location_lat": float?, "location_lng": float?}
+    Returns the matching recent open report, if any.
+    """
+    data = request.get_json(silent=True) or {}
+    description = data.get('description')
+    if not isinstance(description, str) or not description.strip():
+        return jsonify({'error': 'description is required'}), 400
+    lat, lng = data.get('location_lat'), data.get('location_lng')
+    if not all(isinstance(value, (int, float)) for value in (lat, lng)):
+        lat = lng = None
+
+    report_dedup.sync()
+    match = report_dedup.find(description, data.get('address'), lat, lng)
+    return jsonify({'duplicate': match is not None, 'match': match.to_dict() if match else None})
+
+
+@hazard_api_bp.route('/hazard-reports/bulk', methods=['POST'])
+def bulk_ingest_reports():
+    """
+    Bulk-import hazard reports from an NDJSON or CSV request body.
+    The body is parsed as it streams in and inserted in chunks; invalid rows
+    are reported by row number and skipped.
+    Query: format (ndjson|csv, default from Content-Type), source (session
+    id for rows without user_session_id).
+    """
+    fmt = request.args.get('format') or _INGEST_CONTENT_TYPES.get(request.mimetype)
+    if fmt not in hazard_ingest.FORMATS:
+        return jsonify({'error': 'body must be NDJSON or CSV (set Content-Type or ?format=)'}), 415
+
+    source = request.args.get('source') or hazard_ingest.DEFAULT_SOURCE_SESSION
+    stream = io.TextIOWrapper(request.stream, encoding='utf-8', errors='replace', newline='')
+    result = hazard_ingest.ingest_stream(
+        stream, fmt, source=source[:50],
+        chunk_size=current_app.config.get('HAZARD_INGEST_CHUNK_SIZE', hazard_ingest.DEFAULT_CHUNK_SIZE)
+    )
+    return jsonify(result.to_dict())
@@ -0,0 +1,255 @@
+import csv
+import json
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from sqlalchemy import bindparam
+from sqlalchemy.exc import SQLAlchemyError
+from chatbot import db, HazardReport, UserSession, HAZARD_CATEGORIES
+from geohash import encode as encode_geohash
+from report_dedup import report_dedup, CLOSED_STATUSES, NearDuplicateIndex
+import analytics
+
+DEFAULT_CHUNK_SIZE = 1000        # rows per executemany transaction
+DEFAULT_MAX_REPORTED_ERRORS = 1000
+DEFAULT_SOURCE_SESSION = 'bulk-import'
+FORMATS = ('ndjson', 'csv')
+
+_CATEGORIES = frozenset(HAZARD_CATEGORIES)
+_OPTIONAL_TEXT = (('address', None), ('image_url', 255), ('status', 20), ('user_session_id', 50))
+
+
+class IngestResult:
+    """
+    Outcome of a bulk ingest. Only the first max_errors row errors are kept,
+    so the result stays bounded however many rows fail.
+    """
+
+    def __init__(self, max_errors: int = DEFAULT_MAX_REPORTED_ERRORS,
+                 on_error: Optional[Callable[[int, str], None]] = None):
+        self.max_errors = max_errors
+        self.on_error = on_error
+        self.inserted = 0
+        self.failed = 0
+        self.errors: List[Dict] = []
+
+    def add_error(self, row: int, error: str):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'row': row, 'error': error})
+        if self.on_error is not None:
+            self.on_error(row, error)
+
+    def to_dict(self) -> Dict:
+        return {
+            'inserted': self.inserted,
+            'failed': self.failed,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors)
+        }
+
+
+def iter_ndjson(stream: TextIO) -> Iterator[Tuple[int, object]]:
+    """(line number, parsed value or ValueError) per non-blank line"""
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError as e:
+            yield line_number, ValueError(f'invalid JSON: {e}')
+
+
+def iter_csv(stream: TextIO) -> Iterator[Tuple[int, object]]:
+    """(row number, dict) per CSV record; empty cells become None"""
+    reader = csv.DictReader(stream)
+    for row_number, record in enumerate(reader, 1):
+        if None in record:
+            yield row_number, ValueError('row has more fields than the header')
+            continue
+        yield row_number, {key: (value if value != '' else None) for key, value in record.items()}
+
+
+def _coordinate(raw: Dict, key: str, limit: float) -> Optional[float]:
+    value = raw.get(key)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise ValueError(f'{key} must be a number')
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{key} must be a number')
+    if not -limit <= value <= limit:
+        raise ValueError(f'{key} must be between {-limit} and {limit}')
+    return value
+
+
+def validate_row(raw, default_session_id: str, now: datetime) -> Dict:
+    """Turn one parsed record into a hazard_reports row, or raise ValueError"""
+    if not isinstance(raw, dict):
+        raise ValueError('record must be an object')
+
+    category = raw.get('category')
+    if not isinstance(category, str) or category not in _CATEGORIES:
+        raise ValueError(f'invalid category: {category!r}')
+    description = raw.get('description')
+    if not isinstance(description, str) or not description.strip():
+        raise ValueError('description is required')
+
+    row = {'category': category, 'description': description}
+    for key, max_length in _OPTIONAL_TEXT:
+        value = raw.get(key)
+        if value is not None:
+            # Numbers are kept as their text; objects, arrays and booleans are rejected
+            if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+                raise ValueError(f'{key} must be a string')
+            value = str(value)
+            if max_length and len(value) > max_length:
+                raise ValueError(f'{key} is longer than {max_length} characters')
+        row[key] = value
+    row['user_session_id'] = row['user_session_id'] or default_session_id
+    row['status'] = row['status'] or 'submitted'
+
+    lat = _coordinate(raw, 'location_lat', 90.0)
+    lng = _coordinate(raw, 'location_lng', 180.0)
+    if (lat is None) != (lng is None):
+        raise ValueError('location_lat and location_lng must be given together')
+    row['location_lat'] = lat
+    row['location_lng'] = lng
+    row['geohash'] = encode_geohash(lat, lng) if lat is not None else None
+
+    created_at = raw.get('created_at')
+    if created_at is not None:
+        if not isinstance(created_at, str):
+            raise ValueError('created_at must be an ISO 8601 timestamp')
+        try:
+            created_at = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
+        except ValueError:
+            raise ValueError('created_at must be an ISO 8601 timestamp')
+        if created_at.tzinfo is not None:
+            created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+    row['created_at'] = created_at or now
+    row['updated_at'] = now
+    match = report_dedup.find(description, row['address'], lat, lng, now=row['created_at'])
+    row['duplicate_of'] = match.cluster if match is not None else None
+    return row
+
+
+def _ensure_session(session_id: str):
+    if db.session.get(UserSession, session_id) is None:
+        db.session.add(UserSession(id=session_id))
+        db.session.commit()
+
+
+def _chunk_index() -> NearDuplicateIndex:
+    return NearDuplicateIndex(report_dedup.threshold, report_dedup.max_distance_m,
+                              report_dedup.window.total_seconds() / 3600)
+
+
+def _match_in_chunk(row: Dict, position: int, index: NearDuplicateIndex, links: Dict[int, int]):
+    """
+    Match a row that no stored report matched against the earlier rows of
+    its chunk, which have no ids yet: they are indexed under -(position + 1),
+    and a match on one of them is recorded in links (position -> position)
+    until the chunk is inserted.
+    """
+    lat, lng = row['location_lat'], row['location_lng']
+    if row['duplicate_of'] is None:
+        match = index.find(row['description'], row['address'], lat, lng, now=row['created_at'])
+        if match is not None:
+            if match.cluster > 0:
+                row['duplicate_of'] = match.cluster
+            else:
+                links[position] = -match.cluster - 1
+    if row['status'] not in CLOSED_STATUSES:
+        cluster = row['duplicate_of'] or -(links[position] + 1 if position in links else position + 1)
+        index.add(-(position + 1), row['description'], row['address'], lat, lng, row['created_at'], cluster)
+
+
+def _insert_chunk(chunk: List[Tuple[int, Dict]], result: IngestResult, links: Dict[int, int]):
+    """
+    Insert a chunk in one transaction, then point rows at the chunk rows
+    they duplicate (see _match_in_chunk). If the database rejects it,
+    retry row by row so only the offending rows are reported.
+    """
+    table = HazardReport.__table__
+    link = table.update().where(table.c.id == bindparam('report_id')).values(
+        duplicate_of=bindparam('duplicate_of')
+    )
+    try:
+        rows = [row for _, row in chunk]
+        ids = db.session.execute(
+            table.insert().returning(table.c.id, sort_by_parameter_order=True), rows
+        ).scalars().all()
+        if links:
+            db.session.execute(link, [{'report_id': ids[position], 'duplicate_of': ids[target]}
+                                      for position, target in links.items()])
+        analytics.count_reports(rows)
+        db.session.commit()
+        result.inserted += len(chunk)
+        return
+    except SQLAlchemyError:
+        db.session.rollback()
+
+    ids = {}
+    for position, (row_number, row) in enumerate(chunk):
+        if links.get(position) in ids:
+            row['duplicate_of'] = ids[links[position]]
+        try:
+            ids[position] = db.session.execute(table.insert().returning(table.c.id), row).scalar_one()
+            analytics.count_reports([row])
+            db.session.commit()
+            result.inserted += 1
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            ids.pop(position, None)
+            result.add_error(row_number, f"database error: {getattr(e, 'orig', None) or e}")
+
+
+def ingest_records(records: Iterable[Tuple[int, object]], source: str = DEFAULT_SOURCE_SESSION,
+                   chunk_size: int = DEFAULT_CHUNK_SIZE, max_errors: int = DEFAULT_MAX_REPORTED_ERRORS,
+                   on_error: Optional[Callable[[int, str], None]] = None) -> IngestResult:
+    """
+    Validate and insert (row number, record) pairs in chunk_size
+    transactions. Bad rows are reported and skipped; the batch carries on.
+    Rows without a user_session_id are attributed to the source session,
+    which is created if needed. Rows that near-duplicate a recent report
+    (see report_dedup) or an earlier row of the same chunk get duplicate_of
+    set. Memory use is bounded by chunk_size and
+    max_errors. Needs an app context.
+    """
+    result = IngestResult(max_errors, on_error)
+    _ensure_session(source)
+    report_dedup.sync(force=True)
+    now = datetime.utcnow()
+    chunk: List[Tuple[int, Dict]] = []
+    chunk_index = _chunk_index()
+    links: Dict[int, int] = {}
+    for row_number, raw in records:
+        try:
+            if isinstance(raw, ValueError):
+                raise raw
+            row = validate_row(raw, source, now)
+        except ValueError as e:
+            result.add_error(row_number, str(e))
+            continue
+        _match_in_chunk(row, len(chunk), chunk_index, links)
+        chunk.append((row_number, row))
+        if len(chunk) >= chunk_size:
+            _insert_chunk(chunk, result, links)
+            report_dedup.sync(force=True)  # later chunks are checked against this one
+            chunk = []
+            chunk_index = _chunk_index()
+            links = {}
+    if chunk:
+        _insert_chunk(chunk, result, links)
+    return result
+
+
+def ingest_stream(stream: TextIO, fmt: str, **options) -> IngestResult:
+    """Stream-parse NDJSON or CSV text and ingest it (see ingest_records)"""
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of: {', '.join(FORMATS)}")
+    records = iter_ndjson(stream) if fmt == 'ndjson' else iter_csv(stream)
+    return ingest_records(records, **options)
@@ -0,0 +1,141 @@
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+from chatbot import UserSession, HazardReport, ChatMessage
+from chat_archive import chat_archive
+import pagination
+
+history_api_bp = Blueprint('history_api', __name__)
+
+MESSAGE_FIELDS = ('id', 'user_session_id', 'message', 'response', 'intent', 'created_at')
+REPORT_FIELDS = ('id', 'user_session_id', 'category', 'description', 'location_lat', 'location_lng',
+                 'address', 'image_url', 'status', 'duplicate_of', 'created_at', 'updated_at')
+
+
+def _message_filters(args):
+    table = ChatMessage.__table__
+    filters = pagination.time_filters(table, args)
+    if args.get('session_id'):
+        filters.append(table.c.user_session_id == args['session_id'])
+    if args.get('intent'):
+        filters.append(table.c.intent == args['intent'])
+    return filters
+
+
+def _message_archive(args, session_id=None):
+    """Archived chat messages matching the same query args"""
+    return chat_archive.source(session_id=session_id or args.get('session_id') or None,
+                               intent=args.get('intent') or None, **pagination.time_bounds(args))
+
+
+def _report_filters(args):
+    table = HazardReport.__table__
+    filters = pagination.time_filters(table, args)
+    if args.get('status'):
+        filters.append(table.c.status == args['status'])
+    if args.get('category'):
+        filters.append(table.c.category == args['category'])
+    if args.get('session_id'):
+        filters.append(table.c.user_session_id == args['session_id'])
+    return filters
+
+
+def _live_filters(table, filters, archive):
+    """Rows of an archive batch not deleted yet are served from the archive only"""
+    pending = chat_archive.pending_ids() if archive is not None else None
+    return [*filters, table.c.id.notin_(pending)] if pending else filters
+
+
+def _page(key: str, table, serialize, filters, archive=None):
+    limit, cursor = pagination.page_args(request.args)
+    rows, next_cursor = pagination.keyset_page(table, _live_filters(table, filters, archive), cursor, limit,
+                                               archive=archive)
+    return jsonify({key: [serialize(row) for row in rows], 'count': len(rows), 'next_cursor': next_cursor})
+
+
+def _export(name: str, table, serialize, fieldnames, filters, archive=None):
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in pagination.EXPORT_FORMATS:
+        return jsonify({'error': f"format must be one of: {', '.join(pagination.EXPORT_FORMATS)}"}), 400
+    rows = pagination.iter_rows(table, _live_filters(table, filters, archive), archive=archive)
+    lines = pagination.export_lines(rows, serialize, fmt, fieldnames)
+    return Response(stream_with_context(lines), mimetype=pagination.EXPORT_FORMATS[fmt],
+                    headers={'Content-Disposition': f'attachment; filename={name}.{fmt}'})
+
+
+@history_api_bp.route('/sessions', methods=['GET'])
+def list_sessions():
+    """
+    Sessions, newest first.
+    Query: limit, cursor (next_cursor from the previous page), since, until.
+    """
+    try:
+        filters = pagination.time_filters(UserSession.__table__, request.args)
+        return _page('sessions', UserSession.__table__, UserSession.serialize, filters)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+
+@history_api_bp.route('/sessions/<session_id>/messages', methods=['GET'])
+def list_session_messages(session_id):
+    """
+    A session's chat history, newest first, including archived days.
+    Query: limit, cursor, since, until, intent.
+    """
+    try:
+        filters = _message_filters(request.args)
+        filters.append(ChatMessage.__table__.c.user_session_id == session_id)
+        return _page('messages', ChatMessage.__table__, ChatMessage.serialize, filters,
+                     _message_archive(request.args, session_id))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+
+@history_api_bp.route('/chat-messages', methods=['GET'])
+def list_messages():
+    """
+    Chat messages across sessions, newest first, including archived days.
+    Query: limit, cursor, since, until, session_id, intent.
+    """
+    try:
+        return _page('messages', ChatMessage.__table__, ChatMessage.serialize, _message_filters(request.args),
+                     _message_archive(request.args))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+
+@history_api_bp.route('/hazard-reports', methods=['GET'])
+def list_reports():
+    """
+    Hazard reports, newest first.
+    Query: limit, cursor, since, until, status, category, session_id.
+    """
+    try:
+        return _page('reports', HazardReport.__table__, HazardReport.serialize, _report_filters(request.args))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+
+@history_api_bp.route('/export/chat-messages', methods=['GET'])
+def export_messages():
+    """
+    Stream chat messages oldest first as NDJSON or CSV, archived days included.
+    Query: format (ndjson|csv), since, until, session_id, intent.
+    """
+    try:
+        filters = _message_filters(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return _export('chat-messages', ChatMessage.__table__, ChatMessage.serialize, MESSAGE_FIELDS, filters,
+                   _message_archive(request.args))
+
+
+@history_api_bp.route('/export/hazard-reports', methods=['GET'])
+def export_reports():
+    """
+    Stream hazard reports oldest first as NDJSON or CSV.
+    Query: format (ndjson|csv), since, until, status, category, session_id.
+    """
+    try:
+        filters = _report_filters(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return _export('hazard-reports', HazardReport.__table__, HazardReport.serialize, REPORT_FIELDS, filters)
@@ -0,0 +1,138 @@
+import re
+from collections import deque
+from typing import Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+_WORD_CHAR = re.compile(r'\w')
+_TOKEN = re.compile(r'\w+|\W+')
+_SIMPLE_ALTERNATION = re.compile(r'^\\b\((?P<body>[^()\\]*)\)\\b$')
+_REGEX_SPECIAL = frozenset('.^$*+?{}[]\\|()')
+
+# Characters that re.IGNORECASE equates with an ASCII letter but that
+# str.lower() leaves alone; folded so lookups agree with re.search.
+_CASE_FOLD = str.maketrans({'ı': 'i', 'ſ': 's'})
+
+
+def fold(text: str) -> str:
+    """Lowercase text the same way the index does"""
+    return text.lower().translate(_CASE_FOLD)
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into alternating word and non-word runs"""
+    return _TOKEN.findall(text)
+
+
+class KeywordIndex:
+    """
+    Multi-pattern keyword index with \\b word-boundary semantics.
+
+    Keywords are split into word and separator tokens and compiled into an
+    Aho-Corasick automaton over that token alphabet. A message is tokenized
+    once and every keyword hit is found in a single pass, in time linear in
+    the number of tokens regardless of how many keywords are indexed.
+    Because messages are tokenized into maximal \\w runs, a hit always sits
+    on word boundaries, exactly like r'\\b(keyword)\\b'.
+
+    Patterns that are not literal keywords are kept as compiled regexes and
+    checked separately.
+    """
+
+    def __init__(self):
+        self._keywords: Dict[Tuple[str, ...], Set[Hashable]] = {}
+        self._fallback: List[Tuple[re.Pattern, Hashable]] = []
+        self._goto: Optional[List[Dict[str, int]]] = None
+        self._fail: List[int] = []
+        self._output: List[frozenset] = []
+
+    @staticmethod
+    def _is_word_bounded(keyword: str) -> bool:
+        return bool(keyword) and bool(_WORD_CHAR.match(keyword[0])) and bool(_WORD_CHAR.match(keyword[-1]))
+
+    def add_keyword(self, keyword: str, payload: Hashable):
+        """Index a literal keyword; matched as r'\\bkeyword\\b', case-insensitively"""
+        folded = fold(keyword)
+        if not self._is_word_bounded(folded):
+            self._fallback.append((re.compile(rf'\b{re.escape(keyword)}\b', re.IGNORECASE), payload))
+            return
+        self._keywords.setdefault(tuple(tokenize(folded)), set()).add(payload)
+        self._goto = None
+
+    def add_pattern(self, pattern: str, payload: Hashable):
+        """
+        Index a regex pattern. The alternatives of a \\b(a|b|c)\\b pattern
+        become keywords; anything that is not a literal keyword is kept as
+        a case-insensitive regex.
+        """
+        match = _SIMPLE_ALTERNATION.match(pattern)
+        if not match:
+            self._fallback.append((re.compile(pattern, re.IGNORECASE), payload))
+            return
+        for alternative in match.group('body').split('|'):
+            if not _REGEX_SPECIAL.intersection(alternative) and self._is_word_bounded(fold(alternative)):
+                self.add_keyword(alternative, payload)
+            else:
+                self._fallback.append((re.compile(rf'\b(?:{alternative})\b', re.IGNORECASE), payload))
+
+    def add_patterns(self, patterns: Iterable[Tuple[str, Hashable]]):
+        for pattern, payload in patterns:
+            self.add_pattern(pattern, payload)
+
+    def _build(self):
+        """Compile the token trie and its failure links"""
+        goto: List[Dict[str, int]] = [{}]
+        output: List[Set[Hashable]] = [set()]
+
+        for tokens, payloads in self._keywords.items():
+            state = 0
+            for token in tokens:
+                next_state = goto[state].get(token)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto[state][token] = next_state
+                    goto.append({})
+                    output.append(set())
+                state = next_state
+            output[state] |= payloads
+
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for token, next_state in goto[state].items():
+                queue.append(next_state)
+                if state == 0:
+                    continue
+                fallback = fail[state]
+                while fallback and token not in goto[fallback]:
+                    fallback = fail[fallback]
+                fail[next_state] = goto[fallback].get(token, 0)
+                output[next_state] |= output[fail[next_state]]
+
+        self._goto = goto
+        self._fail = fail
+        self._output = [frozenset(payloads) for payloads in output]
+
+    def search(self, text: str) -> Set[Hashable]:
+        """Return the payloads of every keyword and pattern found in text"""
+        if self._goto is None:
+            self._build()
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+
+        found: Set[Hashable] = set()
+        state = 0
+        for token in _TOKEN.findall(text.translate(_CASE_FOLD)):
+            while state and token not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(token, 0)
+            if output[state]:
+                found |= output[state]
+
+        for regex, payload in self._fallback:
+            if payload not in found and regex.search(text):
+                found.add(payload)
+        return found
+
+    def __len__(self) -> int:
+        return len(self._keywords)
@@ -0,0 +1,259 @@
+import re
+import json
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Letters, numbers (optionally ordinal: 38th, 1st) or a single punctuation
+# mark. Whitespace is skipped, so a punctuation token breaks a phrase.
+_TOKEN = re.compile(r'[^\W\d_]+|\d+(?:st|nd|rd|th)?|[^\s\w]|_', re.IGNORECASE)
+
+# Longest street name / landmark phrase considered, in words
+MAX_NAME_WORDS = 5
+
+DEFAULT_SUFFIXES = {
+    'street': 'st', 'st': 'st',
+    'avenue': 'ave', 'ave': 'ave', 'av': 'ave',
+    'road': 'rd', 'rd': 'rd',
+    'boulevard': 'blvd', 'blvd': 'blvd',
+    'drive': 'dr', 'dr': 'dr',
+    'lane': 'ln', 'ln': 'ln',
+    'way': 'way',
+    'circle': 'cir', 'cir': 'cir',
+    'court': 'ct', 'ct': 'ct',
+    'parkway': 'pkwy', 'pkwy': 'pkwy',
+    'place': 'pl', 'pl': 'pl',
+    'pike': 'pike',
+    'highway': 'hwy', 'hwy': 'hwy',
+    'trail': 'trl', 'trl': 'trl',
+    'terrace': 'ter', 'ter': 'ter'
+}
+
+DEFAULT_DIRECTIONS = {
+    'north': 'n', 'n': 'n',
+    'south': 's', 's': 's',
+    'east': 'e', 'e': 'e',
+    'west': 'w', 'w': 'w'
+}
+
+# Major Indianapolis streets; extend or replace with Gazetteer.load()
+DEFAULT_STREETS = [
+    'meridian', 'illinois', 'capitol', 'senate', 'pennsylvania', 'delaware',
+    'alabama', 'new jersey', 'east', 'college', 'central', 'keystone',
+    'washington', 'market', 'ohio', 'new york', 'michigan', 'vermont',
+    'north', 'south', 'maryland', 'georgia', 'massachusetts', 'virginia',
+    'fort wayne', 'indiana', 'kentucky', 'madison', 'shelby', 'prospect',
+    'fall creek', 'binford', 'allisonville', 'emerson', 'shadeland',
+    'arlington', 'post', 'franklin', 'german church', 'mitthoeffer',
+    'lafayette', 'georgetown', 'high school', 'lynhurst', 'tibbs',
+    'harding', 'kessler', 'westfield', 'broad ripple', 'township line',
+    'ditch', 'rockville', 'crawfordsville', 'pendleton',
+    'southport', 'county line', 'thompson', 'stop 11', 'hanna', 'raymond',
+    'troy', 'edgewood', 'epler', 'sherman', 'rural', 'brookville',
+    'english', 'pleasant run', 'white river', 'mass ave',
+    '10th', '16th', '21st', '25th', '30th', '34th', '38th', '42nd',
+    '46th', '52nd', '56th', '62nd', '71st', '75th', '79th', '82nd', '86th',
+    '91st', '96th'
+]
+
+# Words that end a free-form "near ..." / "at ..." phrase
+STOP_WORDS = frozenset([
+    'and', 'but', 'or', 'so', 'because', 'since', 'while', 'when', 'where',
+    'which', 'who', 'that', 'this', 'it', 'its', 'is', 'are', 'was', 'were',
+    'be', 'been', 'has', 'have', 'had', 'there', 'here', 'please', 'help',
+    'now', 'right', 'today', 'tonight', 'yesterday', 'again', 'i', 'we',
+    'you', 'he', 'she', 'they', 'my', 'our', 'your', 'can', 'could',
+    'will', 'would', 'should', 'not', 'just', 'very', 'all', 'for', 'to',
+    'from', 'with', 'in', 'on', 'at', 'near', 'by', 'of'
+])
+
+
+class Gazetteer:
+    """
+    Street names, suffixes and directions used for location extraction.
+    Street names are stored in a word trie so multi-word names such as
+    "fall creek" are matched in one walk.
+    """
+
+    _END = object()
+
+    def __init__(self, streets: Iterable[str] = None, suffixes: Dict[str, str] = None,
+                 directions: Dict[str, str] = None):
+        self.suffixes = dict(DEFAULT_SUFFIXES if suffixes is None else suffixes)
+        self.directions = dict(DEFAULT_DIRECTIONS if directions is None else directions)
+        self.trie: Dict = {}
+        self.size = 0
+        for name in (DEFAULT_STREETS if streets is None else streets):
+            self.add_street(name)
+
+    @classmethod
+    def load(cls, path: str) -> 'Gazetteer':
+        """
+        Load a gazetteer file. A .json file may hold "streets", "suffixes"
+        and "directions" keys (missing keys use the defaults); any other
+        file is read as one street name per line.
+        """
+        with open(path, encoding='utf-8') as f:
+            if path.endswith('.json'):
+                data = json.load(f)
+                return cls(data.get('streets'), data.get('suffixes'), data.get('directions'))
+            names = [line.strip() for line in f]
+        return cls([name for name in names if name and not name.startswith('#')])
+
+    def add_street(self, name: str):
+        words = [token.lower() for token in _TOKEN.findall(name)]
+        if not words:
+            return
+        node = self.trie
+        for word in words:
+            node = node.setdefault(word, {})
+        if self._END not in node:
+            node[self._END] = True
+            self.size += 1
+
+    def match_street(self, words: List[str], start: int) -> int:
+        """Length in words of the longest street name starting at words[start], or 0"""
+        node = self.trie
+        longest = 0
+        for offset in range(min(MAX_NAME_WORDS, len(words) - start)):
+            node = node.get(words[start + offset])
+            if node is None:
+                break
+            if self._END in node:
+                longest = offset + 1
+        return longest
+
+
+class LocationExtractor:
+    """
+    Linear-time location extractor.
+
+    The message is tokenized once; each rule then tries every token with a
+    lookahead bounded by MAX_NAME_WORDS, so cost is O(len(message)) with no
+    regex backtracking. Rules are tried in priority order over the whole
+    message:
+
+    1. "<number> [direction] <name> <suffix>"  e.g. "123 N Meridian St"
+    2. "near <place>"
+    3. "at <place>"
+    4. "on [direction] <name> <suffix>"        e.g. "on Fall Creek Pkwy"
+
+    A <name> is either a gazetteer street (suffix optional) or up to
+    MAX_NAME_WORDS words ending in a suffix. A free-form <place> after
+    "near"/"at" runs until punctuation, a number or a stop word.
+    """
+
+    def __init__(self, gazetteer: Gazetteer = None):
+        self.gazetteer = gazetteer or Gazetteer()
+
+    def _tokenize(self, message: str) -> Tuple[List[Tuple[int, int]], List[str]]:
+        spans = []
+        words = []
+        for match in _TOKEN.finditer(message):
+            spans.append(match.span())
+            words.append(match.group(0).lower())
+        return spans, words
+
+    @staticmethod
+    def _is_name_word(word: str) -> bool:
+        return (word.isalpha() or word[0].isdigit() and not word.isdigit()) and word not in STOP_WORDS
+
+    def _match_street(self, words: List[str], start: int) -> int:
+        """
+        Match "[direction] <name> [suffix]" at words[start].
+        Returns the number of words consumed, or 0.
+        """
+        gazetteer = self.gazetteer
+        starts = [start]
+        if start < len(words) and words[start] in gazetteer.directions:
+            starts.insert(0, start + 1)
+
+        for position in starts:
+            known = gazetteer.match_street(words, position)
+            if known:
+                end = position + known
+                if end < len(words) and words[end] in gazetteer.suffixes:
+                    end += 1
+                return end - start
+
+            # Unknown name: one or more name words followed by a street suffix
+            limit = min(len(words), position + MAX_NAME_WORDS + 1)
+            if position < limit and self._is_name_word(words[position]):
+                for end in range(position + 1, limit):
+                    if words[end] in gazetteer.suffixes:
+                        return end + 1 - start
+                    if not self._is_name_word(words[end]):
+                        break
+        return 0
+
+    def _match_place(self, words: List[str], start: int) -> int:
+        """Match a street or a free-form place phrase at words[start]; returns words consumed"""
+        street = self._match_street(words, start)
+        if street:
+            return street
+        end = start
+        while end < len(words) and end - start < MAX_NAME_WORDS and self._is_name_word(words[end]):
+            end += 1
+        return end - start
+
+    def _find(self, words: List[str]) -> Optional[Tuple[int, int]]:
+        """Return the (first, last) word index of the best location, or None"""
+        # 1. Numbered street address
+        for i, word in enumerate(words):
+            if word.isdigit():
+                length = self._match_street(words, i + 1)
+                if length:
+                    return i, i + length
+
+        # 2./3. Free-form place after "near" or "at"
+        for trigger in ('near', 'at'):
+            for i, word in enumerate(words):
+                if word == trigger:
+                    length = self._match_place(words, i + 1)
+                    if length:
+                        return i, i + length
+
+        # 4. Street after "on"
+        for i, word in enumerate(words):
+            if word == 'on':
+                length = self._match_street(words, i + 1)
+                if length:
+                    return i, i + length
+        return None
+
+    def extract(self, message: str) -> Optional[str]:
+        """Return the location text as it appears in the message, or None"""
+        spans, words = self._tokenize(message)
+        found = self._find(words)
+        if found is None:
+            return None
+        first, last = found
+        return message[spans[first][0]:spans[last][1]]
+
+    def normalize(self, location: str) -> str:
+        """
+        Canonical form of a location for comparison and dedupe, e.g.
+        "near 123 North Meridian Street" -> "123 n meridian st".
+        """
+        gazetteer = self.gazetteer
+        words = [word for word in self._tokenize(location)[1] if word.isalnum()]
+        while words and words[0] in ('near', 'at', 'on'):
+            words = words[1:]
+        normalized = []
+        for i, word in enumerate(words):
+            if word in gazetteer.suffixes and i > 0:
+                normalized.append(gazetteer.suffixes[word])
+            elif word in gazetteer.directions and i < len(words) - 1:
+                normalized.append(gazetteer.directions[word])
+            else:
+                normalized.append(word)
+        return ' '.join(normalized)
+
+
+_default_extractor = None
+
+
+def normalize_address(address: str) -> str:
+    """Normalize an address with the default gazetteer"""
+    global _default_extractor
+    if _default_extractor is None:
+        _default_extractor = LocationExtractor()
+    return _default_extractor.normalize(address)
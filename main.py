@@ -1,43 +1,158 @@
 import os
 import sys
+import click
+import json
 # DON'T CHANGE THIS !!!
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
-from flask import Flask, send_from_directory
-from src.models.user import db
-from src.models.chatbot import UserSession, HazardReport, EmergencyAlert, ChatMessage
+from flask import Flask, Response
+from database import db, init_db
+from chatbot import UserSession, HazardReport, EmergencyAlert, ChatMessage
 from src.routes.user import user_bp
 from src.routes.chatbot import chatbot_bp
+from chat_api import chat_api_bp
+from hazard_api import hazard_api_bp
+from alerts_api import alerts_api_bp
+from history_api import history_api_bp
+from analytics_api import analytics_api_bp
+from write_behind import write_behind
+from metrics import metrics
+from chat_archive import chat_archive
+from session_store import session_store
+from admission import admission
+from engine_config import engine_config
+from static_assets import static_assets
+import migrations
+import hazard_ingest
+import report_dedup
+import analytics
+import alert_stream
 
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
 
 app.register_blueprint(user_bp, url_prefix='/api')
 app.register_blueprint(chatbot_bp, url_prefix='/api')
+app.register_blueprint(chat_api_bp, url_prefix='/api')
+app.register_blueprint(hazard_api_bp, url_prefix='/api')
+app.register_blueprint(alerts_api_bp, url_prefix='/api')
+app.register_blueprint(history_api_bp, url_prefix='/api')
+app.register_blueprint(analytics_api_bp, url_prefix='/api')
 
 # uncomment if you need to use database
 app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db.init_app(app)
-with app.app_context():
-    db.create_all()
+init_db(app)
+write_behind.init_app(app)
+metrics.init_app(app)
+chat_archive.init_app(app)
+session_store.init_app(app)
+admission.init_app(app)
+engine_config.init_app(app)
+static_assets.init_app(app)
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Apply schema migrations to the configured database."""
+    applied = migrations.migrate()
+    print(f"Applied migrations: {applied}" if applied else "Database is up to date")
+
+@app.cli.command('ingest-hazards')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(hazard_ingest.FORMATS), default=None,
+              help='Input format; guessed from the file extension by default.')
+@click.option('--source', default=hazard_ingest.DEFAULT_SOURCE_SESSION,
+              help='Session id for rows without user_session_id.')
+@click.option('--chunk-size', default=hazard_ingest.DEFAULT_CHUNK_SIZE, show_default=True)
+def ingest_hazards_command(path, fmt, source, chunk_size):
+    """Bulk-import hazard reports from an NDJSON or CSV file."""
+    if fmt is None:
+        fmt = 'csv' if path.lower().endswith('.csv') else 'ndjson'
+    with open(path, encoding='utf-8', newline='') as stream:
+        result = hazard_ingest.ingest_stream(
+            stream, fmt, source=source, chunk_size=chunk_size,
+            on_error=lambda row, error: click.echo(f"row {row}: {error}", err=True)
+        )
+    print(f"Inserted {result.inserted} reports, {result.failed} rows rejected")
+
+@app.cli.command('archive-chat')
+@click.option('--days', type=int, default=None, help='Retention in days (default CHAT_RETENTION_DAYS).')
+def archive_chat_command(days):
+    """Move chat messages past retention into daily compressed archives."""
+    if days is not None:
+        chat_archive.retention_days = days
+    print(f"Archived {chat_archive.run_once()} chat messages to {chat_archive.directory}")
+
+@app.cli.command('cluster-reports')
+@click.option('--since', type=click.DateTime(), default=None, help='Only reports created since this time.')
+def cluster_reports_command(since):
+    """Flag near-duplicate hazard reports in the existing backlog."""
+    stats = report_dedup.cluster_backlog(since)
+    print(f"Checked {stats['reports']} reports, flagged {stats['duplicates']} duplicates")
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Recompute the intent and hazard report rollups from the base tables and chat archive."""
+    stats = analytics.rebuild()
+    print(f"Rebuilt {stats['intent_rows']} intent and {stats['hazard_rows']} hazard report rollup rows")
+
+@app.cli.command('serve-alert-stream')
+@click.option('--host', default='0.0.0.0', show_default=True)
+@click.option('--port', default=5001, show_default=True)
+def serve_alert_stream_command(host, port):
+    """Serve /api/alerts/stream from one asyncio process, for large subscriber counts."""
+    print(f"Alert stream listening on {host}:{port}")
+    try:
+        alert_stream.run_stream_server(app, host, port)
+    except KeyboardInterrupt:
+        pass
+
+@app.cli.command('dump-engine-config')
+@click.argument('path', type=click.Path(dir_okay=False, writable=True))
+@click.option('--version', 'config_version', default='1', show_default=True, help='Version to stamp on the file.')
+def dump_engine_config_command(path, config_version):
+    """Write the live chatbot intents and responses as an ENGINE_CONFIG_PATH file."""
+    data = dict(engine_config.engine.snapshot.to_config(), version=config_version)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    print(f"Wrote engine config version {config_version} to {path}")
+
+@app.cli.command('train-classifier')
+@click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--output', '-o', required=True, type=click.Path(dir_okay=False), help='Model file to write.')
+@click.option('--epochs', default=5, show_default=True)
+@click.option('--feature-bits', default=18, show_default=True, help='log2 of the hashed feature count.')
+@click.option('--min-confidence', default=0.5, show_default=True,
+              help='Below this probability the regex result is used.')
+@click.option('--exclude-intent', multiple=True, help='Intent labels to leave out (repeatable).')
+def train_classifier_command(paths, output, epochs, feature_bits, min_confidence, exclude_intent):
+    """Train the n-gram intent classifier from exported chat history (NDJSON, CSV or archive .gz)."""
+    import ngram_classifier
+    model = ngram_classifier.train(ngram_classifier.read_history(paths, exclude_intent), feature_bits=feature_bits,
+                                   epochs=epochs, min_confidence=min_confidence)
+    model.save(output)
+    print(f"Trained on {model.info['samples']} messages ({', '.join(model.classes)}); "
+          f"holdout accuracy {model.info.get('holdout_accuracy', 'n/a')}; wrote {output}")
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve(path):
-    static_folder_path = app.static_folder
-    if static_folder_path is None:
+    if app.static_folder is None:
             return "Static folder not configured", 404
 
-    if path != "" and os.path.exists(os.path.join(static_folder_path, path)):
-        return send_from_directory(static_folder_path, path)
-    else:
-        index_path = os.path.join(static_folder_path, 'index.html')
-        if os.path.exists(index_path):
-            return send_from_directory(static_folder_path, 'index.html')
-        else:
-            return "index.html not found", 404
+    # Served from the manifest built at startup; unknown paths get the SPA shell
+    asset = static_assets.get(path) or static_assets.get('index.html')
+    if asset is None:
+        return "index.html not found", 404
+    return static_assets.response(asset)
 
 
 if __name__ == '__main__':
+    # Development server; production runs serve.py (schema changes via 'flask migrate')
+    with app.app_context():
+        migrations.migrate()
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,326 @@
+import itertools
+import os
+import threading
+import time
+import weakref
+from typing import Callable, Dict, List, Optional, Tuple
+
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from chatbot_engine import ChatbotEngine
+
+# HDR-style log-linear buckets: 16 linear sub-buckets per power of two,
+# so any recorded value is within ~6% of its bucket bounds.
+_SUB_BITS = 4
+_SUB_COUNT = 1 << _SUB_BITS
+
+# Bucket bounds (seconds) exported as Prometheus "le" labels
+EXPORT_BOUNDS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+EXPORT_QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+DEFAULT_SAMPLE_RATE = 0.1
+
+
+def _bucket_index(value: int) -> int:
+    if value < 2 * _SUB_COUNT:
+        return max(value, 0)
+    shift = value.bit_length() - _SUB_BITS - 1
+    return 2 * _SUB_COUNT + (shift - 1) * _SUB_COUNT + (value >> shift) - _SUB_COUNT
+
+
+def _bucket_bounds(index: int) -> Tuple[int, int]:
+    """[lower, upper) of a bucket, in nanoseconds"""
+    if index < 2 * _SUB_COUNT:
+        return index, index + 1
+    shift = (index - 2 * _SUB_COUNT) // _SUB_COUNT + 1
+    top = (index - 2 * _SUB_COUNT) % _SUB_COUNT + _SUB_COUNT
+    return top << shift, (top + 1) << shift
+
+
+def _label_value(value) -> str:
+    """Escape a label value for the Prometheus text format"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def confidence_bucket(confidence: float) -> str:
+    if confidence <= 0:
+        return 'none'
+    if confidence < 0.5:
+        return 'low'
+    if confidence < 0.8:
+        return 'medium'
+    return 'high'
+
+
+class LatencyHistogram:
+    """
+    Log-linear latency histogram over nanosecond values.
+    Not locked: each thread records into its own instance (see
+    MetricsRegistry) and instances are merged when rendered.
+    """
+
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts: List[int] = []
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value_ns: int):
+        index = _bucket_index(value_ns)
+        counts = self.counts
+        if index >= len(counts):
+            counts.extend([0] * (index + 1 - len(counts)))
+        counts[index] += 1
+        self.count += 1
+        self.total += value_ns
+        if value_ns > self.max:
+            self.max = value_ns
+
+    def merge(self, other: 'LatencyHistogram'):
+        counts = list(other.counts)
+        if len(counts) > len(self.counts):
+            self.counts.extend([0] * (len(counts) - len(self.counts)))
+        for index, bucket_count in enumerate(counts):
+            self.counts[index] += bucket_count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def quantile(self, fraction: float) -> float:
+        """Approximate quantile in nanoseconds (bucket midpoint)"""
+        if not self.count:
+            return 0.0
+        target = fraction * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if bucket_count and seen >= target:
+                lower, upper = _bucket_bounds(index)
+                return (lower + upper) / 2
+        return 0.0
+
+
+class _Shard:
+    """Per-thread metric storage, written without locks"""
+
+    __slots__ = ('histograms', 'intent_counts')
+
+    def __init__(self):
+        self.histograms: Dict[Tuple[str, str], LatencyHistogram] = {}
+        self.intent_counts: Dict[Tuple[str, str], int] = {}
+
+    def histogram(self, family: str, label: str) -> LatencyHistogram:
+        key = (family, label)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = LatencyHistogram()
+        return histogram
+
+    def merge(self, other: '_Shard'):
+        for key, histogram in dict(other.histograms).items():
+            self.histogram(*key).merge(histogram)
+        for key, count in dict(other.intent_counts).items():
+            self.intent_counts[key] = self.intent_counts.get(key, 0) + count
+
+
+class MetricsRegistry:
+    """
+    Low-overhead metrics for the chat pipeline.
+
+    Stage timings in ChatbotEngine.process_message are taken for one in
+    every 1/sample_rate messages; intent/confidence counters, request and
+    DB timings are always recorded. Each thread writes to its own shard,
+    so the hot path takes no locks; render() merges the shards and
+    produces Prometheus text. The threaded server starts a thread per
+    request, so the shards of finished threads are folded into one
+    retired shard whenever a thread adds a shard or render() runs.
+    """
+
+    def __init__(self, sample_rate: float = DEFAULT_SAMPLE_RATE):
+        self._local = threading.local()
+        self._shards: List[Tuple[weakref.ref, _Shard]] = []   # (owning thread, shard)
+        self._retired = _Shard()
+        self._lock = threading.Lock()
+        self._tick = itertools.count()
+        self.set_sample_rate(sample_rate)
+        self._db_hooked = False
+        self._collectors: List[Callable[[], List[str]]] = []
+
+    def set_sample_rate(self, sample_rate: float):
+        """Sample every round(1 / sample_rate)th message; sample_rate becomes the rate actually used"""
+        self._period = max(round(1 / sample_rate), 1) if sample_rate > 0 else 0
+        self.sample_rate = 1 / self._period if self._period else 0.0
+
+    def sampled(self) -> bool:
+        """True for the messages whose stages should be timed"""
+        return self._period > 0 and next(self._tick) % self._period == 0
+
+    def _shard(self) -> _Shard:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                self._retire_finished()
+                self._shards.append((weakref.ref(threading.current_thread()), shard))
+            return shard
+
+    def _retire_finished(self):
+        """Fold shards of threads that have exited into _retired; call with _lock held"""
+        live = []
+        for owner, shard in self._shards:
+            thread = owner()
+            if thread is not None and thread.is_alive():
+                live.append((owner, shard))
+            else:
+                self._retired.merge(shard)
+        self._shards = live
+
+    def record_stages(self, started: int, classified: int, extracted: int, generated: int):
+        """Record stage durations from perf_counter_ns timestamps"""
+        shard = self._shard()
+        shard.histogram('stage', 'classify').record(classified - started)
+        shard.histogram('stage', 'extract').record(extracted - classified)
+        shard.histogram('stage', 'generate').record(generated - extracted)
+        shard.histogram('stage', 'total').record(generated - started)
+
+    def count_intent(self, intent: str, confidence: float):
+        key = (intent, confidence_bucket(confidence))
+        counts = self._shard().intent_counts
+        counts[key] = counts.get(key, 0) + 1
+
+    def record_request(self, endpoint: str, duration_ns: int):
+        self._shard().histogram('request', endpoint).record(duration_ns)
+
+    def record_query(self, operation: str, duration_ns: int):
+        self._shard().histogram('db', operation).record(duration_ns)
+
+    def record_admission(self, lane: str, wait_ns: int):
+        self._shard().histogram('admission', lane).record(wait_ns)
+
+    def add_collector(self, collector: Callable[[], List[str]]):
+        """Register a callable returning extra Prometheus lines (e.g. gauges) for render()"""
+        if collector not in self._collectors:
+            self._collectors.append(collector)
+
+    def _merged(self) -> Tuple[Dict[Tuple[str, str], LatencyHistogram], Dict[Tuple[str, str], int]]:
+        merged = _Shard()
+        with self._lock:
+            self._retire_finished()
+            merged.merge(self._retired)
+            # dict() copies are atomic under the GIL, so concurrent writers are safe
+            for _, shard in self._shards:
+                merged.merge(shard)
+        return merged.histograms, merged.intent_counts
+
+    def init_app(self, app):
+        """
+        Hook request and DB timing into app and attach to every
+        ChatbotEngine. METRICS_SAMPLE_RATE sets the stage sampling rate.
+        """
+        self.set_sample_rate(app.config.get('METRICS_SAMPLE_RATE', self.sample_rate))
+        ChatbotEngine.metrics = self
+        app.extensions['metrics'] = self
+
+        @app.before_request
+        def _start_timer():
+            g.metrics_started = time.perf_counter_ns()
+
+        @app.after_request
+        def _record_request(response):
+            started = g.pop('metrics_started', None)
+            if started is not None and request.endpoint != 'prometheus_metrics':
+                self.record_request(request.endpoint or 'unmatched', time.perf_counter_ns() - started)
+            return response
+
+        if not self._db_hooked:
+            event.listen(Engine, 'before_cursor_execute', self._before_query)
+            event.listen(Engine, 'after_cursor_execute', self._after_query)
+            self._db_hooked = True
+
+    @staticmethod
+    def _before_query(conn, cursor, statement, parameters, context, executemany):
+        # Kept on the execution context, which is dropped with it if the statement fails
+        if context is not None:
+            context._metrics_query_started = time.perf_counter_ns()
+
+    def _after_query(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, '_metrics_query_started', None)
+        if started is not None:
+            operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'OTHER'
+            self.record_query(operation, time.perf_counter_ns() - started)
+
+    def _render_histograms(self, lines: List[str], name: str, help_text: str, label: str,
+                           family: Dict[str, LatencyHistogram]):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} histogram')
+        quantile_lines = []
+        for value, histogram in sorted(family.items()):
+            value = _label_value(value)
+            counts = histogram.counts
+            cumulative = 0
+            index = 0
+            for bound in EXPORT_BOUNDS:
+                bound_ns = bound * 1e9
+                while index < len(counts) and _bucket_bounds(index)[1] <= bound_ns:
+                    cumulative += counts[index]
+                    index += 1
+                lines.append(f'{name}_bucket{{{label}="{value}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{label}="{value}",le="+Inf"}} {histogram.count}')
+            lines.append(f'{name}_sum{{{label}="{value}"}} {histogram.total / 1e9:.9f}')
+            lines.append(f'{name}_count{{{label}="{value}"}} {histogram.count}')
+            for fraction in EXPORT_QUANTILES:
+                seconds = histogram.quantile(fraction) / 1e9
+                quantile_lines.append(f'{name}_quantile{{{label}="{value}",quantile="{fraction}"}} {seconds:.9f}')
+        lines.append(f'# HELP {name}_quantile {help_text} (quantiles from the full-resolution histogram)')
+        lines.append(f'# TYPE {name}_quantile gauge')
+        lines.extend(quantile_lines)
+
+    def render(self) -> str:
+        """Prometheus text exposition format"""
+        histograms, intent_counts = self._merged()
+        families = {'stage': {}, 'request': {}, 'db': {}, 'admission': {}}
+        for (family, label), histogram in histograms.items():
+            families[family][label] = histogram
+
+        lines = [
+            '# HELP chatbot_messages_total Messages processed, by intent and confidence bucket',
+            '# TYPE chatbot_messages_total counter'
+        ]
+        for (intent, bucket), count in sorted(intent_counts.items()):
+            lines.append(f'chatbot_messages_total{{intent="{_label_value(intent)}",'
+                         f'confidence="{bucket}"}} {count}')
+        lines.append('# HELP chatbot_stage_sample_rate Fraction of messages with stage timings')
+        lines.append('# TYPE chatbot_stage_sample_rate gauge')
+        lines.append(f'chatbot_stage_sample_rate {self.sample_rate}')
+
+        self._render_histograms(lines, 'chatbot_stage_duration_seconds',
+                                'Sampled ChatbotEngine.process_message stage latency', 'stage', families['stage'])
+        self._render_histograms(lines, 'http_request_duration_seconds',
+                                'Request latency by Flask endpoint', 'endpoint', families['request'])
+        self._render_histograms(lines, 'db_query_duration_seconds',
+                                'SQL statement latency by operation', 'operation', families['db'])
+        if families['admission']:
+            self._render_histograms(lines, 'admission_wait_seconds',
+                                    'Time spent queued for an admission slot, by lane', 'lane',
+                                    families['admission'])
+        for collector in self._collectors:
+            lines.extend(collector())
+        return '\n'.join(lines) + '\n'
+
+    def _after_fork(self):
+        """Forked workers start with empty shards and a fresh lock"""
+        self._local = threading.local()
+        self._shards = []
+        self._retired = _Shard()
+        self._lock = threading.Lock()
+
+
+metrics = MetricsRegistry()
+os.register_at_fork(after_in_child=metrics._after_fork)
@@ -0,0 +1,66 @@
+from typing import Callable, List, Tuple
+
+from sqlalchemy import inspect, text
+from database import db
+import chatbot  # noqa: F401  (registers the models on db.metadata)
+import user  # noqa: F401
+import geo_index
+import analytics
+
+
+def _add_geohash():
+    geo_index.ensure_geohash_column()
+
+
+def _add_column(table: str, name: str, ddl: str):
+    columns = {column['name'] for column in inspect(db.engine).get_columns(table)}
+    if name not in columns:
+        db.session.execute(text(f'ALTER TABLE {table} ADD COLUMN {name} {ddl}'))
+        db.session.commit()
+
+
+def _add_duplicate_of():
+    _add_column('hazard_reports', 'duplicate_of', 'INTEGER REFERENCES hazard_reports (id)')
+    _create_indexes()
+
+
+def _create_indexes():
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+    db.session.execute(text('ANALYZE'))
+    db.session.commit()
+
+
+# (schema version, step). Steps must be idempotent; the version reached is
+# stored in PRAGMA user_version so each step runs once per database.
+MIGRATIONS: List[Tuple[int, Callable[[], None]]] = [
+    (1, _add_geohash),
+    (2, _create_indexes),
+    (3, _create_indexes),  # keyset pagination index on user_sessions
+    (4, _add_duplicate_of),
+    (5, analytics.rebuild),  # backfill the rollup tables create_all just added
+]
+
+
+def schema_version() -> int:
+    return db.session.execute(text('PRAGMA user_version')).scalar() or 0
+
+
+def migrate() -> List[int]:
+    """
+    Bring the database up to date: create missing tables, then run every
+    step newer than the stored schema version. Needs an app context.
+    Returns the versions applied.
+    """
+    db.create_all()
+    current = schema_version()
+    applied = []
+    for version, step in MIGRATIONS:
+        if version <= current:
+            continue
+        step()
+        db.session.execute(text(f'PRAGMA user_version = {int(version)}'))
+        db.session.commit()
+        applied.append(version)
+    return applied
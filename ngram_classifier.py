@@ -0,0 +1,327 @@
+"""
+Hashed n-gram intent classifier: an alternative to regex pattern scoring.
+
+Messages become sparse feature vectors of hashed word unigrams/bigrams and
+character 3-5-grams, scored by a linear softmax model. Features are hashed
+with NumPy over the whole message at once, and a batch of messages is
+scored as one gather-multiply-reduce over the weight matrix.
+
+The model file is a small JSON header followed by the raw weight matrix
+(float16) and bias, and is opened with np.memmap: loading is instant, and
+forked workers share the pages through the OS page cache.
+
+Train offline from exported chat history (see 'flask train-classifier')
+and select the model with ChatbotEngine(classifier=path).
+"""
+import csv
+import gzip
+import json
+import os
+import random
+import re
+import struct
+import zlib
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from keyword_index import fold
+
+MAGIC = b'NGRAMCLF'
+FORMAT_VERSION = 1
+DEFAULT_FEATURE_BITS = 18           # 262144 hashed features
+DEFAULT_CHAR_NGRAMS = (3, 5)        # inclusive range of character n-gram sizes
+DEFAULT_MIN_CONFIDENCE = 0.5        # below this the regex result is used
+MAX_FEATURE_CHARS = 2000            # longer messages are classified on their start
+FEATURE_CHUNK = 2048                # messages hashed per vectorized pass
+_ALIGN = 64
+
+_NON_WORD = re.compile(r'\W+')
+_MIX = np.uint64(0x9E3779B97F4A7C15)
+_CHAR_BASE = np.uint64(0x100000001B3)
+_WORD_SEED = 0x5EED
+
+
+def _normalize(message: str) -> str:
+    return ' ' + _NON_WORD.sub(' ', fold(message[:MAX_FEATURE_CHARS])).strip() + ' '
+
+
+def _mix(hashes: np.ndarray) -> np.ndarray:
+    """Spread rolling/combined hashes over all 64 bits (splitmix64 finalizer)"""
+    hashes = hashes * _MIX
+    hashes ^= hashes >> np.uint64(31)
+    hashes *= np.uint64(0xBF58476D1CE4E5B9)
+    hashes ^= hashes >> np.uint64(29)
+    return hashes
+
+
+def features(message: str, feature_bits: int = DEFAULT_FEATURE_BITS,
+             char_ngrams: Tuple[int, int] = DEFAULT_CHAR_NGRAMS) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sparse feature vector of one message as (indices, values): signed
+    hashed counts, log-scaled and L2-normalized.
+    """
+    indices, values, _ = feature_matrix([message], feature_bits, char_ngrams)
+    return indices, values
+
+
+def feature_matrix(messages: Sequence[str], feature_bits: int = DEFAULT_FEATURE_BITS,
+                   char_ngrams: Tuple[int, int] = DEFAULT_CHAR_NGRAMS
+                   ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    CSR-style (indices, values, row offsets) for a batch of messages. The
+    whole batch is hashed at once: character n-grams are rolling hashes
+    over the concatenated text, masked where they would cross messages.
+    """
+    if len(messages) > FEATURE_CHUNK:
+        parts = [feature_matrix(messages[start:start + FEATURE_CHUNK], feature_bits, char_ngrams)
+                 for start in range(0, len(messages), FEATURE_CHUNK)]
+        offsets = [parts[0][2]]
+        for part in parts[1:]:
+            offsets.append(part[2][1:] + offsets[-1][-1])
+        return (np.concatenate([part[0] for part in parts]), np.concatenate([part[1] for part in parts]),
+                np.concatenate(offsets))
+
+    count = len(messages)
+    texts = [_normalize(message) for message in messages]
+    hashes = []
+    rows = []
+
+    # Words and word bigrams
+    words = [text.split() for text in texts]
+    word_counts = np.fromiter((len(row_words) for row_words in words), dtype=np.int64, count=count)
+    total_words = int(word_counts.sum())
+    if total_words:
+        word_hashes = np.fromiter((zlib.crc32(word.encode('utf-8'), _WORD_SEED)
+                                   for row_words in words for word in row_words),
+                                  dtype=np.uint64, count=total_words)
+        word_rows = np.repeat(np.arange(count), word_counts)
+        hashes.append(word_hashes)
+        rows.append(word_rows)
+        same_row = word_rows[:-1] == word_rows[1:]
+        hashes.append((word_hashes[:-1] * _CHAR_BASE + word_hashes[1:] + np.uint64(1))[same_row])
+        rows.append(word_rows[:-1][same_row])
+
+    # Character n-grams; texts are padded with spaces so word edges count
+    encoded = [text.encode('utf-8') for text in texts]
+    lengths = np.fromiter((len(data) for data in encoded), dtype=np.int64, count=count)
+    data = np.frombuffer(b''.join(encoded), dtype=np.uint8).astype(np.uint64)
+    byte_rows = np.repeat(np.arange(count), lengths)
+    remaining = np.repeat(np.cumsum(lengths), lengths) - np.arange(len(data))  # bytes left in the message
+    low, high = char_ngrams
+    rolling = np.zeros(len(data), dtype=np.uint64)
+    for size in range(1, min(high, len(data)) + 1):
+        # rolling[i] now covers data[i:i + size]
+        rolling = rolling[:len(data) - size + 1] * _CHAR_BASE + data[size - 1:]
+        if size >= low:
+            valid = remaining[:len(rolling)] >= size
+            hashes.append(rolling[valid] + np.uint64(size << 56))
+            rows.append(byte_rows[:len(rolling)][valid])
+
+    offsets = np.zeros(count + 1, dtype=np.int64)
+    if not hashes:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32), offsets
+    hashes = _mix(np.concatenate(hashes))
+    rows = np.concatenate(rows)
+    keys = (rows << feature_bits) | (hashes >> np.uint64(64 - feature_bits)).astype(np.int64)
+    signs = np.where(hashes & np.uint64(1), 1.0, -1.0)
+    keys, inverse = np.unique(keys, return_inverse=True)
+    values = np.bincount(inverse, weights=signs, minlength=len(keys))
+    values = np.sign(values) * np.log1p(np.abs(values))
+    keep = values != 0
+    keys, values = keys[keep], values[keep]
+    rows = keys >> feature_bits
+    norms = np.sqrt(np.bincount(rows, weights=values * values, minlength=count))
+    values /= norms[rows]
+    np.cumsum(np.bincount(rows, minlength=count), out=offsets[1:])
+    return keys & ((1 << feature_bits) - 1), values.astype(np.float32), offsets
+
+
+def _scores(weights: np.ndarray, bias: np.ndarray, indices: np.ndarray, values: np.ndarray,
+            offsets: np.ndarray) -> np.ndarray:
+    """Linear scores (rows x classes) of a CSR batch"""
+    scores = np.tile(bias, (len(offsets) - 1, 1))
+    if len(indices):
+        weighted = weights[indices].astype(np.float32) * values[:, None]
+        nonempty = offsets[1:] > offsets[:-1]
+        scores[nonempty] += np.add.reduceat(weighted, offsets[:-1][nonempty], axis=0)
+    return scores
+
+
+def _softmax(scores: np.ndarray) -> np.ndarray:
+    scores = scores - scores.max(axis=1, keepdims=True)
+    np.exp(scores, out=scores)
+    scores /= scores.sum(axis=1, keepdims=True)
+    return scores
+
+
+class NgramClassifier:
+    """
+    Linear softmax classifier over hashed n-gram features.
+
+    predict() takes a batch of messages and returns (intent, probability)
+    per message. min_confidence is the probability below which
+    ChatbotEngine ignores the prediction and uses regex scoring instead.
+    """
+
+    def __init__(self, classes: Sequence[str], weights: np.ndarray, bias: np.ndarray,
+                 feature_bits: int = DEFAULT_FEATURE_BITS, char_ngrams: Tuple[int, int] = DEFAULT_CHAR_NGRAMS,
+                 min_confidence: float = DEFAULT_MIN_CONFIDENCE, info: Optional[Dict] = None):
+        self.classes = list(classes)
+        self.weights = weights
+        self.bias = np.asarray(bias, dtype=np.float32)
+        self.feature_bits = feature_bits
+        self.char_ngrams = tuple(char_ngrams)
+        self.min_confidence = min_confidence
+        self.info = info or {}
+
+    def probabilities(self, messages: Sequence[str]) -> np.ndarray:
+        indices, values, offsets = feature_matrix(messages, self.feature_bits, self.char_ngrams)
+        return _softmax(_scores(self.weights, self.bias, indices, values, offsets))
+
+    def predict(self, messages: Sequence[str]) -> List[Tuple[str, float]]:
+        if not messages:
+            return []
+        probabilities = self.probabilities(messages)
+        best = probabilities.argmax(axis=1)
+        confidence = probabilities[np.arange(len(best)), best]
+        return [(self.classes[label], float(probability)) for label, probability in zip(best, confidence)]
+
+    # -- model file --------------------------------------------------------
+
+    def save(self, path: str, dtype: str = 'float16'):
+        """
+        Write the model file: magic, header length, JSON header, then the
+        weight matrix and bias as raw little-endian arrays. Written to a
+        temporary file and renamed, so processes with the old model mapped
+        keep reading a consistent file.
+        """
+        weights = np.ascontiguousarray(self.weights, dtype=np.dtype(dtype).newbyteorder('<'))
+        bias = np.ascontiguousarray(self.bias, dtype='<f4')
+        header = dict(self.info, format=FORMAT_VERSION, classes=self.classes, feature_bits=self.feature_bits,
+                      char_ngrams=list(self.char_ngrams), min_confidence=self.min_confidence, dtype=dtype)
+        header_bytes = json.dumps(header, sort_keys=True).encode('utf-8')
+        weights_offset = -(-(len(MAGIC) + 4 + len(header_bytes)) // _ALIGN) * _ALIGN
+        temp = path + '.tmp'
+        with open(temp, 'wb') as f:
+            f.write(MAGIC + struct.pack('<I', len(header_bytes)) + header_bytes)
+            f.write(b'\0' * (weights_offset - f.tell()))
+            f.write(weights.tobytes())
+            f.write(bias.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'NgramClassifier':
+        """Open a model file; the weight matrix is memory-mapped read-only"""
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'{path} is not an n-gram classifier model')
+            (header_length,) = struct.unpack('<I', f.read(4))
+            header = json.loads(f.read(header_length).decode('utf-8'))
+        if header.get('format') != FORMAT_VERSION:
+            raise ValueError(f"{path}: unsupported model format {header.get('format')!r}")
+        classes = header.pop('classes')
+        feature_bits = header.pop('feature_bits')
+        dtype = np.dtype(header.pop('dtype')).newbyteorder('<')
+        shape = (1 << feature_bits, len(classes))
+        weights_offset = -(-(len(MAGIC) + 4 + header_length) // _ALIGN) * _ALIGN
+        weights = np.memmap(path, dtype=dtype, mode='r', offset=weights_offset, shape=shape)
+        bias = np.fromfile(path, dtype='<f4', count=len(classes), offset=weights_offset + weights.nbytes)
+        return cls(classes, weights, bias, feature_bits, tuple(header.pop('char_ngrams')),
+                   header.pop('min_confidence'), header)
+
+
+def read_history(paths: Iterable[str], exclude_intents: Iterable[str] = ()) -> Iterable[Tuple[str, str]]:
+    """
+    (message, intent) pairs from chat history exports: NDJSON or CSV from
+    /api/export/chat-messages, or the archive's .ndjson.gz partitions.
+    Rows without a message or intent are skipped.
+    """
+    excluded = set(exclude_intents)
+    for path in paths:
+        compressed = path.endswith('.gz')
+        with (gzip.open if compressed else open)(path, 'rt', encoding='utf-8', newline='') as stream:
+            if (path[:-3] if compressed else path).endswith('.csv'):
+                rows = csv.DictReader(stream)
+            else:
+                rows = (json.loads(line) for line in stream if line.strip())
+            for row in rows:
+                message, intent = row.get('message'), row.get('intent')
+                if message and intent and intent not in excluded:
+                    yield message, intent
+
+
+def train(samples: Iterable[Tuple[str, str]], feature_bits: int = DEFAULT_FEATURE_BITS,
+          char_ngrams: Tuple[int, int] = DEFAULT_CHAR_NGRAMS, epochs: int = 5, batch_size: int = 128,
+          learning_rate: float = 0.5, l2: float = 1e-6, holdout: float = 0.1, seed: int = 0,
+          min_confidence: float = DEFAULT_MIN_CONFIDENCE) -> NgramClassifier:
+    """
+    Fit a classifier to (message, intent) pairs with mini-batch AdaGrad on
+    the softmax loss. Only the weight rows a batch touches are updated.
+    A holdout fraction is kept aside and its accuracy stored in the model.
+    """
+    samples = [(message, intent) for message, intent in samples if message and intent]
+    if not samples:
+        raise ValueError('no labelled messages to train on')
+    rng = random.Random(seed)
+    rng.shuffle(samples)
+    held = int(len(samples) * holdout) if len(samples) >= 20 else 0
+    test, samples = samples[:held], samples[held:]
+
+    classes = sorted({intent for _, intent in samples})
+    label_of = {intent: label for label, intent in enumerate(classes)}
+    indices, values, offsets = feature_matrix([message for message, _ in samples], feature_bits, char_ngrams)
+    labels = np.array([label_of[intent] for _, intent in samples], dtype=np.int64)
+
+    weights = np.zeros((1 << feature_bits, len(classes)), dtype=np.float32)
+    bias = np.zeros(len(classes), dtype=np.float32)
+    weight_history = np.full_like(weights, 1e-8)
+    bias_history = np.full_like(bias, 1e-8)
+    order = np.arange(len(samples))
+    numpy_rng = np.random.default_rng(seed)
+
+    for _ in range(epochs):
+        numpy_rng.shuffle(order)
+        for start in range(0, len(order), batch_size):
+            rows = order[start:start + batch_size]
+            lengths = offsets[rows + 1] - offsets[rows]
+            positions = np.repeat(offsets[rows] - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+            batch_indices = indices[positions]
+            batch_values = values[positions]
+            batch_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=batch_offsets[1:])
+
+            delta = _softmax(_scores(weights, bias, batch_indices, batch_values, batch_offsets))
+            delta[np.arange(len(rows)), labels[rows]] -= 1.0
+            delta /= len(rows)
+
+            touched, inverse = np.unique(batch_indices, return_inverse=True)
+            row_of_value = np.repeat(np.arange(len(rows)), lengths)
+            gradient = np.empty((len(touched), len(classes)), dtype=np.float32)
+            for label in range(len(classes)):
+                gradient[:, label] = np.bincount(inverse, weights=batch_values * delta[row_of_value, label],
+                                                 minlength=len(touched))
+            gradient += l2 * weights[touched]
+            weight_history[touched] += gradient * gradient
+            weights[touched] -= learning_rate * gradient / np.sqrt(weight_history[touched])
+
+            bias_gradient = delta.sum(axis=0)
+            bias_history += bias_gradient * bias_gradient
+            bias -= learning_rate * bias_gradient / np.sqrt(bias_history)
+
+    info = {
+        'trained_at': datetime.utcnow().isoformat(),
+        'samples': len(samples),
+        'class_counts': {intent: int(count) for intent, count in zip(classes, np.bincount(labels, minlength=len(classes)))}
+    }
+    model = NgramClassifier(classes, weights, bias, feature_bits, char_ngrams, min_confidence, info)
+    if test:
+        predicted = model.predict([message for message, _ in test])
+        model.info['holdout_samples'] = len(test)
+        model.info['holdout_accuracy'] = round(
+            sum(intent == expected for (intent, _), (_, expected) in zip(predicted, test)) / len(test), 4
+        )
+    return model
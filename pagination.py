@@ -0,0 +1,156 @@
+import base64
+import csv
+import heapq
+import io
+import json
+from itertools import islice
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Table, select, tuple_
+from database import db
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+EXPORT_CHUNK_SIZE = 1000
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
+
+
+def encode_cursor(created_at: datetime, row_id) -> str:
+    raw = json.dumps([created_at.isoformat(), row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str, id_type: type = int) -> Tuple[datetime, object]:
+    """
+    Inverse of encode_cursor; raises ValueError for a malformed cursor or
+    one whose id is not an id_type (int ids, or str for session ids)
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+        created_at = datetime.fromisoformat(created_at)
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise ValueError('invalid cursor')
+    if not isinstance(row_id, id_type) or isinstance(row_id, bool):
+        raise ValueError('invalid cursor')
+    return created_at, row_id
+
+
+def _keyset(table: Table, filters: Sequence, after: Optional[Tuple[datetime, object]], descending: bool):
+    key = tuple_(table.c.created_at, table.c.id)
+    query = select(table).where(table.c.created_at.isnot(None), *filters)
+    if after is not None:
+        query = query.where(key < tuple_(*after) if descending else key > tuple_(*after))
+    if descending:
+        return query.order_by(table.c.created_at.desc(), table.c.id.desc())
+    return query.order_by(table.c.created_at, table.c.id)
+
+
+def _row_key(row):
+    return row.created_at, row.id
+
+
+def keyset_page(table: Table, filters: Sequence = (), cursor: Optional[str] = None,
+                limit: int = DEFAULT_PAGE_SIZE, descending: bool = True, archive=None) -> Tuple[List, Optional[str]]:
+    """
+    One page of rows ordered by (created_at, id), newest first by default,
+    and the cursor for the next page (None on the last page). Rows are
+    plain Core rows; no ORM objects are built.
+
+    archive, if given, supplies older rows kept outside the table (see
+    chat_archive.ArchiveSource); it is only read when the page reaches
+    back into the archived range.
+    """
+    after = decode_cursor(cursor, table.c.id.type.python_type) if cursor else None
+    rows = db.session.execute(_keyset(table, filters, after, descending).limit(limit + 1)).fetchall()
+    if archive is not None:
+        newest = archive.newest_key()
+        if newest is not None and not (descending and len(rows) > limit and _row_key(rows[limit]) > newest):
+            merged = heapq.merge(rows, archive.rows(after, descending), key=_row_key, reverse=descending)
+            rows = list(islice(merged, limit + 1))
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].created_at, rows[-1].id)
+
+
+def iter_rows(table: Table, filters: Sequence = (), chunk_size: int = EXPORT_CHUNK_SIZE,
+              archive=None) -> Iterator:
+    """
+    Every matching row, oldest first, fetched in keyset chunks. Each chunk
+    is its own short read transaction, so long exports neither hold
+    memory nor pin the WAL. Archived rows, if any, are merged in order.
+    """
+    if archive is not None and archive.newest_key() is not None:
+        yield from heapq.merge(archive.rows(None, False), iter_rows(table, filters, chunk_size), key=_row_key)
+        return
+    after = None
+    while True:
+        rows = db.session.execute(_keyset(table, filters, after, False).limit(chunk_size)).fetchall()
+        db.session.rollback()
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        after = (rows[-1].created_at, rows[-1].id)
+
+
+def export_lines(rows: Iterator, serialize: Callable[[object], Dict], fmt: str,
+                 fieldnames: Sequence[str], batch: int = 200) -> Iterator[str]:
+    """Serialize rows as NDJSON or CSV text, yielding a few hundred rows at a time"""
+    if fmt == 'ndjson':
+        lines = []
+        for row in rows:
+            lines.append(json.dumps(serialize(row)))
+            if len(lines) >= batch:
+                yield '\n'.join(lines) + '\n'
+                lines = []
+        if lines:
+            yield '\n'.join(lines) + '\n'
+        return
+
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fieldnames, extrasaction='ignore')
+    writer.writeheader()
+    count = 0
+    for row in rows:
+        writer.writerow(serialize(row))
+        count += 1
+        if count % batch == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def page_args(args) -> Tuple[int, Optional[str]]:
+    """(limit, cursor) from request args, limit clamped to MAX_PAGE_SIZE"""
+    limit = min(max(args.get('limit', DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    return limit, args.get('cursor') or None
+
+
+def time_bounds(args) -> Dict[str, datetime]:
+    """Parsed ISO 8601 since/until args, where given"""
+    bounds = {}
+    for name in ('since', 'until'):
+        value = args.get(name)
+        if value:
+            try:
+                bounds[name] = datetime.fromisoformat(value)
+            except ValueError:
+                raise ValueError(f'{name} must be an ISO 8601 timestamp')
+    return bounds
+
+
+def time_filters(table: Table, args) -> List:
+    """created_at range filters from ISO 8601 since/until args"""
+    bounds = time_bounds(args)
+    filters = []
+    if 'since' in bounds:
+        filters.append(table.c.created_at >= bounds['since'])
+    if 'until' in bounds:
+        filters.append(table.c.created_at < bounds['until'])
+    return filters
@@ -0,0 +1,339 @@
+import random
+import re
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import bindparam, event, inspect, select
+from sqlalchemy.orm import Session
+from chatbot import db, HazardReport
+from geohash import haversine_m
+from keyword_index import fold
+from location_extractor import LocationExtractor
+
+NUM_PERMUTATIONS = 60
+BAND_ROWS = 3                   # 20 bands of 3 rows: a 0.5-similar pair is a candidate 93% of the time
+DEFAULT_THRESHOLD = 0.5         # Jaccard similarity that counts as a duplicate
+DEFAULT_MAX_DISTANCE_M = 250.0  # reports further apart are never duplicates
+DEFAULT_WINDOW_HOURS = 72       # only recent reports are matched against
+DEFAULT_SYNC_INTERVAL = 1.0     # seconds between checks for reports from other processes
+STATUS_SYNC_SLACK = timedelta(seconds=5)  # overlap between status checks, for commits still in flight
+CLOSED_STATUSES = ('resolved', 'closed', 'rejected')
+
+_PRIME = (1 << 61) - 1
+_rng = random.Random(0x5AFE)
+_PERMUTATIONS = tuple((_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERMUTATIONS))
+
+_STOP_WORDS = frozenset((
+    'a', 'an', 'the', 'and', 'or', 'of', 'to', 'in', 'on', 'at', 'near', 'by', 'for', 'with', 'is', 'are',
+    'was', 'there', 'this', 'that', 'it', 'its', 'has', 'have', 'been', 'be', 'some', 'very', 'please',
+    'my', 'i', 'we', 'our'
+))
+
+_WORD = re.compile(r'\w+')
+_extractor = LocationExtractor()
+
+
+def shingles(description: str, address: Optional[str] = None) -> FrozenSet[str]:
+    """
+    Words of the description (stop words dropped, street suffixes and
+    directions abbreviated) plus the words of the normalized location,
+    taken from address or, failing that, extracted from the description.
+    Single words rather than n-grams, since reports are short and word
+    order varies between reporters.
+    """
+    gazetteer = _extractor.gazetteer
+    result = set()
+    for word in _WORD.findall(fold(description or '')):
+        if word not in _STOP_WORDS:
+            result.add(gazetteer.suffixes.get(word) or gazetteer.directions.get(word) or word)
+    location = address or _extractor.extract(description or '')
+    if location:
+        result.update(f'loc:{word}' for word in _extractor.normalize(location).split())
+    return frozenset(result)
+
+
+def signature(shingle_set: Iterable[str]) -> Tuple[int, ...]:
+    hashes = [zlib.crc32(shingle.encode('utf-8')) for shingle in shingle_set]
+    return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS)
+
+
+def _bands(sig: Tuple[int, ...]) -> List[Tuple[int, Tuple[int, ...]]]:
+    return [(band, sig[start:start + BAND_ROWS])
+            for band, start in enumerate(range(0, NUM_PERMUTATIONS, BAND_ROWS))]
+
+
+class _Entry:
+    __slots__ = ('id', 'cluster', 'shingles', 'bands', 'lat', 'lng', 'created_at')
+
+    def __init__(self, report_id: int, cluster: int, shingle_set: FrozenSet[str], bands, lat, lng, created_at):
+        self.id = report_id
+        self.cluster = cluster
+        self.shingles = shingle_set
+        self.bands = bands
+        self.lat = lat
+        self.lng = lng
+        self.created_at = created_at
+
+
+class DuplicateMatch:
+    __slots__ = ('report_id', 'cluster', 'similarity', 'distance_m')
+
+    def __init__(self, report_id: int, cluster: int, similarity: float, distance_m: Optional[float]):
+        self.report_id = report_id
+        self.cluster = cluster
+        self.similarity = similarity
+        self.distance_m = distance_m
+
+    def to_dict(self) -> Dict:
+        return {
+            'report_id': self.report_id,
+            'duplicate_of': self.cluster,
+            'similarity': round(self.similarity, 3),
+            'distance_m': round(self.distance_m, 1) if self.distance_m is not None else None
+        }
+
+
+class NearDuplicateIndex:
+    """
+    MinHash/LSH index over recent open hazard reports.
+
+    Each report is reduced to a set of description and location shingles
+    and a 60-value MinHash signature split into 20 LSH bands. A lookup
+    hashes the new report, gathers reports sharing any band, and confirms
+    them by exact Jaccard similarity and by location: coordinates within
+    max_distance_m when both have them, otherwise at least one shared
+    location word. Reports without a location never match. A match joins
+    the cluster of the earliest report, whose id is stored in
+    HazardReport.duplicate_of.
+
+    Reports committed in this process are added as they commit, and
+    dropped when their status moves to a closed one; reports and status
+    changes from other processes are picked up every sync_interval
+    seconds. Entries older than window_hours fall out of the index.
+    """
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, max_distance_m: float = DEFAULT_MAX_DISTANCE_M,
+                 window_hours: float = DEFAULT_WINDOW_HOURS, sync_interval: float = DEFAULT_SYNC_INTERVAL):
+        self.threshold = threshold
+        self.max_distance_m = max_distance_m
+        self.window = timedelta(hours=window_hours)
+        self.sync_interval = sync_interval
+        self._entries: Dict[int, _Entry] = {}
+        self._buckets: Dict[Tuple[int, Tuple[int, ...]], Set[int]] = {}
+        self._last_id = 0
+        self._synced_at = None
+        self._status_synced_at: Optional[datetime] = None
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, report_id: int, description: str, address: Optional[str] = None, lat: Optional[float] = None,
+            lng: Optional[float] = None, created_at: Optional[datetime] = None, cluster: Optional[int] = None):
+        shingle_set = shingles(description, address)
+        if not shingle_set:
+            return
+        entry = _Entry(report_id, cluster or report_id, shingle_set, _bands(signature(shingle_set)),
+                       lat, lng, created_at or datetime.utcnow())
+        with self._lock:
+            if report_id in self._entries:
+                return
+            self._entries[report_id] = entry
+            for band in entry.bands:
+                self._buckets.setdefault(band, set()).add(report_id)
+            self._last_id = max(self._last_id, report_id)
+
+    def _remove(self, entry: _Entry):
+        del self._entries[entry.id]
+        for band in entry.bands:
+            bucket = self._buckets.get(band)
+            if bucket is not None:
+                bucket.discard(entry.id)
+                if not bucket:
+                    del self._buckets[band]
+
+    def discard(self, report_id: int):
+        with self._lock:
+            entry = self._entries.get(report_id)
+            if entry is not None:
+                self._remove(entry)
+
+    def prune(self, now: Optional[datetime] = None):
+        cutoff = (now or datetime.utcnow()) - self.window
+        with self._lock:
+            for entry in [entry for entry in self._entries.values() if entry.created_at < cutoff]:
+                self._remove(entry)
+
+    def find(self, description: str, address: Optional[str] = None, lat: Optional[float] = None,
+             lng: Optional[float] = None, now: Optional[datetime] = None) -> Optional[DuplicateMatch]:
+        """Best matching report created in the window up to now (default: the current time), or None"""
+        shingle_set = shingles(description, address)
+        if not shingle_set:
+            return None
+        now = now or datetime.utcnow()
+        cutoff = now - self.window
+        locations = frozenset(shingle for shingle in shingle_set if shingle.startswith('loc:'))
+        best = None
+        with self._lock:
+            candidates = set()
+            for band in _bands(signature(shingle_set)):
+                candidates.update(self._buckets.get(band, ()))
+            for report_id in candidates:
+                entry = self._entries[report_id]
+                if entry.created_at < cutoff or entry.created_at > now:
+                    continue
+                distance = None
+                if None not in (lat, lng, entry.lat, entry.lng):
+                    distance = haversine_m(lat, lng, entry.lat, entry.lng)
+                    if distance > self.max_distance_m:
+                        continue
+                elif not locations & entry.shingles:
+                    # Without coordinates on both, only a shared place name ties them together
+                    continue
+                similarity = len(shingle_set & entry.shingles) / len(shingle_set | entry.shingles)
+                if similarity >= self.threshold and (best is None or similarity > best.similarity or
+                                                     (similarity == best.similarity and report_id < best.report_id)):
+                    best = DuplicateMatch(report_id, entry.cluster, similarity, distance)
+        return best
+
+    def _add_rows(self, rows):
+        for row in rows:
+            self.add(row.id, row.description, row.address, row.location_lat, row.location_lng,
+                     row.created_at, row.duplicate_of)
+
+    def sync(self, force: bool = False):
+        """
+        Load reports created since the last sync (by any process), apply
+        status changes to indexed ones and drop expired ones
+        """
+        now = time.monotonic()
+        if not force and self._synced_at is not None and now - self._synced_at < self.sync_interval:
+            return
+        self._synced_at = now
+        changed_since, self._status_synced_at = self._status_synced_at, datetime.utcnow()
+        cutoff = self._status_synced_at - self.window
+        table = HazardReport.__table__
+        columns = (table.c.id, table.c.description, table.c.address, table.c.location_lat,
+                   table.c.location_lng, table.c.created_at, table.c.duplicate_of)
+        query = select(*columns).where(
+            table.c.id > self._last_id,
+            table.c.created_at >= cutoff,
+            table.c.status.notin_(CLOSED_STATUSES)
+        ).order_by(table.c.id)
+        # Own connection: this may run inside a session flush
+        with db.engine.connect() as connection:
+            last_id = self._last_id
+            self._add_rows(connection.execute(query))
+            if changed_since is not None:
+                # Reports already seen whose status was changed since the last sync
+                changed = select(*columns, table.c.status).where(
+                    table.c.id <= last_id,
+                    table.c.created_at >= cutoff,
+                    table.c.updated_at >= changed_since - STATUS_SYNC_SLACK
+                )
+                for row in connection.execute(changed):
+                    if row.status in CLOSED_STATUSES:
+                        self.discard(row.id)
+                    else:
+                        self._add_rows((row,))
+        self.prune()
+
+
+report_dedup = NearDuplicateIndex()
+
+
+def cluster_backlog(since: Optional[datetime] = None, chunk_size: int = 1000,
+                    index: Optional[NearDuplicateIndex] = None) -> Dict:
+    """
+    Cluster existing reports in id order, matching each against the
+    reports from the window before it. Sets duplicate_of on reports that
+    have none. Needs an app context.
+    """
+    index = index or NearDuplicateIndex()
+    table = HazardReport.__table__
+    update = table.update().where(table.c.id == bindparam('report_id')).values(
+        duplicate_of=bindparam('duplicate_of')
+    )
+    conditions = [table.c.status.notin_(CLOSED_STATUSES)]
+    if since is not None:
+        conditions.append(table.c.created_at >= since)
+
+    stats = {'reports': 0, 'duplicates': 0}
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(table.c.id, table.c.description, table.c.address, table.c.location_lat,
+                   table.c.location_lng, table.c.created_at, table.c.duplicate_of)
+            .where(table.c.id > last_id, *conditions).order_by(table.c.id).limit(chunk_size)
+        ).fetchall()
+        if not rows:
+            break
+        updates = []
+        for row in rows:
+            cluster = row.duplicate_of
+            if cluster is None:
+                match = index.find(row.description, row.address, row.location_lat, row.location_lng,
+                                   now=row.created_at)
+                if match is not None:
+                    cluster = match.cluster
+                    updates.append({'report_id': row.id, 'duplicate_of': cluster})
+            index.add(row.id, row.description, row.address, row.location_lat, row.location_lng,
+                      row.created_at, cluster)
+        index.prune(rows[-1].created_at)
+        if updates:
+            db.session.execute(update, updates)
+        db.session.commit()
+        stats['reports'] += len(rows)
+        stats['duplicates'] += len(updates)
+        last_id = rows[-1].id
+    return stats
+
+
+@event.listens_for(Session, 'before_flush')
+def _flag_duplicates(session, flush_context, instances):
+    reports = [obj for obj in session.new if isinstance(obj, HazardReport) and obj.duplicate_of is None]
+    if not reports:
+        return
+    report_dedup.sync()
+    for report in sorted(reports, key=lambda report: report.created_at or datetime.utcnow()):
+        match = report_dedup.find(report.description, report.address,
+                                  report.location_lat, report.location_lng, now=report.created_at)
+        if match is not None:
+            report.duplicate_of = match.cluster
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_new_reports(session, flush_context):
+    for obj in session.new:
+        if isinstance(obj, HazardReport):
+            session.info.setdefault('new_hazard_reports', []).append(
+                (obj.id, obj.description, obj.address, obj.location_lat, obj.location_lng,
+                 obj.created_at, obj.duplicate_of)
+            )
+    for obj in session.dirty:
+        if isinstance(obj, HazardReport) and inspect(obj).attrs.status.history.has_changes():
+            session.info.setdefault('hazard_report_statuses', []).append(
+                (obj.status in CLOSED_STATUSES,
+                 (obj.id, obj.description, obj.address, obj.location_lat, obj.location_lng,
+                  obj.created_at, obj.duplicate_of))
+            )
+
+
+@event.listens_for(Session, 'after_commit')
+def _index_on_commit(session):
+    for report_id, description, address, lat, lng, created_at, cluster in session.info.pop('new_hazard_reports', ()):
+        report_dedup.add(report_id, description, address, lat, lng, created_at, cluster)
+    for closed, report in session.info.pop('hazard_report_statuses', ()):
+        if closed:
+            report_dedup.discard(report[0])
+        else:
+            report_dedup.add(*report)  # reopened; pruned later if already out of the window
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_on_rollback(session):
+    session.info.pop('new_hazard_reports', None)
+    session.info.pop('hazard_report_statuses', None)
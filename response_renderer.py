@@ -0,0 +1,134 @@
+import json
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+HAZARD_CATEGORY_NAMES = {
+    'road_traffic': 'Road/Traffic Hazard',
+    'infrastructure': 'Infrastructure Issue',
+    'environmental': 'Environmental Concern',
+    'public_safety': 'Public Safety Issue'
+}
+
+HIGH_PRIORITY_EMERGENCIES = ('medical', 'fire', 'crime')
+
+# Key used for hazard categories that have no display name
+_GENERAL_CATEGORY = object()
+
+
+class FrozenDict(dict):
+    """Read-only dict; still a dict, so it serializes like one"""
+
+    __slots__ = ()
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('FrozenDict is read-only')
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __hash__(self):
+        return hash(tuple(sorted(self.items())))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return FrozenDict, (dict(self),)
+
+
+class RenderedTemplate:
+    """One precomputed response variant and its serialized fragments"""
+
+    __slots__ = ('head', 'tail', 'message', 'message_json', 'quick_actions', 'quick_actions_json')
+
+    def __init__(self, message: str, category_name: Optional[str], quick_actions):
+        self.head = message
+        self.tail = f"\n\n📋 **Category**: {category_name}" if category_name else ''
+        self.message = self.head + self.tail
+        self.message_json = json.dumps(self.message)
+        self.quick_actions = tuple(FrozenDict(action) for action in quick_actions)
+        self.quick_actions_json = json.dumps(list(self.quick_actions))
+
+
+class ResponseRenderer:
+    """
+    Precomputed response templates for ChatbotEngine.generate_response.
+
+    Every combination of intent, emergency priority and hazard category is
+    rendered once at startup, together with its JSON fragments. Per request
+    only the location line, entities, timestamp and confidence are spliced
+    in. quick_actions are shared tuples of read-only dicts, so callers cannot
+    corrupt the templates, and entities are returned as a read-only copy, so
+    a response reused for repeated messages cannot be changed either.
+    """
+
+    def __init__(self, responses: Dict):
+        self.templates: Dict[Tuple, RenderedTemplate] = {}
+        categories = [None, _GENERAL_CATEGORY, *HAZARD_CATEGORY_NAMES]
+        for intent, config in responses.items():
+            variants = {None: config} if 'message' in config else config
+            for variant, response_data in variants.items():
+                for category in categories:
+                    if category is None:
+                        category_name = None
+                    elif category is _GENERAL_CATEGORY:
+                        category_name = 'General Hazard'
+                    else:
+                        category_name = HAZARD_CATEGORY_NAMES[category]
+                    self.templates[(intent, variant, category)] = RenderedTemplate(
+                        response_data['message'], category_name, response_data.get('quick_actions', [])
+                    )
+        self.intent_json = {intent: json.dumps(intent) for intent in responses}
+
+    def template(self, intent: str, entities: Dict) -> RenderedTemplate:
+        variant = None
+        if intent == 'emergency':
+            if entities.get('emergency_type') in HIGH_PRIORITY_EMERGENCIES:
+                variant = 'high_priority'
+            else:
+                variant = 'medium_priority'
+        elif (intent, None, None) not in self.templates:
+            intent = 'fallback'
+
+        category = entities.get('hazard_category')
+        if not category:
+            category = None
+        elif category not in HAZARD_CATEGORY_NAMES:
+            category = _GENERAL_CATEGORY
+        return self.templates[(intent, variant, category)]
+
+    def render(self, intent: str, entities: Dict) -> Dict:
+        template = self.template(intent, entities)
+        if entities.get('location'):
+            message = f"{template.head}\n\n📍 **Location detected**: {entities['location']}{template.tail}"
+        else:
+            message = template.message
+        return {
+            'message': message,
+            'quick_actions': template.quick_actions,
+            'intent': intent,
+            'entities': FrozenDict(entities),
+            'timestamp': datetime.utcnow().isoformat()
+        }
+
+    def dumps(self, response: Dict) -> str:
+        """
+        Serialize a response produced by render() (plus any extra keys),
+        reusing the cached fragments. Output equals json.dumps(response).
+        """
+        template = self.template(response['intent'], response['entities'])
+        parts = []
+        for key, value in response.items():
+            if key == 'message' and value is template.message:
+                fragment = template.message_json
+            elif key == 'quick_actions' and value is template.quick_actions:
+                fragment = template.quick_actions_json
+            elif key == 'intent' and value in self.intent_json:
+                fragment = self.intent_json[value]
+            else:
+                fragment = json.dumps(value)
+            parts.append(f'{json.dumps(key)}: {fragment}')
+        return '{' + ', '.join(parts) + '}'
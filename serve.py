@@ -0,0 +1,265 @@
+"""
+Production entry point: a pre-fork WSGI server.
+
+    python serve.py --workers 4 --port 5000 [--migrate] [--pid-file PATH]
+
+The master imports the app once, so ChatbotEngine and its compiled
+keyword and location tables are built before forking and the workers
+share them copy-on-write. Workers are forked already warm and begin
+accepting on the shared listening socket at once. The database schema is
+only touched with --migrate (or 'flask migrate').
+
+Signals to the master:
+    TERM, INT   graceful shutdown; workers finish in-flight requests
+    HUP         graceful reload; static files are rescanned, fresh workers are
+                forked and old ones drained
+    USR2        re-exec the master from the current code on the same socket;
+                the new master stops this one once its workers are ready
+"""
+import time
+
+_process_started = time.perf_counter()
+
+import argparse
+import gc
+import importlib
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+from typing import Dict, List, Optional
+
+logger = logging.getLogger('serve')
+
+LISTEN_FD_ENV = 'SERVE_LISTEN_FD'
+OLD_MASTER_ENV = 'SERVE_OLD_MASTER'
+DEFAULT_GRACEFUL_TIMEOUT = 30.0
+READY_TIMEOUT = 10.0
+
+
+def load_app(target: str):
+    if os.getcwd() not in sys.path:
+        sys.path.insert(1, os.getcwd())
+    module_name, _, attribute = target.partition(':')
+    return getattr(importlib.import_module(module_name), attribute or 'app')
+
+
+def _listen(host: str, port: int, backlog: int) -> socket.socket:
+    inherited = os.environ.pop(LISTEN_FD_ENV, None)
+    if inherited is not None:
+        sock = socket.socket(fileno=int(inherited))
+    else:
+        sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, port))
+        sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(app, sock: socket.socket, host: str, port: int, ready_fd: int):
+    """Body of a forked worker; never returns"""
+    from werkzeug.serving import make_server
+    from alert_stream import broadcaster
+    from write_behind import write_behind
+
+    for sig in (signal.SIGHUP, signal.SIGUSR2):
+        signal.signal(sig, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the master handles Ctrl-C
+    status = 0
+    try:
+        server = make_server(host, port, app, threaded=True, fd=sock.fileno())
+        server.daemon_threads = False  # server_close() waits for in-flight requests
+
+        def shutdown():
+            broadcaster.close()  # alert streams never finish on their own
+            server.shutdown()
+
+        signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=shutdown, daemon=True).start())
+        os.write(ready_fd, b'.')
+        os.close(ready_fd)
+        server.serve_forever()
+        server.server_close()
+        write_behind.stop()
+    except BaseException:
+        logger.exception('worker %d failed', os.getpid())
+        status = 1
+    finally:
+        os._exit(status)
+
+
+class Master:
+    def __init__(self, app, sock: socket.socket, host: str, port: int, workers: int,
+                 graceful_timeout: float = DEFAULT_GRACEFUL_TIMEOUT):
+        self.app = app
+        self.sock = sock
+        self.host = host
+        self.port = port
+        self.worker_count = workers
+        self.graceful_timeout = graceful_timeout
+        self.workers: Dict[int, float] = {}      # pid -> start time
+        self.retiring: Dict[int, float] = {}     # pid -> deadline
+        self._signals: List[int] = []
+
+    def _prepare_fork(self):
+        # Move everything built so far out of the GC's reach, so collections
+        # in the workers do not touch, and thereby copy, the shared pages.
+        gc.collect()
+        gc.freeze()
+
+    def spawn(self, count: int) -> float:
+        """Fork count workers and wait until they accept; returns seconds taken"""
+        from database import db
+        started = time.perf_counter()
+        # Drop pooled DB connections first: the master may have opened some
+        # since the last fork (a reload, a migration), and sockets must not
+        # be shared with the workers
+        with self.app.app_context():
+            db.engine.dispose()
+        read_fd, write_fd = os.pipe()
+        for _ in range(count):
+            pid = os.fork()
+            if pid == 0:
+                os.close(read_fd)
+                _run_worker(self.app, self.sock, self.host, self.port, write_fd)
+            self.workers[pid] = time.monotonic()
+        os.close(write_fd)
+        ready = 0
+        deadline = time.monotonic() + READY_TIMEOUT
+        while ready < count and time.monotonic() < deadline:
+            chunk = os.read(read_fd, count)
+            if not chunk:
+                break
+            ready += len(chunk)
+        os.close(read_fd)
+        if ready < count:
+            logger.warning('only %d of %d workers reported ready', ready, count)
+        return time.perf_counter() - started
+
+    def retire(self, pids):
+        deadline = time.monotonic() + self.graceful_timeout
+        for pid in pids:
+            self.workers.pop(pid, None)
+            self.retiring[pid] = deadline
+            self._kill(pid, signal.SIGTERM)
+
+    @staticmethod
+    def _kill(pid: int, sig: int):
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if self.workers.pop(pid, None) is not None:
+                logger.warning('worker %d exited unexpectedly (status %d)', pid, status)
+            self.retiring.pop(pid, None)
+
+    def reload(self):
+        assets = self.app.extensions.get('static_assets')
+        if assets is not None:
+            assets.scan()  # pick up a new frontend build before forking
+        old = list(self.workers)
+        elapsed = self.spawn(self.worker_count)
+        self.retire(old)
+        logger.info('reloaded: %d workers ready in %.1f ms', self.worker_count, elapsed * 1000)
+
+    def reexec(self):
+        """Start a new master from the current code, inheriting the socket"""
+        pid = os.fork()
+        if pid == 0:
+            env = dict(os.environ, **{LISTEN_FD_ENV: str(self.sock.fileno()), OLD_MASTER_ENV: str(os.getppid())})
+            os.execve(sys.executable, [sys.executable] + sys.argv, env)
+        logger.info('started new master %d', pid)
+
+    def _on_signal(self, signum, frame):
+        self._signals.append(signum)
+
+    def run(self):
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGUSR2):
+            signal.signal(sig, self._on_signal)
+        stopping = False
+        while not stopping or self.workers or self.retiring:
+            while self._signals:
+                signum = self._signals.pop(0)
+                if signum in (signal.SIGTERM, signal.SIGINT) and not stopping:
+                    logger.info('shutting down')
+                    stopping = True
+                    self.retire(list(self.workers))
+                elif signum == signal.SIGHUP and not stopping:
+                    self.reload()
+                elif signum == signal.SIGUSR2 and not stopping:
+                    self.reexec()
+            self._reap()
+            now = time.monotonic()
+            for pid, deadline in list(self.retiring.items()):
+                if now > deadline:
+                    logger.warning('worker %d did not stop in time; killing it', pid)
+                    self._kill(pid, signal.SIGKILL)
+                    self.retiring[pid] = now + 5
+            if not stopping and len(self.workers) < self.worker_count:
+                time.sleep(0.5)  # back off before replacing crashed workers
+                self.spawn(self.worker_count - len(self.workers))
+            time.sleep(0.1)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--app', default='main:app', help='WSGI app as module:attribute (default main:app)')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--backlog', type=int, default=2048)
+    parser.add_argument('--graceful-timeout', type=float, default=DEFAULT_GRACEFUL_TIMEOUT)
+    parser.add_argument('--migrate', action='store_true', help='apply schema migrations before serving')
+    parser.add_argument('--pid-file', help='write the master pid here, for sending signals')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(name)s %(process)d] %(message)s')
+
+    phases = {}
+    started = time.perf_counter()
+    import chat_api  # noqa: F401  (builds the shared ChatbotEngine)
+    phases['engine'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    app = load_app(args.app)
+    phases['app'] = time.perf_counter() - started
+
+    if args.migrate:
+        import migrations
+        started = time.perf_counter()
+        with app.app_context():
+            applied = migrations.migrate()
+        phases['migrate'] = time.perf_counter() - started
+        logger.info('applied migrations: %s', applied or 'none')
+
+    sock = _listen(args.host, args.port, args.backlog)
+    master = Master(app, sock, args.host, args.port, args.workers, args.graceful_timeout)
+    master._prepare_fork()
+    phases['workers'] = master.spawn(args.workers)
+    phases['total'] = time.perf_counter() - _process_started
+
+    logger.info('startup: %s', ', '.join(f'{name} {seconds * 1000:.1f} ms' for name, seconds in phases.items()))
+    logger.info('%d workers listening on %s:%d', args.workers, args.host, args.port)
+
+    if args.pid_file:
+        with open(args.pid_file, 'w') as f:
+            f.write(f'{os.getpid()}\n')
+    old_master = os.environ.pop(OLD_MASTER_ENV, None)
+    if old_master:
+        Master._kill(int(old_master), signal.SIGTERM)
+    master.run()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
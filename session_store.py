@@ -0,0 +1,291 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import bindparam, func, select
+from sqlalchemy.exc import IntegrityError
+from chatbot import db, UserSession
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_SESSIONS = 10000
+DEFAULT_TTL = 1800.0            # seconds of inactivity before a session is dropped
+DEFAULT_FLUSH_INTERVAL = 30.0   # seconds between background persists
+
+
+class SessionState:
+    """Cached view of one UserSession with parsed preferences"""
+
+    __slots__ = ('id', 'created_at', 'last_active', 'preferences', 'context',
+                 'expires', 'dirty', 'preferences_dirty')
+
+    def __init__(self, session_id: str, created_at: Optional[datetime], last_active: Optional[datetime],
+                 preferences: Dict):
+        self.id = session_id
+        self.created_at = created_at
+        self.last_active = last_active
+        self.preferences = preferences
+        self.context: Dict = {}   # conversation context; in memory only
+        self.expires = 0.0
+        self.dirty = False
+        self.preferences_dirty = False
+
+    def to_dict(self) -> Dict:
+        """Same shape as UserSession.to_dict, without re-parsing preferences"""
+        return {
+            'id': self.id,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'last_active': self.last_active.isoformat() if self.last_active else None,
+            'preferences': dict(self.preferences)
+        }
+
+
+class SessionStore:
+    """
+    Bounded per-process cache of active sessions.
+
+    Sessions are loaded once, kept in LRU order and dropped after ttl
+    seconds without access or when max_sessions is exceeded. Activity and
+    preference changes are held in memory and written back in one batched
+    UPDATE every flush_interval seconds; changed sessions that are evicted
+    or expire are kept aside until that write succeeds. While running, the
+    store is UserSession.activity_writer, so update_activity() on a cached
+    session costs no query.
+    """
+
+    def __init__(self, app=None, **options):
+        self.app = None
+        self.max_sessions = options.get('max_sessions', DEFAULT_MAX_SESSIONS)
+        self.ttl = options.get('ttl', DEFAULT_TTL)
+        self.flush_interval = options.get('flush_interval', DEFAULT_FLUSH_INTERVAL)
+        self._sessions: 'OrderedDict[str, SessionState]' = OrderedDict()
+        self._evicted: Dict[str, SessionState] = {}   # dropped from the cache, not yet persisted
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._fallback_writer = None
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Configure from app.config (SESSION_CACHE_MAX_SESSIONS,
+        SESSION_CACHE_TTL, SESSION_CACHE_FLUSH_INTERVAL) and start the store
+        if SESSION_CACHE_ENABLED is set.
+        """
+        self.app = app
+        config = app.config
+        self.max_sessions = config.get('SESSION_CACHE_MAX_SESSIONS', self.max_sessions)
+        self.ttl = config.get('SESSION_CACHE_TTL', self.ttl)
+        self.flush_interval = config.get('SESSION_CACHE_FLUSH_INTERVAL', self.flush_interval)
+        app.extensions['session_store'] = self
+        if config.get('SESSION_CACHE_ENABLED'):
+            self.start()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    # -- access ------------------------------------------------------------
+
+    def get(self, session_id: str, create: bool = True) -> Optional[SessionState]:
+        """
+        The cached session, loading it (or creating the row, if create) on
+        a miss. Needs an app context on a miss.
+        """
+        now = time.monotonic()
+        with self._lock:
+            state = self._sessions.get(session_id)
+            if state is not None:
+                self._sessions.move_to_end(session_id)
+                state.expires = now + self.ttl
+                self.hits += 1
+                return state
+            self.misses += 1
+            # Evicted with unsaved changes: take it back rather than read a stale row
+            state = self._evicted.pop(session_id, None)
+            if state is not None:
+                self._cache(state, now)
+                return state
+
+        state = self._load(session_id, create)
+        if state is None:
+            return None
+        with self._lock:
+            # Another thread may have loaded it meanwhile; keep that copy
+            state = self._sessions.get(session_id) or state
+            self._cache(state, now)
+        return state
+
+    def _cache(self, state: SessionState, now: float):
+        """Make state the most recent entry, setting changed victims aside. Call with the lock held."""
+        self._sessions[state.id] = state
+        self._sessions.move_to_end(state.id)
+        state.expires = now + self.ttl
+        while len(self._sessions) > self.max_sessions:
+            victim = self._sessions.popitem(last=False)[1]
+            if victim.dirty:
+                self._evicted[victim.id] = victim
+
+    def _load(self, session_id: str, create: bool) -> Optional[SessionState]:
+        table = UserSession.__table__
+        row = db.session.execute(select(table).where(table.c.id == session_id)).first()
+        if row is None:
+            if not create:
+                db.session.rollback()
+                return None
+            session = UserSession(id=session_id)
+            db.session.add(session)
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # Created concurrently (e.g. by another worker)
+                db.session.rollback()
+                return self._load(session_id, False)
+            return SessionState(session.id, session.created_at, session.last_active, {})
+        db.session.rollback()
+        preferences = json.loads(row.preferences) if row.preferences else {}
+        return SessionState(row.id, row.created_at, row.last_active, preferences)
+
+    def touch(self, session_id: str, at: datetime = None) -> SessionState:
+        state = self.get(session_id)
+        with self._lock:
+            state.last_active = at or datetime.utcnow()
+            state.dirty = True
+        return state
+
+    def set_preferences(self, session_id: str, preferences: Dict) -> SessionState:
+        state = self.get(session_id)
+        with self._lock:
+            state.preferences = dict(preferences)
+            state.preferences_dirty = state.dirty = True
+        return state
+
+    def touch_session(self, session_id: str, at: datetime = None) -> bool:
+        """UserSession.activity_writer hook: absorb the update if the session is cached"""
+        with self._lock:
+            state = self._sessions.get(session_id)
+            if state is not None:
+                state.last_active = at or datetime.utcnow()
+                state.dirty = True
+                return True
+        fallback = self._fallback_writer
+        return fallback is not None and fallback.touch_session(session_id, at)
+
+    # -- persistence -------------------------------------------------------
+
+    def _persist(self, states: List[SessionState]):
+        if not states:
+            return
+        # Snapshot and clear under the lock, so a change made meanwhile
+        # leaves the session dirty for the next persist
+        with self._lock:
+            rows = [{
+                'session_id': state.id,
+                'last_active': state.last_active,
+                'preferences': json.dumps(state.preferences) if state.preferences_dirty else None
+            } for state in states]
+            for state in states:
+                state.dirty = state.preferences_dirty = False
+
+        table = UserSession.__table__
+        update = table.update().where(table.c.id == bindparam('session_id')).values(
+            last_active=bindparam('last_active'),
+            preferences=func.coalesce(bindparam('preferences'), table.c.preferences)
+        )
+        try:
+            db.session.execute(update, rows)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            with self._lock:
+                for state, row in zip(states, rows):
+                    state.dirty = True
+                    state.preferences_dirty = state.preferences_dirty or row['preferences'] is not None
+            raise
+
+    def flush(self) -> int:
+        """
+        Write every changed session, including evicted and expired ones,
+        and drop expired ones. Sessions dropped from the cache are kept
+        for the next flush if the write fails. Needs an app context.
+        """
+        now = time.monotonic()
+        with self._lock:
+            expired = [session_id for session_id, state in self._sessions.items() if state.expires <= now]
+            for session_id in expired:
+                state = self._sessions.pop(session_id)
+                if state.dirty:
+                    self._evicted[session_id] = state
+            # Dropped sessions first, so a copy loaded again since then is written last
+            dropped = list(self._evicted.values())
+            self._evicted = {}
+            dirty = dropped + [state for state in self._sessions.values() if state.dirty]
+        try:
+            self._persist(dirty)
+        except Exception:
+            with self._lock:
+                for state in dropped:
+                    if state.id not in self._sessions:
+                        self._evicted.setdefault(state.id, state)
+            raise
+        return len(dirty)
+
+    # -- background thread -------------------------------------------------
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='session-store', daemon=True)
+        self._thread.start()
+        if UserSession.activity_writer is not self:
+            self._fallback_writer = UserSession.activity_writer
+            UserSession.activity_writer = self
+        atexit.register(self.stop)
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stop the flush thread and persist everything still pending"""
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+        if UserSession.activity_writer is self:
+            UserSession.activity_writer = self._fallback_writer
+        with self.app.app_context():
+            self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                with self.app.app_context():
+                    self.flush()
+            except Exception:
+                logger.exception('session store flush failed; will retry')
+
+    def _after_fork(self):
+        """A forked child starts empty, with its own flush thread if needed"""
+        was_running = self.running
+        self._sessions = OrderedDict()
+        self._evicted = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        if was_running:
+            self.start()
+
+
+session_store = SessionStore()
+os.register_at_fork(after_in_child=session_store._after_fork)
@@ -0,0 +1,204 @@
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+from typing import Dict, Optional, Tuple
+
+from flask import Response, request, send_file
+
+try:
+    import brotli
+except ImportError:   # brotli variants then come only from prebuilt .br files
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_FILE_SIZE = 512 * 1024        # larger files are served from disk
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024      # in-memory budget, variants included
+MIN_COMPRESS_SIZE = 256
+INDEX_FILE = 'index.html'
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+
+# Content-hashed build output, e.g. index-4f9a2c1b.js or main.3b5e7f01a9.css:
+# at least 8 lowercase hex digits, one of them a digit, right before the
+# extension (so team-photo2024.css is not taken for one)
+_HASHED_NAME = re.compile(r'[.-](?=[0-9a-f]*\d)[0-9a-f]{8,}\.[A-Za-z0-9]+$')
+_COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'application/xml',
+                       'image/svg+xml', 'application/wasm', 'application/manifest+json')
+# Preferred first
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+class StaticAsset:
+    """One file of the static folder, with its validators and encoded variants"""
+
+    __slots__ = ('name', 'path', 'mimetype', 'size', 'etag', 'cache_control', 'body', 'variants')
+
+    def __init__(self, name: str, path: str, mimetype: str, size: int, etag: str, immutable: bool):
+        self.name = name
+        self.path = path
+        self.mimetype = mimetype
+        self.size = size
+        self.etag = etag
+        self.cache_control = IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL
+        self.body: Optional[bytes] = None
+        # encoding -> (bytes in memory, or None to send the file at path)
+        self.variants: Dict[str, Tuple[Optional[bytes], str]] = {}
+
+    def etag_for(self, encoding: Optional[str]) -> str:
+        """Each encoded variant has its own ETag, since its bytes differ"""
+        return self.etag if encoding is None else f'{self.etag}-{encoding}'
+
+
+def _is_compressible(mimetype: str) -> bool:
+    return mimetype.startswith(_COMPRESSIBLE_TYPES)
+
+
+def _digest(path: str) -> str:
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class StaticAssets:
+    """
+    Manifest of the app's static folder, built by scan() at startup and on
+    reload (serve.py HUP), never per request.
+
+    Files up to max_file_size are held in memory, along with gzip and (if
+    the brotli module is installed) brotli variants compressed once at
+    scan time; prebuilt .gz/.br siblings from the frontend build are used
+    as they are. Larger files stay on disk and are streamed. Every asset
+    has a strong ETag from its content. Content-hashed names are cached by
+    clients for a year as immutable; everything else, index.html included,
+    must revalidate, which costs a 304 from memory.
+    """
+
+    def __init__(self, app=None, **options):
+        self.app = None
+        self.folder: Optional[str] = None
+        self.max_file_size = options.get('max_file_size', DEFAULT_MAX_FILE_SIZE)
+        self.max_bytes = options.get('max_bytes', DEFAULT_MAX_BYTES)
+        self._assets: Dict[str, StaticAsset] = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Scan app.static_folder. STATIC_CACHE_MAX_FILE_SIZE and
+        STATIC_CACHE_MAX_BYTES bound what is kept in memory.
+        """
+        self.app = app
+        self.folder = app.static_folder
+        self.max_file_size = app.config.get('STATIC_CACHE_MAX_FILE_SIZE', self.max_file_size)
+        self.max_bytes = app.config.get('STATIC_CACHE_MAX_BYTES', self.max_bytes)
+        app.extensions['static_assets'] = self
+        self.scan()
+
+    def __len__(self) -> int:
+        return len(self._assets)
+
+    def get(self, name: str) -> Optional[StaticAsset]:
+        return self._assets.get(name)
+
+    def scan(self) -> int:
+        """Rebuild the manifest and swap it in whole; returns the file count"""
+        assets: Dict[str, StaticAsset] = {}
+        budget = self.max_bytes
+        if self.folder and os.path.isdir(self.folder):
+            names = []
+            for directory, subdirectories, files in os.walk(self.folder):
+                subdirectories[:] = sorted(d for d in subdirectories if not d.startswith('.'))
+                for file_name in sorted(files):
+                    if not file_name.startswith('.'):
+                        names.append(os.path.relpath(os.path.join(directory, file_name), self.folder)
+                                     .replace(os.sep, '/'))
+            present = set(names)
+            # The SPA shell first, so it is always in memory
+            names.sort(key=lambda name: name != INDEX_FILE)
+            for name in names:
+                try:
+                    asset, used = self._load(name, present, budget)
+                except OSError as e:
+                    logger.warning('skipping static file %s: %s', name, e)
+                    continue
+                assets[name] = asset
+                budget -= used
+        self._assets = assets
+        logger.info('static assets: %d files, %d bytes in memory', len(assets), self.max_bytes - budget)
+        return len(assets)
+
+    def _load(self, name: str, present, budget: int) -> Tuple[StaticAsset, int]:
+        path = os.path.join(self.folder, *name.split('/'))
+        size = os.path.getsize(path)
+        mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        in_memory = size <= self.max_file_size and size <= budget
+
+        body = None
+        if in_memory:
+            with open(path, 'rb') as f:
+                body = f.read()
+            etag = hashlib.sha1(body).hexdigest()
+        else:
+            etag = _digest(path)
+        asset = StaticAsset(name, path, mimetype, size, etag, bool(_HASHED_NAME.search(name)))
+        asset.body = body
+        used = size if in_memory else 0
+
+        for encoding, suffix in ENCODINGS:
+            variant_path = path + suffix
+            if name + suffix in present:
+                variant_size = os.path.getsize(variant_path)
+                if in_memory and used + variant_size <= budget:
+                    with open(variant_path, 'rb') as f:
+                        asset.variants[encoding] = (f.read(), variant_path)
+                    used += variant_size
+                else:
+                    asset.variants[encoding] = (None, variant_path)
+            elif in_memory and size >= MIN_COMPRESS_SIZE and _is_compressible(mimetype):
+                if encoding == 'gzip':
+                    encoded = gzip.compress(body, compresslevel=9, mtime=0)
+                elif brotli is not None:
+                    encoded = brotli.compress(body, quality=11)
+                else:
+                    continue
+                if len(encoded) < size * 0.9 and used + len(encoded) <= budget:
+                    asset.variants[encoding] = (encoded, path)
+                    used += len(encoded)
+        return asset, used
+
+    def response(self, asset: StaticAsset) -> Response:
+        """Serve asset for the current request, honouring Accept-Encoding and If-None-Match"""
+        accepted = request.accept_encodings
+        encoding = next((encoding for encoding, _ in ENCODINGS
+                         if encoding in asset.variants and accepted[encoding]), None)
+        # Only the validator of the variant this request gets can match
+        etag = asset.etag_for(encoding)
+        if etag in request.if_none_match:
+            response = Response(status=304)
+        elif encoding is None:
+            if asset.body is not None:
+                response = Response(asset.body, mimetype=asset.mimetype)
+            else:
+                response = send_file(asset.path, mimetype=asset.mimetype, etag=False, conditional=False)
+        else:
+            body, variant_path = asset.variants[encoding]
+            if body is not None:
+                response = Response(body, mimetype=asset.mimetype)
+            else:
+                response = send_file(variant_path, mimetype=asset.mimetype, etag=False, conditional=False)
+            response.headers['Content-Encoding'] = encoding
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = asset.cache_control
+        if asset.variants:
+            response.vary.add('Accept-Encoding')
+        return response
+
+
+static_assets = StaticAssets()
@@ -0,0 +1,407 @@
+import atexit
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import nullcontext
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import bindparam
+from sqlalchemy.exc import OperationalError
+from chatbot import db, ChatMessage, UserSession
+import analytics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FLUSH_INTERVAL = 0.5   # seconds between background flushes
+DEFAULT_BATCH_SIZE = 500       # rows per transaction; a full batch flushes early
+DEFAULT_MAX_PENDING = 10000    # queued chat messages before writers block
+DEFAULT_PUT_TIMEOUT = 1.0      # seconds a writer blocks on a full queue
+DEFAULT_DURABLE_TIMEOUT = 5.0  # seconds a durable write waits for its commit
+DEFAULT_STOP_RETRIES = 3       # failed flushes while stopping before rows are spilled
+DEFAULT_BATCH_RETRIES = 3      # failed attempts at a batch before its rows are inserted one by one
+SPILL_PATTERN = 'chat-messages-*.ndjson'
+REJECTED_PATTERN = 'rejected-chat-messages-*.ndjson'   # never replayed; kept for inspection
+
+
+class WriteBehindQueue:
+    """
+    Optional write-behind pipeline for chat logging and session activity.
+
+    ChatMessage rows are queued and bulk-inserted by a background thread in
+    batched transactions; UserSession.last_active updates are coalesced so
+    each session is written at most once per flush. The queue is bounded:
+    when full, writers block for put_timeout and then fall back to a
+    synchronous write. Pending work is drained on stop() and at exit.
+
+    A durable write (e.g. an emergency message) forces a flush and returns
+    only after the transaction holding it has committed.
+
+    If the database still rejects a flush after stop_retries attempts while
+    stopping, the remaining messages are appended and fsynced to a file in
+    spill_dir (counting as written for durable waiters) and inserted by the
+    next process to start; a durable waiter whose rows could not be spilled
+    either gets a RuntimeError. Coalesced activity updates are dropped then.
+
+    A batch the database keeps rejecting is retried batch_retries times and
+    then inserted row by row, so one bad row cannot hold up the rest. Rows
+    that still fail with anything but an OperationalError (which means the
+    database itself is unavailable) are logged and appended to a rejected
+    file in spill_dir.
+    """
+
+    def __init__(self, app=None, **options):
+        self.app = None
+        self.flush_interval = options.get('flush_interval', DEFAULT_FLUSH_INTERVAL)
+        self.batch_size = options.get('batch_size', DEFAULT_BATCH_SIZE)
+        self.max_pending = options.get('max_pending', DEFAULT_MAX_PENDING)
+        self.put_timeout = options.get('put_timeout', DEFAULT_PUT_TIMEOUT)
+        self.durable_timeout = options.get('durable_timeout', DEFAULT_DURABLE_TIMEOUT)
+        self.stop_retries = options.get('stop_retries', DEFAULT_STOP_RETRIES)
+        self.batch_retries = options.get('batch_retries', DEFAULT_BATCH_RETRIES)
+        self.spill_dir: Optional[str] = options.get('spill_dir')
+
+        self._messages: List[Dict] = []
+        self._activity: Dict[str, datetime] = {}
+        self._cond = threading.Condition()
+        self._enqueued = 0   # sequence number of the last queued message
+        self._flushed = 0    # sequence number of the last committed message
+        self._abandoned = 0  # sequence number of the last message given up on at shutdown
+        self._flush_requested = False
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """
+        Configure from app.config, insert messages spilled by an earlier
+        shutdown (WRITE_BEHIND_SPILL_DIR) and start the writer thread if
+        WRITE_BEHIND_ENABLED is set.
+        """
+        self.app = app
+        config = app.config
+        self.flush_interval = config.get('WRITE_BEHIND_FLUSH_INTERVAL', self.flush_interval)
+        self.batch_size = config.get('WRITE_BEHIND_BATCH_SIZE', self.batch_size)
+        self.max_pending = config.get('WRITE_BEHIND_MAX_PENDING', self.max_pending)
+        self.put_timeout = config.get('WRITE_BEHIND_PUT_TIMEOUT', self.put_timeout)
+        self.durable_timeout = config.get('WRITE_BEHIND_DURABLE_TIMEOUT', self.durable_timeout)
+        self.stop_retries = config.get('WRITE_BEHIND_STOP_RETRIES', self.stop_retries)
+        self.batch_retries = config.get('WRITE_BEHIND_BATCH_RETRIES', self.batch_retries)
+        self.spill_dir = config.get('WRITE_BEHIND_SPILL_DIR') or self.spill_dir or \
+            os.path.join(app.root_path, 'database', 'spill')
+        app.extensions['write_behind'] = self
+        try:
+            self.replay_spilled()
+        except Exception:
+            logger.exception('could not insert spilled chat messages from %s; will retry at next start',
+                             self.spill_dir)
+        if config.get('WRITE_BEHIND_ENABLED'):
+            self.start()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        if self.running:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+        UserSession.activity_writer = self
+        atexit.register(self.stop)
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stop the writer thread after draining everything queued"""
+        if not self.running:
+            return
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        self._thread = None
+        if UserSession.activity_writer is self:
+            UserSession.activity_writer = None
+
+    def pending(self) -> int:
+        """Number of chat messages waiting to be written"""
+        return len(self._messages)
+
+    def log_message(self, session_id: str, message: str, response: str = None, intent: str = None,
+                    created_at: datetime = None, durable: bool = False):
+        """Queue a ChatMessage row; with durable=True, return once it is committed"""
+        self.log_messages([{
+            'user_session_id': session_id,
+            'message': message,
+            'response': response,
+            'intent': intent,
+            'created_at': created_at or datetime.utcnow()
+        }], durable)
+
+    def log_messages(self, rows: List[Dict], durable: bool = False):
+        """
+        Queue ChatMessage rows (dicts of its columns, created_at set). When
+        the queue is not running they are written now in one transaction.
+        With durable=True, return once all of them are committed.
+        """
+        if not rows:
+            return
+        if not self.running:
+            self._write(rows, {})
+            return
+
+        overflow = []
+        sequence = 0
+        with self._cond:
+            deadline = time.monotonic() + self.put_timeout
+            for row in rows:
+                while len(self._messages) >= self.max_pending and not self._stopping:
+                    self._flush_requested = True
+                    self._cond.notify_all()
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+
+                if len(self._messages) < self.max_pending and not self._stopping:
+                    self._messages.append(row)
+                    self._enqueued += 1
+                    sequence = self._enqueued
+                else:
+                    overflow.append(row)
+            if sequence and (durable or len(self._messages) >= self.batch_size):
+                self._flush_requested = True
+                self._cond.notify_all()
+
+        if overflow:
+            # Backpressure: the queue stayed full, so write on the caller's thread
+            self._write(overflow, {})
+
+        if durable and sequence:
+            with self._cond:
+                if not self._cond.wait_for(lambda: self._flushed >= sequence or self._abandoned >= sequence,
+                                           self.durable_timeout):
+                    raise TimeoutError('durable chat message was not committed in time')
+                if self._flushed < sequence:
+                    raise RuntimeError('durable chat message could not be written or spilled at shutdown')
+
+    def touch_session(self, session_id: str, at: datetime = None) -> bool:
+        """
+        Record session activity to be written on the next flush.
+        Returns False when the queue is not running and the caller must write it.
+        """
+        if not self.running:
+            return False
+        at = at or datetime.utcnow()
+        with self._cond:
+            current = self._activity.get(session_id)
+            if current is None or at > current:
+                self._activity[session_id] = at
+        return True
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Ask the writer thread to flush now and wait for everything queued so far"""
+        if not self.running:
+            return True
+        with self._cond:
+            target = self._enqueued
+            self._flush_requested = True
+            self._cond.notify_all()
+            self._cond.wait_for(lambda: self._flushed >= target or self._abandoned >= target, timeout)
+            return self._flushed >= target
+
+    def _run(self):
+        failures = 0
+        while True:
+            with self._cond:
+                if not (self._flush_requested or self._stopping):
+                    self._cond.wait(self.flush_interval)
+                self._flush_requested = False
+                messages, self._messages = self._messages, []
+                activity, self._activity = self._activity, {}
+                last_sequence = self._enqueued
+                stopping = self._stopping
+
+            chunks = [messages[start:start + self.batch_size] for start in range(0, len(messages), self.batch_size)]
+            try:
+                while chunks:
+                    if failures >= self.batch_retries:
+                        self._write_each(chunks[0])
+                        failures = 0
+                    else:
+                        self._write(chunks[0], {})
+                    chunks.pop(0)
+                if activity:
+                    self._write([], activity)
+            except Exception:
+                logger.exception('write-behind flush failed; will retry')
+                with self._cond:
+                    self._messages = [row for chunk in chunks for row in chunk] + self._messages
+                    for session_id, at in activity.items():
+                        current = self._activity.get(session_id)
+                        if current is None or at > current:
+                            self._activity[session_id] = at
+                failures += 1
+                if stopping and failures > self.stop_retries:
+                    self._abandon()
+                    return
+                time.sleep(self.flush_interval)
+                continue
+
+            failures = 0
+            with self._cond:
+                self._flushed = last_sequence
+                self._cond.notify_all()
+                if stopping and not self._messages and not self._activity:
+                    return
+
+    def _abandon(self):
+        """Give up on the database while stopping: spill what is queued and release durable waiters"""
+        with self._cond:
+            messages, self._messages = self._messages, []
+            self._activity = {}
+            last_sequence = self._enqueued
+        spilled = False
+        if messages:
+            try:
+                path = self._spill(messages)
+                spilled = True
+                logger.error('database unavailable at shutdown; spilled %d chat messages to %s',
+                             len(messages), path)
+            except OSError:
+                logger.exception('database unavailable at shutdown; lost %d chat messages', len(messages))
+        with self._cond:
+            if spilled or not messages:
+                self._flushed = last_sequence
+            else:
+                self._abandoned = last_sequence
+            self._cond.notify_all()
+
+    def _spill(self, messages: List[Dict], pattern: str = SPILL_PATTERN) -> str:
+        os.makedirs(self.spill_dir, exist_ok=True)
+        path = os.path.join(self.spill_dir, pattern.replace('*', str(os.getpid())))
+        lines = ''.join(json.dumps(dict(row, created_at=row['created_at'].isoformat())) + '\n'
+                        for row in messages)
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        return path
+
+    def replay_spilled(self) -> int:
+        """Insert chat messages spilled at an earlier shutdown and remove their files; returns the count"""
+        if not self.spill_dir:
+            return 0
+        replayed = 0
+        for path in sorted(glob.glob(os.path.join(self.spill_dir, SPILL_PATTERN))):
+            with open(path, encoding='utf-8') as f:
+                rows = [json.loads(line) for line in f if line.strip()]
+            for row in rows:
+                row['created_at'] = datetime.fromisoformat(row['created_at'])
+            try:
+                self._write(rows, {})
+            except OperationalError:
+                raise
+            except Exception:
+                self._write_each(rows)
+            os.remove(path)
+            replayed += len(rows)
+            logger.info('inserted %d chat messages spilled to %s', len(rows), path)
+        return replayed
+
+    def _write(self, messages: List[Dict], activity: Dict[str, datetime]):
+        """Insert messages and apply activity updates in batch_size transactions"""
+        with self.app.app_context() if self.app is not None else nullcontext():
+            try:
+                for start in range(0, len(messages), self.batch_size):
+                    batch = messages[start:start + self.batch_size]
+                    db.session.execute(ChatMessage.__table__.insert(), batch)
+                    analytics.count_messages(batch)
+                    db.session.commit()
+
+                table = UserSession.__table__
+                update = table.update().where(table.c.id == bindparam('session_id')).values(
+                    last_active=bindparam('last_active')
+                )
+                rows = [{'session_id': session_id, 'last_active': at} for session_id, at in activity.items()]
+                for start in range(0, len(rows), self.batch_size):
+                    db.session.execute(update, rows[start:start + self.batch_size])
+                    db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+    def _write_each(self, messages: List[Dict]):
+        """
+        Insert messages one per transaction, removing each from the list once
+        handled. Rows the database rejects are set aside; an OperationalError
+        is raised, leaving the rest in the list.
+        """
+        rejected = []
+        with self.app.app_context() if self.app is not None else nullcontext():
+            while messages:
+                row = messages[0]
+                try:
+                    db.session.execute(ChatMessage.__table__.insert(), [row])
+                    analytics.count_messages([row])
+                    db.session.commit()
+                except OperationalError:
+                    db.session.rollback()
+                    raise
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error('database rejected chat message for session %s: %s',
+                                 row.get('user_session_id'), getattr(e, 'orig', None) or e)
+                    rejected.append(row)
+                messages.pop(0)
+        if rejected:
+            try:
+                logger.error('set aside %d rejected chat messages in %s',
+                             len(rejected), self._spill(rejected, REJECTED_PATTERN))
+            except Exception:
+                logger.exception('could not set aside rejected chat messages: %r', rejected)
+
+    def _after_fork(self):
+        """A forked child starts with an empty queue and, if needed, its own writer thread"""
+        was_running = self.running
+        self._messages = []
+        self._activity = {}
+        self._cond = threading.Condition()
+        self._enqueued = self._flushed = self._abandoned = 0
+        self._flush_requested = False
+        self._stopping = False
+        self._thread = None
+        if was_running:
+            self.start()
+
+
+write_behind = WriteBehindQueue()
+os.register_at_fork(after_in_child=write_behind._after_fork)
+
+
+def log_chat_message(session_id: str, message: str, response: str = None, intent: str = None,
+                     durable: Optional[bool] = None):
+    """
+    Log a chat exchange through the write-behind queue. Emergency messages
+    are durable by default.
+    """
+    if durable is None:
+        durable = intent == 'emergency'
+    write_behind.log_message(session_id, message, response, intent, durable=durable)
+
+
+def log_chat_messages(exchanges: Iterable[Tuple[str, str, Optional[str], Optional[str]]]):
+    """
+    Log (session_id, message, response, intent) exchanges together, in one
+    transaction when the queue is not running. Durable if any of them is
+    an emergency.
+    """
+    now = datetime.utcnow()
+    rows = [{'user_session_id': session_id, 'message': message, 'response': response, 'intent': intent,
+             'created_at': now} for session_id, message, response, intent in exchanges]
+    write_behind.log_messages(rows, durable=any(row['intent'] == 'emergency' for row in rows))